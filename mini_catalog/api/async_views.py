@@ -0,0 +1,228 @@
+"""
+Async GET handlers for the hot read paths, served under ASGI (`catalog/asgi.py`).
+
+Under ASGI a sync DRF view holds a worker thread for the whole request:
+authentication, queries, serialization and rendering. The handlers here
+run on the event loop and only hand the individual queries to Django's async
+ORM (aget, afirst, aiterator), so a slow or waiting request no longer
+occupies a thread.
+
+Each route stays a DRF view. `hybrid()` serves the plain GET with its async
+handler and leaves everything else to the DRF view: writes, search,
+filters and ordering, the browsable API, and invalid tokens or cursors.
+A handler returns None to defer, for example when a Stats row still has to
+be reconciled. Responses match the sync views and share the anonymous catalog
+cache (api/cache.py). By default (ASYNC_READ_VIEWS = None) the async path is
+on only when the ASGI application (`catalog/asgi.py`) is loaded: under WSGI
+every async view would need an event loop of its own per request. True or
+False forces it either way. `manage.py benchmark_async` compares the two paths.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .cache import acatalog_version, cache_headers, not_modified, response_key, response_timeout, user_interests
+from .models import Comment, Equipment, Stats
+from .pagination import KeysetPagination
+from .serializers import CommentSerializer, EquipmentSerializer, NotificationSerializer
+from .views import CommentViewSet, EquipmentViewSet, NotificationListView, global_stats, inbox, personalise, \
+    user_stats
+
+PAGE_PARAMS = {'cursor', 'page_size'}
+
+# Set by serve_asgi(), before the URLconf is loaded.
+asgi = False
+
+
+def serve_asgi():
+    global asgi
+    asgi = True
+
+
+def enabled():
+    value = getattr(settings, 'ASYNC_READ_VIEWS', None)
+    return asgi if value is None else value
+
+
+def hybrid(sync_view, handler):
+    """URL callback serving GET with `handler` and every other request with `sync_view`."""
+    if not enabled():
+        return sync_view
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET' and enabled() and wants_json(request):
+            response = await handler(request, *args, **kwargs)
+            if response is not None:
+                return response
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+    # What the DRF view exposes to CSRF, routers and the endpoint benchmark.
+    view.csrf_exempt = True
+    for name in ('cls', 'initkwargs', 'actions'):
+        if hasattr(sync_view, name):
+            setattr(view, name, getattr(sync_view, name))
+    return view
+
+
+def wants_json(request):
+    # The browsable API stays with DRF.
+    return 'format' not in request.GET and 'text/html' not in request.headers.get('Accept', '')
+
+
+def plain(request, allowed=PAGE_PARAMS):
+    """True when the query string has nothing the DRF filter backends would act on."""
+    return set(request.GET) <= allowed
+
+
+async def authenticate(request):
+    """
+    The request wrapped for DRF with `user` resolved by the same
+    authenticators, or None when the credentials are invalid (the DRF view
+    answers 401).
+    """
+    request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        if request.META.get('HTTP_AUTHORIZATION'):
+            # The token's user is loaded from the database.
+            await sync_to_async(getattr)(request, 'user')
+        else:
+            request.user
+    except APIException:
+        return None
+    return request
+
+
+def render(data, status=200):
+    # What APIView.finalize_response() produces for a JSON client.
+    response = Response(data, status=status)
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = JSONRenderer.media_type
+    response.renderer_context = {}
+    patch_vary_headers(response, ('Accept',))
+    return response.render()
+
+
+async def paginate(request, queryset, view, serializer_class):
+    paginator = KeysetPagination()
+    try:
+        page = await paginator.apaginate_queryset(queryset, request, view=view)
+    except NotFound:
+        return None
+    data = serializer_class(page, many=True, context={'request': request}).data
+    return paginator.get_paginated_response(data).data
+
+
+async def cached(request, produce):
+    """Anonymous catalog responses: same keys and ETags as CatalogCacheMixin."""
+    key = response_key(await acatalog_version(), request, JSONRenderer.media_type)
+    etag = f'"{key}"'
+    if not_modified(request, etag):
+        return cache_headers(render(None, status=304), etag)
+    data = await cache.aget(f'catalog:response:{key}')
+    if data is None:
+        data = await produce()
+        if data is None:
+            return None
+        await cache.aset(f'catalog:response:{key}', data, response_timeout())
+    return cache_headers(render(data), etag)
+
+
+# -----------------------
+# Items
+# -----------------------
+async def items_for(request):
+    user = request.user
+    queryset = Equipment.objects.with_related()
+    if user.is_authenticated:
+        queryset = personalise(queryset, *await sync_to_async(user_interests)(user.id))
+    return queryset.distinct()
+
+
+async def item_list(request):
+    request = await authenticate(request)
+    if request is None or not plain(request):
+        return None
+
+    async def produce():
+        return await paginate(request, await items_for(request), EquipmentViewSet, EquipmentSerializer)
+
+    if not request.user.is_authenticated:
+        return await cached(request, produce)
+    data = await produce()
+    return render(data) if data is not None else None
+
+
+async def item_detail(request, pk):
+    request = await authenticate(request)
+    if request is None or not plain(request, allowed=set()):
+        return None
+
+    async def produce():
+        queryset = await items_for(request)
+        try:
+            item = await queryset.aget(pk=pk)
+        except Equipment.DoesNotExist:
+            # DRF renders the 404.
+            return None
+        return EquipmentSerializer(item, context={'request': request}).data
+
+    if not request.user.is_authenticated:
+        return await cached(request, produce)
+    data = await produce()
+    return render(data) if data is not None else None
+
+
+async def comment_list(request, equipment_id):
+    request = await authenticate(request)
+    if request is None or not plain(request):
+        return None
+    # The author is rendered with str(), which must not load it lazily here.
+    queryset = Comment.objects.with_related().filter(item_id=equipment_id)
+    data = await paginate(request, queryset, CommentViewSet, CommentSerializer)
+    return render(data) if data is not None else None
+
+
+# -----------------------
+# Stats and notifications (authenticated only; DRF answers 401)
+# -----------------------
+async def authenticated(request):
+    request = await authenticate(request)
+    return request if request is not None and request.user.is_authenticated else None
+
+
+async def user_stats_view(request, id):
+    if await authenticated(request) is None:
+        return None
+    row = await Stats.objects.filter(user_id=id).afirst()
+    # A missing row is reconciled (or 404'd) by the sync view.
+    return render(user_stats(row)) if row is not None else None
+
+
+async def global_stats_view(request):
+    if await authenticated(request) is None:
+        return None
+    row = await Stats.objects.filter(user__isnull=True).afirst()
+    return render(global_stats(row)) if row is not None else None
+
+
+async def notification_list(request):
+    request = await authenticated(request)
+    if request is None or not plain(request, allowed=PAGE_PARAMS | {'unread'}):
+        return None
+    data = await paginate(request, inbox(request.user.id, request.GET), NotificationListView,
+                          NotificationSerializer)
+    return render(data) if data is not None else None
+
+
+async def unread_count(request):
+    request = await authenticated(request)
+    if request is None:
+        return None
+    unread = await Stats.objects.filter(user_id=request.user.id).values_list('unread_notifications', flat=True).afirst()
+    return render({"unread": unread}) if unread is not None else None
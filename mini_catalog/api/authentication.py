@@ -0,0 +1,118 @@
+"""
+JWT authentication with the user (and profile) cached in process memory.
+
+JWTAuthentication loads the user with a SELECT on every request, and views
+reading `request.user.profile` add another. CachedJWTAuthentication keeps
+recently seen users, with their profile attached, in a bounded LRU
+(JWT_USER_CACHE_SIZE entries, each valid JWT_USER_CACHE_TTL seconds), so a
+repeat request usually authenticates without a query. The token checks
+(inactive user, revoked token) still run on every request.
+
+Signals on User and Profile (api/signals.py) drop a user's entry when either
+changes or is deleted, which covers deactivation. Each process has its own
+cache and only sees its own signals: a change made elsewhere, or through
+QuerySet.update(), shows up here once the entry expires.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import Profile
+
+
+class UserCache:
+    """Thread-safe LRU of users by id (as a string, the way tokens carry it) whose entries expire."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Bumped by every discard, so a user loaded before it is not stored after it.
+        self.generation = 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user, generation):
+        ttl = getattr(settings, 'JWT_USER_CACHE_TTL', 60)
+        size = getattr(settings, 'JWT_USER_CACHE_SIZE', 10000)
+        with self.lock:
+            if generation != self.generation or ttl <= 0 or size <= 0:
+                return
+            self.entries[user_id] = (user, time.monotonic() + ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+users = UserCache()
+
+
+def forget_user(user_id):
+    # Dropped now, and again on commit so a request that re-read the old row
+    # before the commit cannot keep it cached.
+    user_id = str(user_id)
+    users.discard(user_id)
+    transaction.on_commit(lambda: users.discard(user_id))
+
+
+def _copy(user):
+    # Each request gets its own instances; the cached ones are never mutated.
+    user = copy.copy(user)
+    cached = user._state.fields_cache
+    for name, related in cached.items():
+        cached[name] = copy.copy(related)
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user_id = str(user_id) if user_id is not None else None
+        user = users.get(user_id) if user_id is not None else None
+        if user is None:
+            generation = users.generation
+            user = super().get_user(validated_token)
+            # Attached as the reverse one-to-one cache, so `user.profile` needs no query.
+            profile = Profile.objects.filter(user=user).first()
+            if profile is not None:
+                user.profile = profile
+            users.set(user_id, user, generation)
+        else:
+            self.check_user(user, validated_token)
+        return _copy(user)
+
+    def check_user(self, user, validated_token):
+        # The checks JWTAuthentication.get_user() makes after loading the user.
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
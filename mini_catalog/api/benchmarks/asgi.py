@@ -0,0 +1,117 @@
+"""
+Sync against async views under ASGI (`manage.py benchmark_async`).
+
+Drives the ASGI application with many concurrent requests and compares the
+throughput of the async read views (api/async_views.py) with the sync DRF
+views on the same routes. Importing `catalog.asgi` installs the async views,
+as serving it does, so this module has to load before the URLconf does.
+"""
+import asyncio
+import re
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from catalog.asgi import application
+
+from ..models import Equipment
+from .common import allowed_host, git_revision, summarize
+from .endpoints import PATH_PARAM_RE, concrete_path, default_samples
+
+ASYNC_ROUTES = [
+    'api/items/', 'api/items/<pk>/', 'api/items/<equipment_id>/comments/', 'api/users/<id>/stats/',
+    'api/stats/', 'api/notifications/', 'api/notifications/unread-count/',
+]
+
+
+async def asgi_get(app, path, headers):
+    """One GET through the ASGI application, as a server would send it; returns the status."""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+        'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('127.0.0.1', 80),
+    }
+    received = asyncio.Event()
+    status = []
+
+    async def receive():
+        if not received.is_set():
+            received.set()
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Nothing else to send; the handler stops listening once it has responded.
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def throughput(app, path, headers, requests, concurrency):
+    """Send `requests` GETs from `concurrency` concurrent clients."""
+    pending = iter(range(requests))
+    seconds, statuses = [], Counter()
+
+    async def client():
+        for _ in pending:
+            started = time.perf_counter()
+            statuses[await asgi_get(app, path, headers)] += 1
+            seconds.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests_per_second': round(requests / elapsed, 1),
+        **summarize(seconds),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def compare(requests=500, concurrency=50, warmup=20, username=None, anonymous=False, only=None):
+    samples = default_samples(username)
+    headers = [(b'host', allowed_host().encode())]
+    if not anonymous and samples['user'] is not None:
+        token = AccessToken.for_user(samples['user'])
+        headers.append((b'authorization', f'Bearer {token}'.encode()))
+    app = application
+
+    results, skipped = [], []
+    for route in ASYNC_ROUTES:
+        if only and not re.search(only, route):
+            continue
+        path = concrete_path(route, PATH_PARAM_RE.findall(route), samples)
+        if path is None:
+            skipped.append(route)
+            continue
+        row = {'route': route, 'path': path}
+        for mode, enabled in (('sync', False), ('async', True)):
+            with override_settings(ASYNC_READ_VIEWS=enabled):
+                if warmup:
+                    asyncio.run(throughput(app, path, headers, warmup, min(warmup, concurrency)))
+                row[mode] = asyncio.run(throughput(app, path, headers, requests, concurrency))
+        row['speedup'] = round(row['async']['requests_per_second'] / row['sync']['requests_per_second'], 2)
+        results.append(row)
+
+    return {
+        'revision': git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'requests': requests,
+        'concurrency': concurrency,
+        'authenticated_as': None if len(headers) == 1 else samples['user'].username,
+        'rows': {
+            'users': User.objects.count(),
+            'items': Equipment.objects.count(),
+        },
+        'endpoints': results,
+        'skipped': skipped,
+    }
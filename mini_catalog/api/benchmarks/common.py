@@ -0,0 +1,65 @@
+"""
+Measurement helpers shared by the benchmarks.
+"""
+import subprocess
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'mean_ms': round(sum(ms) / len(ms), 3),
+    }
+
+
+def timed(call, iterations, warmup=0):
+    for _ in range(warmup):
+        call()
+    seconds = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def profile(call):
+    """Run `call` once; return (its result, SQL query count, peak traced memory in KiB)."""
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as ctx:
+            result = call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, len(ctx.captured_queries), round(peak / 1024, 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def allowed_host():
+    # localhost is what an empty ALLOWED_HOSTS accepts with DEBUG on.
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*']
+    return hosts[0] if hosts else 'localhost'
@@ -0,0 +1,146 @@
+"""
+In-process latency benchmark of the API (`manage.py benchmark_endpoints`).
+
+Every GET endpoint under /api/ is discovered from the URLconf, its path
+parameters are filled with ids from the current database (see
+`manage.py seed_data`), and it is called through the Django test client, so
+middleware, authentication, pagination and rendering are all included.
+Timed runs are not instrumented; one extra run per endpoint counts SQL
+queries and records peak Python memory with tracemalloc. The JSON report
+carries the git revision so runs can be compared across commits.
+"""
+import re
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ..models import Equipment, EquipmentList, Stats
+from .common import allowed_host, git_revision, profile, summarize, timed
+
+PREFIX = 'api/'
+PATH_PARAM_RE = re.compile(r'<(?:\w+:)?(\w+)>')
+REGEX_PARAM_RE = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+
+# -----------------------
+# Endpoint discovery
+# -----------------------
+def _walk(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _walk(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            yield prefix + str(pattern.pattern), pattern.callback
+
+
+def _handles_get(callback):
+    actions = getattr(callback, 'actions', None)
+    if actions is not None:
+        return 'get' in actions
+    view_class = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None)
+    return view_class is not None and hasattr(view_class, 'get')
+
+
+def discover():
+    """(route, parameter names) of every GET endpoint under /api/, without format suffixes."""
+    for route, callback in _walk(get_resolver().url_patterns):
+        route = route.replace('^', '').replace('$', '')
+        if not route.startswith(PREFIX) or not _handles_get(callback):
+            continue
+        names = PATH_PARAM_RE.findall(route) + REGEX_PARAM_RE.findall(route)
+        if 'format' in names:
+            continue
+        route = REGEX_PARAM_RE.sub(lambda m: f'<{m.group(1)}>', route)
+        route = PATH_PARAM_RE.sub(lambda m: f'<{m.group(1)}>', route)
+        yield route, names
+
+
+def default_samples(username=None):
+    """Ids to fill path parameters with: the most active user and the most liked item."""
+    if username:
+        user = User.objects.get(username=username)
+    else:
+        busiest = Stats.objects.filter(user__isnull=False).order_by('-items', '-follows').first()
+        user = busiest.user if busiest else User.objects.order_by('pk').first()
+    return {
+        'user': user,
+        'item': Equipment.objects.order_by('-like_count', '-pk').first(),
+        'list': EquipmentList.objects.filter(user=user).first() if user else None,
+    }
+
+
+def sample_value(route, name, samples):
+    resource = route[len(PREFIX):].split('/', 1)[0]
+    if name in ('item_id', 'equipment_id') or (name == 'pk' and resource == 'items'):
+        obj = samples['item']
+    elif name in ('list_id',) or (name == 'pk' and resource == 'lists'):
+        obj = samples['list']
+    elif name in ('user_id', 'id') and resource == 'users':
+        obj = samples['user']
+    else:
+        return None
+    return obj.pk if obj is not None else None
+
+
+def concrete_path(route, names, samples):
+    values = {name: sample_value(route, name, samples) for name in names}
+    if None in values.values():
+        return None
+    return '/' + PATH_PARAM_RE.sub(lambda m: str(values[m.group(1)]), route)
+
+
+# -----------------------
+# Runner
+# -----------------------
+def run(iterations=50, warmup=5, username=None, anonymous=False, cold=False, only=None):
+    samples = default_samples(username)
+    client = APIClient(SERVER_NAME=allowed_host(), raise_request_exception=False)
+    if not anonymous and samples['user'] is not None:
+        client.force_authenticate(samples['user'])
+
+    results, skipped, seen = [], [], set()
+    for route, names in discover():
+        if only and not re.search(only, route):
+            continue
+        path = concrete_path(route, names, samples)
+        if path is None:
+            skipped.append(route)
+            continue
+        # A shadowed duplicate route resolves to the first pattern anyway.
+        if path in seen:
+            continue
+        seen.add(path)
+
+        def call():
+            if cold:
+                cache.clear()
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response
+
+        seconds = timed(call, iterations, warmup)
+        response, queries, peak_kb = profile(call)
+        results.append({
+            'route': route, 'path': path, 'status': response.status_code,
+            **summarize(seconds), 'queries': queries, 'peak_memory_kb': peak_kb,
+        })
+
+    return {
+        'revision': git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'iterations': iterations,
+        'authenticated_as': None if anonymous or samples['user'] is None else samples['user'].username,
+        'cold_cache': cold,
+        'rows': {
+            'users': User.objects.count(),
+            'items': Equipment.objects.count(),
+        },
+        'endpoints': results,
+        'skipped': skipped,
+    }
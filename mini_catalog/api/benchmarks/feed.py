@@ -0,0 +1,111 @@
+"""
+Following feed benchmark (`manage.py benchmark_feed`).
+
+Creates a reader following thousands of authors and compares the following
+feed (api/feed.py) with a join over all followees. Its data is written in a
+transaction that is rolled back.
+"""
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .. import feed
+from ..models import Equipment, Follow, Stats
+from ..pagination import KeysetPagination, MergedKeysetPagination
+from ..views import FeedView
+from .common import allowed_host, git_revision, profile, summarize, timed
+
+FEED_MARKER = 'benchmark_feed'
+
+
+def _feed_data(followees, items_per_author, popular, seed=0):
+    """A reader following `followees` authors, the first `popular` of them above the fan-out limit."""
+    rng = random.Random(seed)
+    password = make_password(None)
+    reader = User.objects.create(username=f'{FEED_MARKER}_reader', password=password)
+    authors = User.objects.bulk_create(
+        [User(username=f'{FEED_MARKER}_{i}', password=password) for i in range(followees)], batch_size=1000,
+    )
+    Stats.objects.bulk_create(
+        [Stats(user_id=author.pk, followers=feed.fanout_limit() + 1) for author in authors[:popular]],
+        batch_size=1000,
+    )
+    Follow.objects.bulk_create(
+        [Follow(follower_id=reader.pk, following_id=author.pk) for author in authors], batch_size=1000,
+    )
+    items = Equipment.objects.bulk_create(
+        [Equipment(name=FEED_MARKER, price_per_day=1, author_id=rng.choice(authors).pk)
+         for _ in range(followees * items_per_author)],
+        batch_size=1000,
+    )
+    # created_at is set on insert; spread the items out in time, newest last.
+    now = timezone.now()
+    for i, item in enumerate(items):
+        item.created_at = now - timezone.timedelta(seconds=len(items) - i)
+    Equipment.objects.bulk_update(items, ['created_at'], batch_size=500)
+    return reader
+
+
+def _feed_reader(reader_id, strategy):
+    """read(next link or None) -> (items of the page, next link)."""
+    factory = APIRequestFactory(SERVER_NAME=allowed_host())
+    followed = Follow.objects.filter(follower_id=reader_id).values('following_id')
+
+    def read(link):
+        request = Request(factory.get(link or '/api/feed/'))
+        if strategy == 'timeline':
+            paginator = MergedKeysetPagination()
+            page = feed.items(paginator.paginate_queryset(feed.sources(reader_id), request, view=FeedView))
+        else:
+            paginator = KeysetPagination()
+            queryset = Equipment.objects.with_related().filter(author_id__in=followed)
+            page = paginator.paginate_queryset(queryset, request)
+        return page, paginator.get_next_link()
+    return read
+
+
+def feed_comparison(followees=10000, items_per_author=2, popular=10, depth=10, iterations=50, warmup=5):
+    report = {
+        'revision': git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'followees': followees,
+        'popular_followees': popular,
+        'items': followees * items_per_author,
+        'fanout_max_followers': feed.fanout_limit(),
+        'reads': [],
+    }
+    with transaction.atomic():
+        started = time.perf_counter()
+        reader = _feed_data(followees, items_per_author, popular)
+        report['setup_s'] = round(time.perf_counter() - started, 2)
+        started = time.perf_counter()
+        report['timeline_rows'] = feed.rebuild([reader.pk])
+        report['rebuild_s'] = round(time.perf_counter() - started, 2)
+
+        pages = {}
+        for strategy in ('timeline', 'join'):
+            read = _feed_reader(reader.pk, strategy)
+            links = [None]
+            while len(links) < depth:
+                _, link = read(links[-1])
+                if link is None:
+                    break
+                links.append(link)
+            for number in sorted({1, len(links)}):
+                link = links[number - 1]
+                (page, _), queries, _ = profile(lambda: read(link))
+                pages[strategy, number] = [item.pk for item in page]
+                report['reads'].append({
+                    'strategy': strategy, 'page': number, 'queries': queries,
+                    **summarize(timed(lambda: read(link), iterations, warmup)),
+                })
+        report['same_results'] = all(ids == pages['join', number] for (_, number), ids in pages.items())
+        transaction.set_rollback(True)
+    return report
@@ -0,0 +1,167 @@
+"""
+SQLite contention benchmark (`manage.py benchmark_sqlite`).
+
+Reader and writer threads run under SQLite's default settings and under the
+tuned ones (api/sqlite.py, api/routers.py). Writers add comments and remove
+them afterwards, so the benchmark only runs on a scratch copy of the
+database file passed explicitly, never on the configured one. Every query
+runs in a thread of its own whose connections open the copy, so the
+caller's connection is left alone.
+"""
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .. import sqlite
+from ..models import Comment, Equipment
+from .common import git_revision, summarize
+
+CONTENTION_MARKER = 'benchmark_sqlite'
+
+
+def sqlite_profiles():
+    """Connection OPTIONS and routers per profile; the journal mode is reset by each one as it is a property of the file."""
+    tuned = {'OPTIONS': settings.DATABASES[DEFAULT_DB_ALIAS].get('OPTIONS', {}), 'DATABASE_ROUTERS': []}
+    profiles = {
+        # SQLite's own defaults, and the 5 s timeout of Python's sqlite3 module.
+        'default': {
+            'OPTIONS': {'init_command': (
+                'PRAGMA busy_timeout = 5000; PRAGMA journal_mode = delete; PRAGMA synchronous = full; '
+                'PRAGMA mmap_size = 0; PRAGMA cache_size = -2000'
+            )},
+            'DATABASE_ROUTERS': [],
+        },
+        'tuned': tuned,
+    }
+    read = getattr(settings, 'READ_DATABASE', 'read')
+    if read in settings.DATABASES:
+        profiles['tuned+read'] = {**tuned, 'DATABASE_ROUTERS': ['api.routers.ReadWriteRouter']}
+    return profiles
+
+
+@contextmanager
+def database_settings(alias, **values):
+    """Open new connections to `alias`, in every thread, with `values` in their settings."""
+    settings_dict = connections.settings[alias]
+    saved = {key: settings_dict[key] for key in values}
+    settings_dict.update(values)
+    try:
+        yield
+    finally:
+        settings_dict.update(saved)
+
+
+def scratch_path(database):
+    database = os.path.abspath(database)
+    if database == os.path.abspath(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME']):
+        raise ValueError("The benchmark writes to the database; pass a copy of it, not the configured file")
+    if not os.path.isfile(database):
+        raise ValueError(f"{database} does not exist; copy the database file and pass the copy")
+    return database
+
+
+def in_thread(call):
+    """Run `call` in a new thread, whose connections open the scratch database."""
+    def target():
+        try:
+            return call()
+        finally:
+            connections.close_all()
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(target).result()
+
+
+def _sample():
+    item_ids = list(Equipment.objects.order_by('pk').values_list('pk', flat=True)[:1000])
+    author_id = User.objects.order_by('pk').values_list('pk', flat=True).first()
+    if not item_ids or author_id is None:
+        raise ValueError("The database has no items or users; run seed_data first")
+    return item_ids, author_id
+
+
+def _contend(role, stop_at, item_ids, author_id, results):
+    seconds, errors = [], Counter()
+    rng = random.Random()
+    try:
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                if role == 'read':
+                    list(Equipment.objects.with_related().filter(public=True).order_by('-created_at', '-id')[:20])
+                else:
+                    # What a comment POST does: look the item up, then insert.
+                    with transaction.atomic():
+                        item = Equipment.objects.get(pk=rng.choice(item_ids))
+                        Comment.objects.create(item=item, author_id=author_id, text=CONTENTION_MARKER)
+            except OperationalError as exc:
+                errors[str(exc)] += 1
+                continue
+            seconds.append(time.perf_counter() - started)
+    finally:
+        connections.close_all()
+        results.append((role, seconds, errors))
+
+
+def contention(database, duration=5.0, readers=8, writers=4, only=None):
+    """Benchmark on `database`, the path of a scratch copy of the SQLite file."""
+    database = scratch_path(database)
+    report = []
+    with ExitStack() as stack:
+        for alias in connections.settings:
+            stack.enter_context(database_settings(alias, NAME=database))
+        item_ids, author_id = in_thread(_sample)
+
+        for name, overrides in sqlite_profiles().items():
+            if only and not re.search(only, name):
+                continue
+            with override_settings(DATABASE_ROUTERS=overrides['DATABASE_ROUTERS']), \
+                    database_settings(DEFAULT_DB_ALIAS, OPTIONS=overrides['OPTIONS']):
+                # The first connection switches the journal mode while nothing else is open.
+                pragmas = in_thread(lambda: sqlite.pragmas(connection))
+                results, threads = [], []
+                stop_at = time.perf_counter() + duration
+                for role, count in (('read', readers), ('write', writers)):
+                    threads += [
+                        threading.Thread(target=_contend, args=(role, stop_at, item_ids, author_id, results))
+                        for _ in range(count)
+                    ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            row = {'profile': name, 'pragmas': pragmas, 'errors': {}}
+            for role in ('read', 'write'):
+                seconds = [s for r, samples, _ in results if r == role for s in samples]
+                row[f'{role}s_per_second'] = round(len(seconds) / duration, 1)
+                row[role] = summarize(seconds) if seconds else None
+                for r, _, errors in results:
+                    if r == role:
+                        for message, count in errors.items():
+                            key = f'{role}: {message}'
+                            row['errors'][key] = row['errors'].get(key, 0) + count
+            report.append(row)
+            # Signals take the counters back down with the rows.
+            in_thread(lambda: Comment.objects.filter(author_id=author_id, text=CONTENTION_MARKER).delete())
+
+    return {
+        'revision': git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'scratch_database': database,
+        'duration_s': duration,
+        'readers': readers,
+        'writers': writers,
+        'profiles': report,
+    }
@@ -0,0 +1,147 @@
+"""
+Versioned caches for catalog reads.
+
+Anonymous responses:
+
+Every cache key includes the catalog version, a counter bumped by signals
+whenever an item, its tags/categories, likes or ratings change, so stale
+entries are never read again and simply expire. The same key doubles as a
+strong ETag: a conditional GET whose ETag still matches the current version
+is answered with 304 before any query or serializer runs.
+
+Per-user interests: the favourite item ids and their tag ids used to
+personalise EquipmentViewSet, cached under a per-user version that Favorite
+signals bump. Tag edits on favourited items are picked up when the entry
+expires (INTERESTS_CACHE_TIMEOUT).
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Equipment, Favorite
+
+VERSION_KEY = 'catalog:version'
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded with the clock so an evicted counter never restarts at a
+        # value that old entries were stored under.
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        version = await sync_to_async(catalog_version)()
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_catalog():
+    # Bumped right away so reads later in the same transaction miss, and again
+    # on commit so a concurrent reader that cached the pre-commit data under
+    # the first bump cannot keep serving it.
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+class CatalogCacheMixin:
+    """Cache `list` and `retrieve` of a viewset for anonymous GET requests."""
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        key = response_key(catalog_version(), request, request.accepted_media_type)
+        etag = f'"{key}"'
+
+        if not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = cache.get(f'catalog:response:{key}')
+            if data is not None:
+                response = Response(data)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(f'catalog:response:{key}', response.data, response_timeout())
+        return cache_headers(response, etag)
+
+
+# Shared with the async views (api/async_views.py), which read and fill the same entries.
+def response_key(version, request, media_type):
+    return hashlib.sha1('|'.join([
+        str(version), request.get_host(), request.get_full_path(), media_type or '',
+    ]).encode()).hexdigest()
+
+
+def response_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def not_modified(request, etag):
+    return etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+
+def cache_headers(response, etag):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept', 'Authorization'))
+    return response
+
+
+def _user_version_key(user_id):
+    return f'interests:version:{user_id}'
+
+
+def interests_version(user_id):
+    version = cache.get(_user_version_key(user_id))
+    if version is None:
+        cache.add(_user_version_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(_user_version_key(user_id))
+    return version
+
+
+def user_interests(user_id):
+    """Return (favourite item ids, tag ids of those items) for a user."""
+    version = interests_version(user_id)
+    key = f'interests:{user_id}:{version}'
+    interests = cache.get(key)
+    if interests is None:
+        favorite_ids = list(Favorite.objects.filter(user_id=user_id).values_list('item_id', flat=True))
+        tag_ids = list(
+            Equipment.tags.through.objects.filter(equipment_id__in=favorite_ids)
+            .values_list('tag_id', flat=True).distinct()
+        )
+        interests = (favorite_ids, tag_ids)
+        cache.set(key, interests, getattr(settings, 'INTERESTS_CACHE_TIMEOUT', 600))
+    return interests
+
+
+def invalidate_user_interests(user_id):
+    cache.set(_user_version_key(user_id), time.time_ns(), timeout=None)
@@ -0,0 +1,87 @@
+"""
+Constant-memory export of the catalog as NDJSON or CSV.
+
+Items are read with `iterator(chunk_size=...)`, which keeps one chunk in
+memory at a time and prefetches categories and tags per chunk, and each row
+is encoded and yielded immediately, so memory stays flat for any catalog size.
+
+Under ASGI a sync iterator would be read to the end into a list before the
+first byte is sent, so `async_lines()` hands the lines over in small batches
+through sync_to_async instead.
+"""
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from .models import Equipment
+
+CHUNK_SIZE = 1000
+# Lines per sync_to_async round trip when streaming under ASGI.
+ASYNC_BATCH = 200
+
+FIELDS = [
+    'id', 'name', 'price_per_day', 'available_from', 'description', 'public', 'created_at',
+    'author', 'categories', 'tags', 'like_count', 'rating_count', 'avg_rating',
+]
+
+
+def export_rows(queryset=None, chunk_size=CHUNK_SIZE):
+    if queryset is None:
+        queryset = Equipment.objects.all()
+    items = queryset.with_related().order_by('id').iterator(chunk_size=chunk_size)
+    for item in items:
+        yield {
+            'id': item.id,
+            'name': item.name,
+            'price_per_day': str(item.price_per_day),
+            'available_from': item.available_from.isoformat() if item.available_from else None,
+            'description': item.description,
+            'public': item.public,
+            'created_at': item.created_at.isoformat(),
+            'author': item.author.username,
+            'categories': [c.name for c in item.categories.all()],
+            'tags': [t.name for t in item.tags.all()],
+            'like_count': item.like_count,
+            'rating_count': item.rating_count,
+            'avg_rating': item.average_rating,
+        }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    """File-like object whose write() just returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        # Same "a|b" list format the importer reads.
+        row = {**row, 'categories': '|'.join(row['categories']), 'tags': '|'.join(row['tags'])}
+        yield writer.writerow(['' if row[f] is None else row[f] for f in FIELDS])
+
+
+async def async_lines(lines):
+    lines = iter(lines)
+    # Thread-sensitive: every batch runs on the thread that holds the query.
+    take = sync_to_async(lambda: ''.join(islice(lines, ASYNC_BATCH)))
+    while True:
+        batch = await take()
+        if not batch:
+            return
+        yield batch
+
+
+FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+}
@@ -0,0 +1,76 @@
+"""
+Facet counts for the catalog filters: GET /api/items/?facets=categories,tags
+
+Counts are taken over the current result set, i.e. after search, filters
+and personalisation, and added to the list response as
+
+    "facets": {"categories": [{"id": 1, "name": "Палатки", "count": 12}, ...], "tags": [...]}
+
+Each facet is one GROUP BY over the M2M table, restricted to the ids of the
+result set in a subquery. Counts are cached under the catalog version (and
+the user's interests version when signed in), keyed by the filters but not
+the cursor, so paging through results and redrawing the sidebar reuse them.
+"""
+import hashlib
+
+from django.core.cache import cache as backend
+from django.db.models import Count
+from rest_framework.exceptions import ValidationError
+
+from . import cache
+from .models import Equipment
+
+FACETS = {
+    'categories': (Equipment.categories.through, 'category'),
+    'tags': (Equipment.tags.through, 'tag'),
+}
+QUERY_PARAM = 'facets'
+# Parameters that change the page or its order, not the result set.
+IGNORED_PARAMS = {QUERY_PARAM, 'cursor', 'page_size', 'ordering', 'format'}
+
+
+def requested(request):
+    value = request.query_params.get(QUERY_PARAM)
+    if not value:
+        return []
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in FACETS]
+    if unknown:
+        raise ValidationError({QUERY_PARAM: f"Допустимые значения: {', '.join(FACETS)}"})
+    return list(dict.fromkeys(names))
+
+
+def count(queryset, name):
+    through, field = FACETS[name]
+    rows = (
+        through.objects.filter(equipment_id__in=queryset.order_by().values('pk'))
+        .values(f'{field}_id', f'{field}__name')
+        .annotate(count=Count('equipment_id', distinct=True))
+        .order_by('-count', f'{field}__name')
+    )
+    return [{'id': row[f'{field}_id'], 'name': row[f'{field}__name'], 'count': row['count']} for row in rows]
+
+
+def cache_key(request, name):
+    user = request.user
+    params = sorted(
+        (key, value) for key, values in request.query_params.lists() if key not in IGNORED_PARAMS
+        for value in values
+    )
+    return 'facets:' + hashlib.sha1('|'.join([
+        str(cache.catalog_version()),
+        f'{user.id}:{cache.interests_version(user.id)}' if user.is_authenticated else '',
+        name, repr(params),
+    ]).encode()).hexdigest()
+
+
+def facet_counts(request, queryset, names):
+    keys = {name: cache_key(request, name) for name in names}
+    found = backend.get_many(keys.values())
+    result = {}
+    for name, key in keys.items():
+        if key not in found:
+            found[key] = count(queryset, name)
+            backend.set(key, found[key], cache.response_timeout())
+        result[name] = found[key]
+    return result
@@ -0,0 +1,154 @@
+"""
+The following feed, GET /api/feed/: the newest items of the people a user follows.
+
+The feed uses hybrid fan-out. When an author with at most
+FEED_FANOUT_MAX_FOLLOWERS followers adds an item, the worker writes one
+TimelineEntry per follower (`tasks.fan_out_item`). A follower's page is then a
+range scan of the (user, created_at, item) index, however many people they
+follow. Items of authors above the limit are not copied. Reading the feed
+fetches them from the (author, created_at, id) index and merges them in, so a
+popular author's item does not queue one insert per follower. Stats.followers
+decides which side an author is on; for an author without a Stats row the
+Follow rows are counted instead.
+
+Both sources are paged with the same cursor by MergedKeysetPagination. When
+an author crosses the limit, items copied earlier may also be read from the
+author. The merge drops such duplicates. When an author falls back to the
+limit, the items posted above it were never copied, so
+`tasks.backfill_followers` copies their latest FEED_BACKFILL items into
+every follower's timeline, as following them would.
+
+Following someone copies their latest FEED_BACKFILL items into the timeline.
+Unfollowing removes them. `manage.py rebuild_timelines` refills timelines from
+Follow, for follows made before the feed existed or imports that met a full queue.
+`manage.py benchmark_feed` compares the feed with a join over all followees.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Equipment, Follow, Stats, TimelineEntry
+
+# Shared by both sources: the item's created_at, then the item id.
+ORDERING = ('-created_at', '-item_id')
+
+
+def fanout_limit():
+    return getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 1000)
+
+
+def backfill_size():
+    return getattr(settings, 'FEED_BACKFILL', 50)
+
+
+def follower_count(author_id):
+    followers = Stats.objects.filter(user_id=author_id).values_list('followers', flat=True).first()
+    if followers is None:
+        # No Stats row (yet): count, rather than take a popular author for a small one.
+        followers = Follow.objects.filter(following_id=author_id).count()
+    return followers
+
+
+def fans_out(author_id):
+    return follower_count(author_id) <= fanout_limit()
+
+
+def uncounted_popular(follows):
+    """Followees in `follows` without a Stats row that have more followers than the limit."""
+    authors = list(follows.filter(following__stats__isnull=True).values_list('following_id', flat=True).distinct())
+    if not authors:
+        return []
+    return list(
+        Follow.objects.filter(following_id__in=authors).order_by().values('following_id')
+        .annotate(total=Count('pk')).filter(total__gt=fanout_limit()).values_list('following_id', flat=True)
+    )
+
+
+def popular_followees(user_id):
+    """Followees of `user_id` whose items are read at request time."""
+    follows = Follow.objects.filter(follower_id=user_id)
+    popular = Stats.objects.filter(user__isnull=False, followers__gt=fanout_limit()).values('user_id')
+    return follows.filter(Q(following_id__in=popular) | Q(following_id__in=uncounted_popular(follows)))
+
+
+def sources(user_id):
+    """Querysets ordered by ORDERING whose rows carry `created_at` and `item_id`."""
+    querysets = [TimelineEntry.objects.filter(user_id=user_id).only('item_id', 'created_at')]
+    # Fetched first: as a subquery, SQLite walks the items by date instead of by author.
+    authors = list(popular_followees(user_id).values_list('following_id', flat=True))
+    if authors:
+        querysets.append(
+            Equipment.objects.filter(author_id__in=authors).annotate(item_id=F('id')).only('id', 'created_at')
+        )
+    return querysets
+
+
+def items(rows):
+    """The Equipment of a page of rows, in page order."""
+    ids = [row.item_id for row in rows]
+    found = Equipment.objects.with_related().in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def entries(user_ids, author_id, created):
+    return [
+        TimelineEntry(user_id=user_id, item_id=item_id, author_id=author_id, created_at=created_at)
+        for user_id in user_ids for item_id, created_at in created
+    ]
+
+
+def latest(author_id):
+    """(id, created_at) of the author's items copied by a backfill."""
+    return list(
+        Equipment.objects.filter(author_id=author_id).order_by('-created_at', '-id')
+        .values_list('id', 'created_at')[:backfill_size()]
+    )
+
+
+def backfill(user_id, author_id):
+    """Copy the latest items of a newly followed author into the follower's timeline."""
+    if not fans_out(author_id):
+        return
+    TimelineEntry.objects.bulk_create(entries([user_id], author_id, latest(author_id)), ignore_conflicts=True)
+
+
+def fell_to_limit(author_id):
+    """After an unfollow: whether the author has just dropped back to the fan-out limit."""
+    return follower_count(author_id) == fanout_limit()
+
+
+def forget(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild(user_ids=None, chunk_size=500):
+    """Refill the timelines of `user_ids` (default: every follower) from Follow."""
+    follows = Follow.objects.all() if user_ids is None else Follow.objects.filter(follower_id__in=user_ids)
+    followers = follows.order_by('follower_id').values_list('follower_id', flat=True).distinct()
+    popular = set(
+        Stats.objects.filter(user__isnull=False, followers__gt=fanout_limit()).values_list('user_id', flat=True)
+    ) | set(uncounted_popular(follows))
+    written = 0
+    for user_id in followers.iterator():
+        authors = [
+            pk for pk in Follow.objects.filter(follower_id=user_id).values_list('following_id', flat=True)
+            if pk not in popular
+        ]
+        with transaction.atomic():
+            TimelineEntry.objects.filter(user_id=user_id).delete()
+            for start in range(0, len(authors), chunk_size):
+                latest = (
+                    Equipment.objects.filter(author_id__in=authors[start:start + chunk_size])
+                    .annotate(rank=Window(RowNumber(), partition_by=F('author_id'),
+                                          order_by=[F('created_at').desc(), F('id').desc()]))
+                    .filter(rank__lte=backfill_size())
+                    .values_list('id', 'author_id', 'created_at')
+                )
+                created = TimelineEntry.objects.bulk_create(
+                    [TimelineEntry(user_id=user_id, item_id=item_id, author_id=author_id, created_at=created_at)
+                     for item_id, author_id, created_at in latest],
+                    batch_size=1000,
+                )
+                written += len(created)
+    return written
@@ -0,0 +1,105 @@
+"""
+Audit log writes.
+
+HISTORY_WRITE_MODE = 'sync' inserts every History row inside the request, as
+before. 'buffered' collects rows in memory after the request's transaction
+commits and writes them with one bulk_create when HISTORY_BUFFER_SIZE rows
+are waiting or HISTORY_FLUSH_INTERVAL seconds have passed, and on process
+exit. Buffered mode can lose up to one buffer of entries if the process is
+killed, in exchange for taking the INSERT off the write path.
+
+A batch that fails with OperationalError ("database is locked") goes back to
+the buffer and is retried on the timer. While writes fail the buffer holds at
+most ten times HISTORY_BUFFER_SIZE entries and drops the oldest beyond that.
+Other errors (a row the database rejects) would fail every retry too, so that
+batch is logged and dropped.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from .models import History
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryBuffer:
+    def __init__(self, max_size=500, interval=2.0, max_pending=None):
+        self.max_size = max_size
+        self.interval = interval
+        self.max_pending = max_pending or max_size * 10
+        self.entries = []
+        self.lock = threading.Lock()
+        self.timer = None
+        # Set while writes fail: only the timer retries, not every add().
+        self.failing = False
+
+    def add(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+            full = len(self.entries) >= self.max_size and not self.failing
+            if not full:
+                self._schedule()
+        if full:
+            self.flush()
+
+    def _schedule(self):
+        # Called with the lock held.
+        if self.timer is None:
+            self.timer = threading.Timer(self.interval, self._flush_on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            batch, self.entries = self.entries, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if batch:
+            try:
+                History.objects.bulk_create(batch)
+            except OperationalError:
+                logger.warning("Could not write %s history entries, will retry", len(batch), exc_info=True)
+                self.requeue(batch)
+                return 0
+            except Exception:
+                logger.exception("Could not write %s history entries", len(batch))
+            self.failing = False
+        return len(batch)
+
+    def requeue(self, batch):
+        with self.lock:
+            self.failing = True
+            self.entries[:0] = batch
+            dropped = max(0, len(self.entries) - self.max_pending)
+            del self.entries[:dropped]
+            self._schedule()
+        if dropped:
+            logger.error("History buffer is full, dropped the %s oldest entries", dropped)
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread has its own connection; don't leak it.
+            connection.close()
+
+
+buffer = HistoryBuffer(
+    max_size=getattr(settings, 'HISTORY_BUFFER_SIZE', 500),
+    interval=getattr(settings, 'HISTORY_FLUSH_INTERVAL', 2.0),
+)
+atexit.register(buffer.flush)
+
+
+def record(user_id, action):
+    entry = History(user_id=user_id, action=action, created_at=timezone.now())
+    if getattr(settings, 'HISTORY_WRITE_MODE', 'sync') == 'buffered':
+        transaction.on_commit(lambda: buffer.add(entry))
+    else:
+        entry.save()
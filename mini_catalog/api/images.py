@@ -0,0 +1,188 @@
+"""
+Fixed-size WebP/JPEG variants of Equipment.image and Profile.avatar.
+
+Uploads queue a `generate_image_variants` task (api/tasks.py), so resizing
+happens in the worker rather than the request. The worker hands the
+rendering to a process pool of IMAGE_RENDER_WORKERS processes, shared with
+`manage.py build_image_variants`, which backfills existing media. Variant
+paths are stored in the `*_variants` JSON field together with the source
+file they were made from, so a replaced image is re-rendered; the files of
+the replaced image's variants are deleted (api/signals.py).
+"""
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# model label -> (image field, variants field, {variant: (width, height)})
+SPECS = {
+    'api.equipment': ('image', 'image_variants', {'thumb': (320, 240), 'medium': (1024, 768)}),
+    'api.profile': ('avatar', 'avatar_variants', {'thumb': (64, 64), 'medium': (256, 256)}),
+}
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+QUALITY = 82
+
+_pool = None
+
+
+def spec_for(model):
+    return SPECS[model._meta.label_lower]
+
+
+def variant_path(source, variant, ext):
+    base, _ = os.path.splitext(source)
+    return f"variants/{base}/{variant}.{ext}"
+
+
+def render_variants(source, sizes):
+    """
+    Render every size of `source` in every format and save it to storage.
+
+    Returns {'source': source, variant: {ext: path}}, or None when the file is
+    missing or not an image. Touches no database, so it runs in pool workers.
+    """
+    try:
+        with default_storage.open(source, 'rb') as handle:
+            original = ImageOps.exif_transpose(Image.open(handle))
+            original.load()
+    except (FileNotFoundError, UnidentifiedImageError, OSError) as exc:
+        logger.warning("Cannot render variants of %s: %s", source, exc)
+        return None
+
+    variants = {'source': source}
+    for variant, size in sizes.items():
+        resized = ImageOps.fit(original, size, Image.Resampling.LANCZOS)
+        variants[variant] = {}
+        for ext, pil_format in FORMATS.items():
+            image = resized.convert('RGB') if pil_format == 'JPEG' else resized
+            buffer = io.BytesIO()
+            image.save(buffer, pil_format, quality=QUALITY, optimize=True)
+            path = variant_path(source, variant, ext)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[variant][ext] = default_storage.save(path, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def variant_files(variants):
+    return [path for variant, paths in (variants or {}).items() if variant != 'source' for path in paths.values()]
+
+
+def delete_variants(variants):
+    for path in variant_files(variants):
+        default_storage.delete(path)
+
+
+def needs_variants(instance):
+    image_field, variants_field, _ = spec_for(type(instance))
+    image = getattr(instance, image_field)
+    return (getattr(instance, variants_field) or {}).get('source') != (image.name if image else None)
+
+
+def store(model, pk, source, variants):
+    """Save rendered variants unless the image was replaced in the meantime."""
+    image_field, variants_field, _ = spec_for(model)
+    # A file that could not be rendered is still marked as processed.
+    stored = model.objects.filter(pk=pk, **{image_field: source}).update(
+        **{variants_field: variants or {'source': source}}
+    )
+    if not stored:
+        # Rendered for an image that is gone; nothing will point at the files.
+        delete_variants(variants)
+    return stored
+
+
+def new_pool(workers=None):
+    # Children are forked, all of them on the first submit; they must not share
+    # the parent's DB connections.
+    connections.close_all()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def pool():
+    """The process pool of this process, started on first use."""
+    global _pool
+    if _pool is None:
+        _pool = new_pool(getattr(settings, 'IMAGE_RENDER_WORKERS', None))
+    return _pool
+
+
+def shutdown():
+    """Stop the pool; the next render starts one with the settings of the time."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def render(source, sizes):
+    """render_variants() in the pool, so a worker never decodes images itself."""
+    global _pool
+    try:
+        return pool().submit(render_variants, source, sizes).result()
+    except BrokenProcessPool:
+        # A child died (e.g. killed for memory); the next task starts a new pool.
+        _pool = None
+        raise
+
+
+def generate(model, pk):
+    image_field, variants_field, sizes = spec_for(model)
+    instance = model.objects.filter(pk=pk).only(image_field, variants_field).first()
+    if instance is None or not needs_variants(instance):
+        return False
+    image = getattr(instance, image_field)
+    if not image:
+        model.objects.filter(pk=pk).update(**{variants_field: {}})
+        return True
+    return bool(store(model, pk, image.name, render(image.name, sizes)))
+
+
+def _render(job):
+    pk, source, sizes = job
+    return pk, source, render_variants(source, sizes)
+
+
+def backfill(model, workers=None, force=False):
+    """
+    Render variants for every row of `model` that lacks them, in the shared
+    process pool or in a pool of `workers` processes.
+    """
+    image_field, variants_field, sizes = spec_for(model)
+    rows = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+    jobs = [
+        (pk, source, sizes)
+        for pk, source, variants in rows.values_list('pk', image_field, variants_field).iterator()
+        if force or (variants or {}).get('source') != source
+    ]
+    if not jobs:
+        return 0
+    executor = new_pool(workers) if workers else pool()
+    done = 0
+    try:
+        for pk, source, variants in executor.map(_render, jobs, chunksize=8):
+            done += store(model, pk, source, variants)
+    finally:
+        if workers:
+            executor.shutdown()
+    return done
+
+
+def urls(variants, source):
+    """{variant: {ext: url}} for serializers; None until variants of `source` exist."""
+    if not variants or variants.get('source') != source:
+        return None
+    return {
+        variant: {ext: default_storage.url(path) for ext, path in paths.items()}
+        for variant, paths in variants.items() if variant != 'source'
+    }
@@ -0,0 +1,228 @@
+"""
+Bulk import of Equipment from CSV or NDJSON.
+
+Rows are parsed one at a time from the stream and validated with
+EquipmentImportSerializer; valid rows are written in batches: category and
+tag names are resolved (and missing ones created) with one query per batch,
+then items and their M2M through rows go in with bulk_create inside one
+transaction per batch. Invalid rows are reported and skipped, and so are
+lines that are not UTF-8 or that the CSV reader rejects.
+
+bulk_create bypasses model signals, so the search index, statistics,
+history and catalog cache version are updated here once per batch, and each
+committed batch queues `tasks.fan_out_items` to copy its items into the
+followers' timelines (api/feed.py). Followers are not notified of imported
+items.
+"""
+import csv
+import json
+import logging
+
+from django.db import DatabaseError, transaction
+from rest_framework import serializers
+
+from . import cache, history, search, stats, tasks
+from .models import Equipment, Category, Tag
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+NOT_UTF8 = "Line is not valid UTF-8; save the file as UTF-8"
+
+
+class NamesField(serializers.ListField):
+    """A list of names, also accepted as a single "a|b|c" string (CSV cells)."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = [name.strip() for name in data.split('|') if name.strip()]
+        return list(dict.fromkeys(super().to_internal_value(data)))
+
+
+class EquipmentImportSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    price_per_day = serializers.DecimalField(max_digits=10, decimal_places=2)
+    available_from = serializers.DateField(required=False, allow_null=True)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    public = serializers.BooleanField(required=False, default=True)
+    categories = NamesField(child=serializers.CharField(max_length=100), required=False, default=list)
+    tags = NamesField(child=serializers.CharField(max_length=50), required=False, default=list)
+
+    def to_internal_value(self, data):
+        # Empty CSV cells mean "not given".
+        data = {key: value for key, value in data.items() if value not in ('', None)}
+        return super().to_internal_value(data)
+
+
+class Lines:
+    """
+    The lines of a binary stream, each decoded on its own: a byte that is not
+    UTF-8 fails the line it is on, and the next line reads normally.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.number = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raw = self.stream.readline()
+        if not raw:
+            raise StopIteration
+        self.number += 1
+        return raw.decode('utf-8-sig' if self.number == 1 else 'utf-8')
+
+
+def iter_rows(stream, fmt):
+    """Yield (line number, dict or parse error) from a binary stream."""
+    lines = Lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        try:
+            reader.fieldnames
+        except UnicodeDecodeError:
+            yield lines.number, ValueError(NOT_UTF8)
+            return
+        except csv.Error as exc:
+            yield lines.number, exc
+            return
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                # The reader starts over on the next line.
+                yield lines.number, ValueError(NOT_UTF8)
+                continue
+            except csv.Error as exc:
+                yield lines.number, exc
+                continue
+            yield lines.number, row
+    elif fmt == 'ndjson':
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield lines.number, ValueError(NOT_UTF8)
+                continue
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield lines.number, exc
+                continue
+            yield lines.number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+    else:
+        raise ValueError(f"Unsupported format {fmt!r}, use csv or ndjson")
+
+
+def format_for(filename, default='ndjson'):
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return default
+
+
+class Importer:
+    def __init__(self, author, batch_size=BATCH_SIZE):
+        self.author = author
+        self.batch_size = batch_size
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, detail):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': detail})
+
+    def run(self, stream, fmt):
+        batch = []
+        for line, row in iter_rows(stream, fmt):
+            if isinstance(row, Exception):
+                self.error(line, {'non_field_errors': [str(row)]})
+                continue
+            serializer = EquipmentImportSerializer(data=row)
+            if not serializer.is_valid():
+                self.error(line, serializer.errors)
+                continue
+            batch.append((line, serializer.validated_data))
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+        if self.created:
+            history.record(self.author.pk, f"Imported {self.created} items")
+        return self.report()
+
+    def report(self):
+        return {'created': self.created, 'failed': self.failed, 'errors': self.errors}
+
+    def write(self, batch):
+        try:
+            with transaction.atomic():
+                ids = self._write(batch)
+        except DatabaseError as exc:
+            for line, _ in batch:
+                self.error(line, {'non_field_errors': [f"Batch could not be saved: {exc}"]})
+            return
+        self.created += len(ids)
+        cache.invalidate_catalog()
+
+    def _write(self, batch):
+        categories = self.resolve(Category, {n for _, row in batch for n in row['categories']})
+        tags = self.resolve(Tag, {n for _, row in batch for n in row['tags']})
+
+        items = Equipment.objects.bulk_create([
+            Equipment(
+                author=self.author,
+                **{k: v for k, v in row.items() if k not in ('categories', 'tags')},
+            )
+            for _, row in batch
+        ])
+        Equipment.categories.through.objects.bulk_create([
+            Equipment.categories.through(equipment_id=item.pk, category_id=categories[name])
+            for item, (_, row) in zip(items, batch) for name in row['categories']
+        ])
+        Equipment.tags.through.objects.bulk_create([
+            Equipment.tags.through(equipment_id=item.pk, tag_id=tags[name])
+            for item, (_, row) in zip(items, batch) for name in row['tags']
+        ])
+
+        ids = [item.pk for item in items]
+        search.index_items(ids)
+        stats.bump(self.author.pk, len(ids), fields=['items'])
+        transaction.on_commit(lambda: self.fan_out(ids))
+        return ids
+
+    def fan_out(self, ids):
+        try:
+            tasks.enqueue('fan_out_items', item_ids=ids, author_id=self.author.pk)
+        except tasks.QueueFull:
+            # The items are saved; `manage.py rebuild_timelines` copies them later.
+            logger.warning("Task queue is full, %s imported items were not fanned out", len(ids))
+
+    @staticmethod
+    def resolve(model, names):
+        """Map names to ids, creating the ones that don't exist yet."""
+        if not names:
+            return {}
+        found = {}
+        for pk, name in model.objects.filter(name__in=names).order_by('-pk').values_list('pk', 'name'):
+            found[name] = pk
+        missing = [model(name=name) for name in names if name not in found]
+        for obj in model.objects.bulk_create(missing):
+            found[obj.name] = obj.pk
+        if missing and model is Category:
+            stats.bump(delta=len(missing), fields=['categories'])
+        return found
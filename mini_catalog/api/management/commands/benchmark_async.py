@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import asgi
+
+
+class Command(BaseCommand):
+    help = "Compare throughput of the sync and async read views under concurrent ASGI requests, as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and mode")
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight at once")
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--user', help="Username to call the API as, the most active user by default")
+        parser.add_argument('--anonymous', action='store_true', help="Call the API without authentication")
+        parser.add_argument('--only', help="Regex; benchmark only routes that match it")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        report = asgi.compare(
+            requests=options['requests'], concurrency=options['concurrency'], warmup=options['warmup'],
+            username=options['user'], anonymous=options['anonymous'], only=options['only'],
+        )
+        data = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(data + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(data)
@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import endpoints
+
+
+class Command(BaseCommand):
+    help = "Call every GET endpoint in-process and report p50/p95/p99 latency, queries and peak memory as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--user', help="Username to call the API as, the most active user by default")
+        parser.add_argument('--anonymous', action='store_true', help="Call the API without authentication")
+        parser.add_argument('--cold', action='store_true', help="Clear the cache before every request")
+        parser.add_argument('--only', help="Regex; benchmark only routes that match it")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        report = endpoints.run(
+            iterations=options['iterations'], warmup=options['warmup'], username=options['user'],
+            anonymous=options['anonymous'], cold=options['cold'], only=options['only'],
+        )
+        data = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(data + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(data)
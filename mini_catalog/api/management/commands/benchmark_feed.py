@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import feed
+
+
+class Command(BaseCommand):
+    help = ("Compare the following feed (timeline rows merged with popular authors) with a join over all "
+            "followees for one reader following many authors, and report latency and queries as JSON. "
+            "Its data is rolled back afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followees', type=int, default=10000)
+        parser.add_argument('--items-per-author', type=int, default=2)
+        parser.add_argument('--popular', type=int, default=10,
+                            help="Followees above FEED_FANOUT_MAX_FOLLOWERS, merged at read time")
+        parser.add_argument('--depth', type=int, default=10, help="Also time this page, following next links")
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        report = feed.feed_comparison(
+            followees=options['followees'], items_per_author=options['items_per_author'],
+            popular=options['popular'], depth=options['depth'],
+            iterations=options['iterations'], warmup=options['warmup'],
+        )
+        data = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(data + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(data)
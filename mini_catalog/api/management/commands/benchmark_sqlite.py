@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import sqlite
+
+
+class Command(BaseCommand):
+    help = ("Run reader and writer threads under the default and the tuned SQLite settings and report "
+            "throughput, latency and lock errors as JSON. Writes to the database, so it runs on a copy only")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', required=True,
+                            help="Scratch copy of the SQLite file to run on, e.g. cp db.sqlite3 /tmp/bench.sqlite3")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per profile")
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--only', help="Regex; run only the profiles that match it")
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        try:
+            report = sqlite.contention(
+                options['database'], duration=options['duration'], readers=options['readers'],
+                writers=options['writers'], only=options['only'],
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        data = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                handle.write(data + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(data)
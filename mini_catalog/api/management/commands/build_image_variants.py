@@ -0,0 +1,19 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from api import cache, images
+
+
+class Command(BaseCommand):
+    help = "Render missing WebP/JPEG variants of equipment images and avatars in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Pool size, IMAGE_RENDER_WORKERS by default")
+        parser.add_argument('--force', action='store_true', help="Re-render variants that already exist")
+
+    def handle(self, *args, **options):
+        for label in images.SPECS:
+            done = images.backfill(apps.get_model(label), workers=options['workers'], force=options['force'])
+            self.stdout.write(f"{label}: {done} images processed")
+        cache.invalidate_catalog()
+        self.stdout.write(self.style.SUCCESS("Image variants are up to date"))
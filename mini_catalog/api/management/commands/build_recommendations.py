@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import recommender
+
+
+class Command(BaseCommand):
+    help = "Precompute the top-K tag co-occurrence recommendations for every user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=recommender.TOP_K)
+
+    def handle(self, *args, **options):
+        if not recommender.is_available():
+            raise CommandError("numpy and scipy are required to build recommendations")
+        users = recommender.rebuild(top_k=options['top_k'])
+        self.stdout.write(self.style.SUCCESS(f"Built recommendations for {users} users"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api import exporter
+
+
+class Command(BaseCommand):
+    help = "Stream the catalog to a file (or stdout) as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(exporter.FORMATS), default='ndjson')
+        parser.add_argument('--output', help="File to write, stdout by default")
+        parser.add_argument('--chunk-size', type=int, default=exporter.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        encode, _ = exporter.FORMATS[options['format']]
+        lines = encode(exporter.export_rows(chunk_size=options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
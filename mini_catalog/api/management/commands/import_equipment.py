@@ -0,0 +1,28 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import Importer, format_for
+
+
+class Command(BaseCommand):
+    help = "Bulk-import equipment from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--author', required=True, help="Username that will own the imported items")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['author']!r} does not exist")
+        fmt = options['format'] or format_for(options['path'])
+        with open(options['path'], 'rb') as stream:
+            report = Importer(author, batch_size=options['batch_size']).run(stream, fmt)
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'], ensure_ascii=False)}")
+        self.stdout.write(self.style.SUCCESS(f"Created {report['created']} items, {report['failed']} rows failed"))
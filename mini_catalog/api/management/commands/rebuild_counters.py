@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from api.models import Comment, CommentLike, CommentRating, Equipment, Like, Rating
+
+
+def per_item(queryset, aggregate, field='item'):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+            .annotate(total=aggregate).values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+class Command(BaseCommand):
+    help = ("Rebuild like_count, rating_count and rating_sum of Equipment and Comment "
+            "from Like, Rating, CommentLike and CommentRating rows")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Equipment.objects.update(
+                like_count=per_item(Like.objects.all(), Count('id')),
+                rating_count=per_item(Rating.objects.all(), Count('id')),
+                rating_sum=per_item(Rating.objects.all(), Sum('value')),
+            )
+            comments = Comment.objects.update(
+                like_count=per_item(CommentLike.objects.all(), Count('id'), field='comment'),
+                rating_count=per_item(CommentRating.objects.all(), Count('id'), field='comment'),
+                rating_sum=per_item(CommentRating.objects.all(), Sum('value'), field='comment'),
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {updated} items and {comments} comments"))
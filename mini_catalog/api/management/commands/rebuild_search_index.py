@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the FTS5 full-text index used by ?search= on /api/items/"
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("Full-text index is only available on SQLite")
+        with transaction.atomic():
+            indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} items"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import feed
+
+
+class Command(BaseCommand):
+    help = ("Refill following-feed timelines from Follow: the latest FEED_BACKFILL items of every followee "
+            "below FEED_FANOUT_MAX_FOLLOWERS")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help="Only this follower (repeatable)")
+
+    def handle(self, *args, **options):
+        written = feed.rebuild(options['users'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} timeline entries"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api import stats
+
+
+class Command(BaseCommand):
+    help = "Recount the materialized user and global statistics from the source tables"
+
+    def handle(self, *args, **options):
+        stats.reconcile()
+        self.stdout.write(self.style.SUCCESS("Statistics reconciled"))
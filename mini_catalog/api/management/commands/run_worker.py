@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api import tasks
+
+
+class Command(BaseCommand):
+    help = "Process background tasks from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            done = tasks.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Processed {done} tasks"))
+            return
+        self.stdout.write("Worker started, press Ctrl+C to stop")
+        try:
+            tasks.work(poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Worker stopped")
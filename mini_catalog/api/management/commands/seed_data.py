@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from api.seed import Seeder, BATCH_SIZE
+
+COUNTS = {
+    'users': 1000,
+    'items': 10000,
+    'tags': 200,
+    'categories': 30,
+    'follows': 20000,
+    'favorites': 20000,
+    'comments': 50000,
+    'likes': 50000,
+    'ratings': 20000,
+}
+
+
+class Command(BaseCommand):
+    help = "Generate synthetic users, items and activity with skewed popularity, for benchmarks"
+
+    def add_arguments(self, parser):
+        for name, default in COUNTS.items():
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help="Zipf exponent of author, followee and item popularity; 0 is uniform")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed, for repeatable data")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        seeder = Seeder(seed=options['seed'], skew=options['skew'], batch_size=options['batch_size'])
+        counts = seeder.run(**{name: options[name] for name in COUNTS})
+        for name, created in counts.items():
+            self.stdout.write(f"{name}: {created}")
+        self.stdout.write(self.style.SUCCESS("Seeded. Every generated user has the password 'seed-password'"))
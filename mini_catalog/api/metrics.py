@@ -0,0 +1,183 @@
+"""
+Request timing: Server-Timing headers and Prometheus histograms.
+
+PerformanceMiddleware (api/middleware.py) opens a RequestTiming for each
+request. SQL time is collected by an execute_wrapper on every connection, serializer
+time by ModelSerializer in api/serializers.py, and everything is recorded
+under the resolved URL name. Histograms live in process memory: each worker
+process exposes its own at /metrics and Prometheus sums them. Recording costs
+a few perf_counter() calls and one locked bucket increment per histogram.
+"""
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# /metrics is served to localhost unless METRICS_ALLOWED_IPS says otherwise.
+ALLOWED_IPS = ('127.0.0.1', '::1')
+
+current = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self, total):
+        return ', '.join([
+            f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries"',
+            f'serialize;dur={self.serialize * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    """
+    Installed on every connection (see api/signals.py). The timing is found
+    through the context variable, which also follows async views into the
+    sync_to_async threads their queries run in.
+    """
+    timing = current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    return timing(execute, sql, params, many, context)
+
+
+class TimedSerializerMixin:
+    """Add the time spent in the outermost to_representation() to the current request."""
+
+    def to_representation(self, instance):
+        timing = current.get()
+        # Nested serializers run inside the outer call and are already counted.
+        if timing is None or timing.serializing:
+            return super().to_representation(instance)
+        timing.serializing = True
+        started = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timing.serialize += perf_counter() - started
+            timing.serializing = False
+
+
+# -----------------------
+# Prometheus registry
+# -----------------------
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, labels
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            series = dict(self.series)
+        for labels, value in sorted(series.items()):
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.series = {}
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                yield f'{self.name}_bucket{_labels(self.label_names, labels, [("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}'
+
+
+REQUESTS = Counter('catalog_http_requests_total', "Requests by URL name, method and status",
+                   ('view', 'method', 'status'))
+DURATION = Histogram('catalog_http_request_duration_seconds', "Total request time",
+                     ('view', 'method'))
+DB_DURATION = Histogram('catalog_http_db_duration_seconds', "Time spent in SQL per request", ('view',))
+DB_QUERIES = Histogram('catalog_http_db_queries', "SQL queries per request", ('view',), buckets=QUERY_BUCKETS)
+SERIALIZE_DURATION = Histogram('catalog_http_serialize_duration_seconds',
+                               "Time spent in serializers per request", ('view',))
+METRICS = [REQUESTS, DURATION, DB_DURATION, DB_QUERIES, SERIALIZE_DURATION]
+
+
+def record(view, method, status, timing, total):
+    REQUESTS.inc((view, method, status))
+    DURATION.observe((view, method), total)
+    DB_DURATION.observe((view,), timing.db)
+    DB_QUERIES.observe((view,), timing.queries)
+    SERIALIZE_DURATION.observe((view,), timing.serialize)
+
+
+def reset():
+    for metric in METRICS:
+        with metric.lock:
+            metric.series.clear()
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ALLOWED_IPS)
+    if allowed is not None and request.META.get('REMOTE_ADDR') not in allowed:
+        raise Http404
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,60 @@
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+class PerformanceMiddleware:
+    """
+    Time every request: SQL queries, serializers and the total, per URL name.
+
+    Sends a Server-Timing header (SERVER_TIMING_HEADER) and feeds the
+    histograms served at /metrics (PERFORMANCE_METRICS). Keep it first in
+    MIDDLEWARE so the total covers the rest of the stack. Works in both sync
+    and async stacks, so it does not push async views back onto a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PERFORMANCE_METRICS', True)
+        self.header = getattr(settings, 'SERVER_TIMING_HEADER', True)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        timing = metrics.RequestTiming()
+        token = metrics.current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, timing)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        timing = metrics.RequestTiming()
+        token = metrics.current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        return self.finish(request, response, timing)
+
+    def finish(self, request, response, timing):
+        total = perf_counter() - timing.started
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        metrics.record(view, request.method, response.status_code, timing, total)
+        if self.header:
+            response['Server-Timing'] = timing.server_timing(total)
+        return response
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+
+
+def create_index(apps, schema_editor):
+    # Without FTS5, search falls back to icontains (api/search.py).
+    if schema_editor.connection.vendor != 'sqlite' or not has_fts5(schema_editor.connection):
+        return
+    schema_editor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS api_equipment_fts USING fts5(
+            name, description, tags, categories,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    schema_editor.execute("""
+        INSERT INTO api_equipment_fts(rowid, name, description, tags, categories)
+        SELECT e.id, e.name, e.description,
+            (SELECT group_concat(t.name, ' ') FROM api_equipment_tags et
+                JOIN api_tag t ON t.id = et.tag_id WHERE et.equipment_id = e.id),
+            (SELECT group_concat(c.name, ' ') FROM api_equipment_categories ec
+                JOIN api_category c ON c.id = ec.category_id WHERE ec.equipment_id = e.id)
+        FROM api_equipment e
+    """)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS api_equipment_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_task'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='history',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, column):
+    totals = (
+        queryset.filter(**{column: OuterRef('user_id')}).order_by()
+        .values(column).annotate(total=Count('pk')).values('total')
+    )
+    return Coalesce(Subquery(totals, output_field=IntegerField()), Value(0))
+
+
+def create_rows(apps, schema_editor):
+    model = apps.get_model
+    Stats = model('api', 'Stats')
+    Stats.objects.get_or_create(user=None, defaults={
+        'items': model('api', 'Equipment').objects.count(),
+        'comments': model('api', 'Comment').objects.count(),
+        'likes': model('api', 'Like').objects.count(),
+        'ratings': model('api', 'Rating').objects.count(),
+        'follows': model('api', 'Follow').objects.count(),
+        'users': model(settings.AUTH_USER_MODEL).objects.count(),
+        'categories': model('api', 'Category').objects.count(),
+    })
+    # Signals only adjust rows that exist, so every existing user needs one now.
+    users = model(settings.AUTH_USER_MODEL).objects.values_list('pk', flat=True)
+    Stats.objects.bulk_create([Stats(user_id=pk) for pk in users.iterator()], batch_size=1000)
+    Stats.objects.filter(user__isnull=False).update(
+        items=_count(model('api', 'Equipment').objects.all(), 'author_id'),
+        comments=_count(model('api', 'Comment').objects.all(), 'author_id'),
+        likes=_count(model('api', 'Like').objects.all(), 'user__user_id'),
+        ratings=_count(model('api', 'Rating').objects.all(), 'user_id'),
+        follows=_count(model('api', 'Follow').objects.all(), 'follower_id'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_history_created_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('items', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('likes', models.IntegerField(default=0)),
+                ('ratings', models.IntegerField(default=0)),
+                ('follows', models.IntegerField(default=0)),
+                ('users', models.IntegerField(default=0)),
+                ('categories', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_rows, migrations.RunPython.noop),
+    ]
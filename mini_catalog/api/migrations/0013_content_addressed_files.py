@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:56
+
+import api.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileReference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='equipment',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=api.uploads.equipment_file_storage, upload_to=api.uploads.equipment_file_path),
+        ),
+    ]
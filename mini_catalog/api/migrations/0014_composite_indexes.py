@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_content_addressed_files'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(fields=['public', 'created_at', 'id'], name='api_equipme_public_cc3732_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipment',
+            index=models.Index(fields=['author', 'created_at', 'id'], name='api_equipme_author__48c7dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentlist',
+            index=models.Index(fields=['user', 'added_at', 'id'], name='api_equipme_user_id_37d58c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'is_read', 'created_at', 'id'], name='api_notific_user_id_3b0879_idx'),
+        ),
+    ]
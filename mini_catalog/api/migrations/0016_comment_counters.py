@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def count_votes(apps, schema_editor):
+    def per_comment(model, aggregate):
+        totals = (
+            apps.get_model('api', model).objects.filter(comment=OuterRef('pk')).order_by()
+            .values('comment').annotate(total=aggregate).values('total')
+        )
+        return Coalesce(Subquery(totals, output_field=IntegerField()), Value(0))
+
+    apps.get_model('api', 'Comment').objects.update(
+        like_count=per_comment('CommentLike', Count('pk')),
+        rating_count=per_comment('CommentRating', Count('pk')),
+        rating_sum=per_comment('CommentRating', Sum('value')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_unread_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
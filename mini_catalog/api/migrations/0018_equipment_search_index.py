@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_following_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentSearchIndex',
+            fields=[
+                ('item', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='api.equipment')),
+                ('document', models.TextField(db_column='api_equipment_fts')),
+            ],
+            options={
+                'db_table': 'api_equipment_fts',
+                'managed': False,
+            },
+        ),
+    ]
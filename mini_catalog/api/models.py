@@ -1,6 +1,9 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+from .uploads import equipment_file_path, equipment_file_storage
+
 # -----------------------
 # Users: Profile, Follow
 # -----------------------
@@ -8,6 +11,8 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     bio = models.TextField(blank=True)
+    # Resized copies of `avatar`, rendered by the worker (api/images.py)
+    avatar_variants = models.JSONField(default=dict, blank=True)
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, related_name='following', on_delete=models.CASCADE)
@@ -16,6 +21,9 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            models.Index(fields=['following', 'created_at', 'id']),
+        ]
 
 # -----------------------
 # Category & Tag
@@ -37,14 +45,22 @@ class Tag(models.Model):
 # -----------------------
 # Equipment
 # -----------------------
+class EquipmentQuerySet(models.QuerySet):
+    def with_related(self):
+        # Everything EquipmentSerializer renders, in a fixed number of queries.
+        return self.select_related('author').prefetch_related('categories', 'tags')
+
 class Equipment(models.Model):
     name = models.CharField(max_length=255)
     price_per_day = models.DecimalField(max_digits=10, decimal_places=2)
     available_from = models.DateField(null=True, blank=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    file = models.FileField(upload_to='equipment_files/', null=True, blank=True)
+    # Stored under its SHA-256 digest and shared between identical uploads (api/uploads.py)
+    file = models.FileField(upload_to=equipment_file_path, storage=equipment_file_storage, null=True, blank=True)
     image = models.ImageField(upload_to='equipment_images/', null=True, blank=True)
+    # Resized copies of `image`, rendered by the worker (api/images.py)
+    image_variants = models.JSONField(default=dict, blank=True)
     public = models.BooleanField(default=True)
 
     categories = models.ManyToManyField(Category, blank=True, related_name='items')
@@ -52,29 +68,90 @@ class Equipment(models.Model):
 
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="equipments", default=1)
 
+    # Denormalized counters, kept in sync by signals (see api/signals.py)
+    # and rebuilt by `manage.py rebuild_counters`.
+    like_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    objects = EquipmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['public', 'created_at', 'id']),
+            models.Index(fields=['author', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.name} — {self.price_per_day}/day"
 
+    @property
+    def average_rating(self):
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 2)
+        return 0
+
+class EquipmentSearchIndex(models.Model):
+    # A row of the FTS5 index (migration 0007), written by api/search.py and
+    # only joined on rowid by `?search=`.
+    item = models.OneToOneField(Equipment, primary_key=True, db_column='rowid', db_constraint=False,
+                                on_delete=models.DO_NOTHING, related_name='search_index')
+    # The hidden column named after the table: the left-hand side of MATCH.
+    document = models.TextField(db_column='api_equipment_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'api_equipment_fts'
+
 class EquipmentList(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     equipment = models.ForeignKey(Equipment, on_delete=models.CASCADE)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'added_at', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.user} - {self.equipment}"
 
 # -----------------------
 # Comments & Ratings
 # -----------------------
+class CommentQuerySet(models.QuerySet):
+    def with_related(self):
+        # The author CommentSerializer renders, in the same query.
+        return self.select_related('author')
+
 class Comment(models.Model):
     item = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized from CommentLike / CommentRating like the Equipment counters.
+    like_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', 'created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"{self.author.username}: {self.text[:20]}"
 
+    @property
+    def average_rating(self):
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 2)
+        return 0
+
 class Rating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     item = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name="ratings")
@@ -136,16 +213,117 @@ class CategorySubscription(models.Model):
     class Meta:
         unique_together = ('user', 'category')
 
+# -----------------------
+# Recommendations (precomputed by `manage.py build_recommendations`)
+# -----------------------
+class Recommendation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    item = models.ForeignKey(Equipment, on_delete=models.CASCADE, related_name='recommendations')
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'item')
+        indexes = [
+            models.Index(fields=['user', 'score', 'item']),
+        ]
+
 # -----------------------
 # History, Notifications
 # -----------------------
 class History(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=255)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered writes (api/history.py) keep the time of the event.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+        ]
 
 class Notification(models.Model):
     user = models.ForeignKey(User, related_name='notifications', on_delete=models.CASCADE)
     message = models.CharField(max_length=255)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id']),
+            models.Index(fields=['user', 'is_read', 'created_at', 'id']),
+        ]
+
+# -----------------------
+# Following feed (fan-out on write, see api/feed.py)
+# -----------------------
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, related_name='timeline', on_delete=models.CASCADE)
+    item = models.ForeignKey(Equipment, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    # The item's created_at, so a page is read from the (user, created_at, item) index alone.
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'item')
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'item']),
+            models.Index(fields=['user', 'author']),
+        ]
+
+# -----------------------
+# Content-addressed files
+# -----------------------
+class FileReference(models.Model):
+    # Storage name of a deduplicated Equipment.file and how many items use it
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+# -----------------------
+# Statistics (maintained by signals, see api/stats.py)
+# -----------------------
+class Stats(models.Model):
+    # user=None is the single global row, created by migration and reconcile_stats.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='stats')
+    items = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0)
+    ratings = models.IntegerField(default=0)
+    follows = models.IntegerField(default=0)
+    # Per-user only: how many follow the user; decides fan-out (api/feed.py).
+    followers = models.IntegerField(default=0)
+    users = models.IntegerField(default=0)
+    categories = models.IntegerField(default=0)
+    # Per-user only: the notification badge, read without touching Notification.
+    unread_notifications = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # The few authors whose items are merged into feeds at read time.
+            models.Index(fields=['followers']),
+        ]
+
+# -----------------------
+# Background tasks (DB-backed queue, see api/tasks.py)
+# -----------------------
+class Task(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
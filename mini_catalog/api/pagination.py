@@ -0,0 +1,208 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_value(value):
+    # Full precision: DjangoJSONEncoder drops microseconds, which would make
+    # rows created within the same millisecond fall between two pages.
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opaque-cursor pagination on an ordering that ends with the primary key.
+
+    The cursor stores the ordering values of the last row of a page, and the
+    next page is read with a `WHERE (created_at, id) < (...)` style filter, so
+    page 1000 costs the same as page 1 and no COUNT(*) is ever issued.
+    Views pick the ordering with `keyset_ordering`, filter backends may supply
+    their own through `get_keyset_ordering()` (search relevance), and an
+    `?ordering=` accepted by the view's OrderingFilter replaces its first field.
+    """
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # For async views: the same page, fetched with the async ORM.
+        queryset = self.page_queryset(queryset, request, view)
+        return self.set_page([row async for row in queryset.aiterator(chunk_size=self.page_size + 1)])
+
+    def page_queryset(self, queryset, request, view):
+        """The sliced queryset of one page plus one row to tell whether more follow."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.model = queryset.model
+
+        self.position, self.reverse = self.decode_cursor(request)
+
+        ordering = self.flip(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.after(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        backends = getattr(view, 'filter_backends', [])
+        for backend in backends:
+            if hasattr(backend, 'get_keyset_ordering'):
+                ordering = backend().get_keyset_ordering(request, view) or ordering
+        for backend in backends:
+            if hasattr(backend, 'get_ordering'):
+                requested = backend().get_ordering(request, queryset, view)
+                if requested and self.field_name(requested[0]) in ('id', 'pk'):
+                    ordering = (requested[0],)
+                elif requested:
+                    ordering = (requested[0],) + ordering[1:]
+                break
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    # -----------------------
+    # Cursor encoding
+    # -----------------------
+    @staticmethod
+    def flip(ordering):
+        return tuple(f[1:] if f.startswith('-') else f'-{f}' for f in ordering)
+
+    @staticmethod
+    def field_name(term):
+        return term.lstrip('-')
+
+    def after(self, ordering, position):
+        # (a, b, c) > (x, y, z) expanded into OR-ed prefix comparisons.
+        condition = Q()
+        for i, term in enumerate(ordering):
+            lookup = 'lt' if term.startswith('-') else 'gt'
+            step = Q(**{f'{self.field_name(t)}': position[j] for j, t in enumerate(ordering[:i])})
+            step &= Q(**{f'{self.field_name(term)}__{lookup}': position[i]})
+            condition |= step
+        return condition
+
+    def to_python(self, name, value):
+        if name == 'pk':
+            return self.model._meta.pk.to_python(value)
+        try:
+            return self.model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            return value
+
+    def encode_cursor(self, row, reverse):
+        position = [getattr(row, self.field_name(term)) for term in self.ordering]
+        payload = json.dumps({'p': position, 'r': int(reverse)}, default=encode_value)
+        token = urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            position = [
+                self.to_python(self.field_name(term), value)
+                for term, value in zip(self.ordering, payload['p'], strict=True)
+            ]
+            return position, bool(payload.get('r'))
+        except (ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """
+    KeysetPagination over several querysets read as one, newest first.
+
+    `paginate_queryset()` takes a list of querysets whose ordering fields
+    exist on all of them (the following feed reads timeline rows and items
+    of popular authors, see api/feed.py). Each one is read with the same
+    cursor and limit, the rows are merged on their ordering values, rows with
+    equal values are kept once, and the page is cut from the merge, so a page
+    costs one indexed query per source. The ordering must be all descending.
+    """
+
+    def paginate_queryset(self, querysets, request, view=None):
+        rows = []
+        for queryset in querysets:
+            rows.extend(self.page_queryset(queryset, request, view))
+        return self.set_page(self.merge(rows))
+
+    def merge(self, rows):
+        merged = {}
+        for row in rows:
+            merged.setdefault(self.position_of(row), row)
+        # Ascending when reading backwards from a `previous` cursor.
+        keys = sorted(merged, reverse=not self.reverse)
+        return [merged[key] for key in keys[:self.page_size + 1]]
+
+    def position_of(self, row):
+        return tuple(getattr(row, self.field_name(term)) for term in self.ordering)
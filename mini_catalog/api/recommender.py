@@ -0,0 +1,112 @@
+"""
+Tag co-occurrence recommender.
+
+Items are L2-normalised rows of a sparse item x tag matrix. A user's profile
+is the sum of the rows of their favourites, and every other item is scored
+by its dot product with that profile. The top K items per user are stored in
+the Recommendation table, so RecommendationsView only reads precomputed rows.
+"""
+from django.db import transaction
+
+from .models import Equipment, Favorite, Recommendation
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # recommendations are then only built where SciPy is installed
+    np = sparse = None
+
+TOP_K = 50
+USER_BATCH = 1000
+WRITE_BATCH = 2000
+
+
+def is_available():
+    return sparse is not None
+
+
+def _pairs(queryset, *fields):
+    return np.array(list(queryset.values_list(*fields)), dtype=np.int64).reshape(-1, len(fields))
+
+
+def score(favorites, item_tags, top_k=TOP_K):
+    """
+    Yield (user_id, [(item_id, score), ...]) for every user in `favorites`.
+
+    `favorites` holds (user_id, item_id) pairs and `item_tags` (item_id, tag_id)
+    pairs; both must describe every item a user could be recommended.
+    """
+    if not len(favorites):
+        return
+    items, inverse = np.unique(np.concatenate([item_tags[:, 0], favorites[:, 1]]), return_inverse=True)
+    tag_ids, tag_cols = np.unique(item_tags[:, 1], return_inverse=True)
+    users, user_rows = np.unique(favorites[:, 0], return_inverse=True)
+
+    item_tag = sparse.csr_matrix(
+        (np.ones(len(item_tags)), (inverse[:len(item_tags)], tag_cols)),
+        shape=(len(items), len(tag_ids)),
+    )
+    norms = np.sqrt(np.asarray(item_tag.multiply(item_tag).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    item_tag = (sparse.diags(1 / norms) @ item_tag).tocsr()
+
+    user_item = sparse.csr_matrix(
+        (np.ones(len(favorites)), (user_rows, inverse[len(item_tags):])),
+        shape=(len(users), len(items)),
+    )
+    item_tag_t = item_tag.T.tocsc()
+
+    for start in range(0, len(users), USER_BATCH):
+        seen = user_item[start:start + USER_BATCH]
+        scores = (seen @ item_tag @ item_tag_t).tocsr()
+        # Already favourited items are not recommended again.
+        scores = (scores - scores.multiply(seen.astype(bool))).tocsr()
+        scores.eliminate_zeros()
+        for row in range(scores.shape[0]):
+            lo, hi = scores.indptr[row], scores.indptr[row + 1]
+            values, cols = scores.data[lo:hi], scores.indices[lo:hi]
+            if len(values) > top_k:
+                keep = np.argpartition(-values, top_k)[:top_k]
+                values, cols = values[keep], cols[keep]
+            order = np.lexsort((items[cols], -values))
+            yield int(users[start + row]), [
+                (int(items[c]), float(v)) for c, v in zip(cols[order], values[order])
+            ]
+
+
+def _save(results, clear_users):
+    stale = Recommendation.objects.all()
+    if clear_users is not None:
+        stale = stale.filter(user_id__in=clear_users)
+    with transaction.atomic():
+        stale.delete()
+        batch = []
+        for user_id, ranked in results:
+            batch += [Recommendation(user_id=user_id, item_id=i, score=s) for i, s in ranked]
+            if len(batch) >= WRITE_BATCH:
+                Recommendation.objects.bulk_create(batch)
+                batch = []
+        Recommendation.objects.bulk_create(batch)
+
+
+def rebuild(top_k=TOP_K):
+    """Recompute recommendations for every user with favourites."""
+    tags = Equipment.tags.through.objects.all()
+    favorites = _pairs(Favorite.objects.all(), 'user_id', 'item_id')
+    results = list(score(favorites, _pairs(tags, 'equipment_id', 'tag_id'), top_k))
+    _save(results, None)
+    return len(results)
+
+
+def refresh_user(user_id, top_k=TOP_K):
+    """Recompute one user's rows, reading only the items that share a tag with their favourites."""
+    if not is_available():
+        return
+    tags = Equipment.tags.through.objects.all()
+    favorite_ids = Favorite.objects.filter(user_id=user_id).values('item_id')
+    candidates = tags.filter(
+        tag_id__in=tags.filter(equipment_id__in=favorite_ids).values('tag_id')
+    ).values('equipment_id')
+    favorites = _pairs(Favorite.objects.filter(user_id=user_id), 'user_id', 'item_id')
+    item_tags = _pairs(tags.filter(equipment_id__in=candidates), 'equipment_id', 'tag_id')
+    _save(score(favorites, item_tags, top_k), [user_id])
@@ -0,0 +1,32 @@
+"""
+Optional read/write split (DATABASE_ROUTERS = ['api.routers.ReadWriteRouter']).
+
+Reads go through the READ_DATABASE alias, a second connection to the same
+SQLite file opened with `PRAGMA query_only` (see catalog/settings.py), so
+plain reads can never take the write lock or queue behind a writer's
+transaction. Writes, and reads made inside a transaction on the default
+database (which must see its own uncommitted rows), stay on 'default'.
+Both aliases point at one file, so there is no replication lag.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+def read_alias():
+    return getattr(settings, 'READ_DATABASE', 'read')
+
+
+class ReadWriteRouter:
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,131 @@
+import re
+from functools import cache
+
+from django.db import connection
+from django.db.models import Lookup
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Equipment, EquipmentSearchIndex, Tag, Category
+
+# -----------------------
+# SQLite FTS5 index over Equipment
+# -----------------------
+FTS_TABLE = 'api_equipment_fts'
+
+# bm25() column weights: name, description, tags, categories
+RANK_WEIGHTS = (10.0, 1.0, 5.0, 3.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_available():
+    return connection.vendor == 'sqlite' and has_fts5()
+
+
+@cache
+def has_fts5():
+    """Whether this SQLite build has FTS5; probed once per process."""
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+
+
+class Match(Lookup):
+    """`document MATCH %s` on EquipmentSearchIndex."""
+    lookup_name = 'match'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', (*lhs_params, *rhs_params)
+
+
+EquipmentSearchIndex._meta.get_field('document').register_lookup(Match)
+
+
+def _source_sql(where=''):
+    equipment = Equipment._meta.db_table
+    tags_through = Equipment.tags.through._meta.db_table
+    categories_through = Equipment.categories.through._meta.db_table
+    return f"""
+        SELECT e.id, e.name, e.description,
+            (SELECT group_concat(t.name, ' ') FROM {tags_through} et
+                JOIN {Tag._meta.db_table} t ON t.id = et.tag_id WHERE et.equipment_id = e.id),
+            (SELECT group_concat(c.name, ' ') FROM {categories_through} ec
+                JOIN {Category._meta.db_table} c ON c.id = ec.category_id WHERE ec.equipment_id = e.id)
+        FROM {equipment} e {where}
+    """
+
+
+def index_items(item_ids):
+    """(Re)write the index rows of the given items; missing items are just dropped."""
+    item_ids = list(item_ids)
+    if not item_ids or not is_available():
+        return
+    placeholders = ', '.join(['%s'] * len(item_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", item_ids)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, name, description, tags, categories) "
+            + _source_sql(f"WHERE e.id IN ({placeholders})"),
+            item_ids,
+        )
+
+
+def remove_items(item_ids):
+    item_ids = list(item_ids)
+    if not item_ids or not is_available():
+        return
+    placeholders = ', '.join(['%s'] * len(item_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", item_ids)
+
+
+def rebuild():
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}(rowid, name, description, tags, categories) " + _source_sql())
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def build_match(terms):
+    """Turn free text into an FTS5 query: every word must match, as a prefix."""
+    words = TOKEN_RE.findall(' '.join(terms))
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# -----------------------
+# DRF filter backend
+# -----------------------
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    `?search=` through the FTS5 index, ranked by BM25.
+
+    Matching rows get a `search_rank` annotation (lower is better) that
+    KeysetPagination uses as the page key. Falls back to SearchFilter's
+    icontains lookups on databases without FTS5.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not is_available():
+            return super().filter_queryset(request, queryset, view)
+        match = build_match(self.get_search_terms(request))
+        if not match:
+            return queryset
+
+        weights = ', '.join(str(w) for w in RANK_WEIGHTS)
+        # The index is joined on rowid, so MATCH runs once for the whole query
+        # and bm25() ranks the row it is on; a correlated subquery would run it
+        # again for every result.
+        return queryset.filter(search_index__document__match=match).annotate(
+            search_rank=RawSQL(f"bm25({FTS_TABLE}, {weights})", [])
+        )
+
+    def get_keyset_ordering(self, request, view):
+        if is_available() and build_match(self.get_search_terms(request)):
+            return ('search_rank', 'id')
+        return None
@@ -0,0 +1,142 @@
+"""
+Synthetic catalog data for local benchmarking (`manage.py seed_data`).
+
+Everything is written with bulk_create in batches. Popularity follows a Zipf
+law with exponent `skew`: a few authors own most items, a few users attract
+most followers and a few items get most comments, likes and ratings, as in a
+real catalog. `skew=0` gives uniform data. bulk_create bypasses signals, so
+counters, the search index and stats are rebuilt once at the end.
+"""
+import io
+import random
+import uuid
+from functools import lru_cache
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import transaction
+
+from . import cache, search, stats
+from .models import Profile, Follow, Category, Tag, Equipment, Comment, Like, Rating, Favorite
+
+BATCH_SIZE = 1000
+WORDS = (
+    'tent', 'kayak', 'drill', 'ladder', 'camera', 'tripod', 'bike', 'helmet', 'stove', 'lantern',
+    'saw', 'projector', 'speaker', 'sled', 'skis', 'board', 'rope', 'jack', 'mixer', 'grill',
+)
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(n, skew):
+    """Cumulative weights of ranks 1..n under a Zipf law, for random.choices."""
+    return tuple(accumulate(1 / rank ** skew for rank in range(1, n + 1)))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Seeder:
+    def __init__(self, seed=None, skew=1.1, batch_size=BATCH_SIZE):
+        self.rng = random.Random(seed)
+        self.skew = skew
+        self.batch_size = batch_size
+        self.counts = {}
+
+    def choose(self, population, k=1):
+        return self.rng.choices(population, cum_weights=zipf_weights(len(population), self.skew), k=k)
+
+    def pairs(self, left, right, total):
+        """Up to `total` distinct (left, right) pairs, uniform on the left and skewed on the right."""
+        found = set()
+        if not left or not right:
+            return found
+        # Duplicates are dropped, so give up after a bounded number of rounds.
+        for _ in range(5):
+            missing = total - len(found)
+            if missing <= 0:
+                break
+            found.update(
+                (a, b) for a, b in zip(self.rng.choices(left, k=missing), self.choose(right, missing)) if a != b
+            )
+        return found
+
+    def save(self, model, objects):
+        created = 0
+        for batch in batched(objects, self.batch_size):
+            created += len(model.objects.bulk_create(batch, batch_size=self.batch_size))
+        self.counts[model._meta.model_name] = self.counts.get(model._meta.model_name, 0) + created
+
+    def run(self, users=100, items=1000, tags=50, categories=10, follows=2000,
+            favorites=2000, comments=5000, likes=5000, ratings=2000):
+        run = uuid.uuid4().hex[:6]
+        # One hash for every account: hashing per user would dominate the run.
+        password = make_password('seed-password')
+
+        with transaction.atomic():
+            self.save(User, (
+                User(username=f'seed_{run}_{i}', email=f'seed_{run}_{i}@example.com', password=password)
+                for i in range(users)
+            ))
+            user_ids = list(User.objects.filter(username__startswith=f'seed_{run}_').order_by('pk')
+                            .values_list('pk', flat=True))
+            self.save(Profile, (Profile(user_id=pk) for pk in user_ids))
+            profile_ids = dict(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'pk'))
+
+            self.save(Category, (Category(name=f'category {run} {i}') for i in range(categories)))
+            self.save(Tag, (Tag(name=f'{self.rng.choice(WORDS)}-{run}-{i}') for i in range(tags)))
+            category_ids = list(Category.objects.filter(name__startswith=f'category {run} ')
+                                .order_by('pk').values_list('pk', flat=True))
+            tag_ids = list(Tag.objects.filter(name__contains=f'-{run}-').order_by('pk').values_list('pk', flat=True))
+
+            authors = self.choose(user_ids, items) if user_ids else []
+            self.save(Equipment, (
+                Equipment(
+                    name=f'{self.rng.choice(WORDS)} {i}',
+                    description=' '.join(self.rng.choices(WORDS, k=12)),
+                    price_per_day=self.rng.randint(100, 50000) / 100,
+                    public=self.rng.random() > 0.1,
+                    author_id=author,
+                )
+                for i, author in enumerate(authors)
+            ))
+            item_ids = list(Equipment.objects.filter(author_id__in=user_ids).order_by('pk')
+                            .values_list('pk', flat=True))
+
+            if category_ids:
+                self.save(Equipment.categories.through, (
+                    Equipment.categories.through(equipment_id=item, category_id=category)
+                    for item in item_ids for category in set(self.choose(category_ids, self.rng.randint(1, 2)))
+                ))
+            if tag_ids:
+                self.save(Equipment.tags.through, (
+                    Equipment.tags.through(equipment_id=item, tag_id=tag)
+                    for item in item_ids for tag in set(self.choose(tag_ids, self.rng.randint(1, 4)))
+                ))
+
+            self.save(Follow, (Follow(follower_id=a, following_id=b)
+                               for a, b in self.pairs(user_ids, user_ids, follows)))
+            self.save(Favorite, (Favorite(user_id=u, item_id=i)
+                                 for u, i in self.pairs(user_ids, item_ids, favorites)))
+            self.save(Rating, (Rating(user_id=u, item_id=i, value=self.rng.randint(1, 5))
+                               for u, i in self.pairs(user_ids, item_ids, ratings)))
+            self.save(Like, (Like(user_id=profile_ids[u], item_id=i)
+                             for u, i in self.pairs(user_ids, item_ids, likes)))
+            if user_ids and item_ids:
+                commented = self.choose(item_ids, comments)
+                self.save(Comment, (
+                    Comment(item_id=item, author_id=self.rng.choice(user_ids),
+                            text=' '.join(self.rng.choices(WORDS, k=8)))
+                    for item in commented
+                ))
+
+        call_command('rebuild_counters', stdout=io.StringIO())
+        if search.is_available():
+            search.rebuild()
+        stats.reconcile()
+        cache.invalidate_catalog()
+        return self.counts
@@ -2,7 +2,16 @@ from rest_framework import serializers
 from .models import Equipment, Comment, EquipmentList, Profile, Like, Rating, History, Follow, Notification, Category, Tag, Favorite, CommentLike, CommentRating, TagSubscription, CategorySubscription
 from django.contrib.auth.models import User
 import os
-class RegisterSerializer(serializers.ModelSerializer):
+from . import images
+from .metrics import TimedSerializerMixin
+from .uploads import MAX_FILE_SIZE
+
+
+class ModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Serializer time is reported per request by PerformanceMiddleware.
+    pass
+
+class RegisterSerializer(ModelSerializer):
     password = serializers.CharField(write_only=True)
 
     class Meta:
@@ -20,56 +29,60 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name']
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email')
 
-class EquipmentSerializer(serializers.ModelSerializer):
+class EquipmentSerializer(ModelSerializer):
     author = UserSerializer(read_only=True)
     image_url = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     file_url = serializers.SerializerMethodField()
-    like_count = serializers.SerializerMethodField()
-    avg_rating = serializers.SerializerMethodField()
-    likes = serializers.IntegerField(source='likes.count', read_only=True)
-    rating = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(read_only=True)
+    avg_rating = serializers.FloatField(source='average_rating', read_only=True)
+    likes = serializers.IntegerField(source='like_count', read_only=True)
+    rating = serializers.FloatField(source='average_rating', read_only=True)
     categories = CategorySerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
 
     class Meta:
         model = Equipment
         fields = '__all__'
-        read_only_fields = ('id', 'created_at', 'author')
+        read_only_fields = ('id', 'created_at', 'author', 'rating_count', 'rating_sum')
 
     def get_image_url(self, obj):
         if obj.image:
             return obj.image.url
         return None
 
+    def get_image_variants(self, obj):
+        return images.urls(obj.image_variants, obj.image.name or None)
+
     def get_file_url(self, obj):
         if obj.file:
             return obj.file.url
         return None
 
-    def get_like_count(self, obj):
-        return obj.likes.count()
-
-    def get_avg_rating(self, obj):
-        ratings = obj.ratings.all().values_list('value', flat=True)
-        return round(sum(ratings) / len(ratings), 2) if ratings else 0
+    def validate(self, attrs):
+        # Files rejected while streaming in (api/uploads.py) never reach validate_file.
+        upload_errors = getattr(self.context.get('request'), 'upload_errors', None)
+        if upload_errors:
+            raise serializers.ValidationError(upload_errors)
+        return attrs
 
     def validate_file(self, value):
-        max_size = 5 * 1024 * 1024
+        max_size = MAX_FILE_SIZE
         if value.size > max_size:
             raise serializers.ValidationError("Файл көлемі 5MB-тан аспауы керек.")
         ext = os.path.splitext(value.name)[1].lower()
@@ -78,88 +91,89 @@ class EquipmentSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Рұқсат етілген форматтар: JPG, PNG, PDF.")
         return value
 
-    def get_rating(self, obj):
-        ratings = obj.ratings.all()
-        if ratings:
-            return round(sum(r.value for r in ratings) / ratings.count(), 2)
-        return 0
-
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(ModelSerializer):
+    # Rendered from select_related('author'): Comment.objects.with_related()
     author = serializers.StringRelatedField(read_only=True)
+    avg_rating = serializers.FloatField(source='average_rating', read_only=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'author', 'text', 'created_at']
-        read_only_fields = ('author', 'created_at')
+        fields = ['id', 'author', 'text', 'created_at', 'like_count', 'rating_count', 'avg_rating']
+        read_only_fields = ('author', 'created_at', 'like_count', 'rating_count')
 
-class EquipmentListSerializer(serializers.ModelSerializer):
+class EquipmentListSerializer(ModelSerializer):
     items = EquipmentSerializer(many=True, read_only=True)
 
     class Meta:
         model = EquipmentList
         fields = ('id', 'name', 'items', 'created_at')
 
-class ProfileSerializer(serializers.ModelSerializer):
+class ProfileSerializer(ModelSerializer):
+    avatar_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Profile
-        fields = ['id', 'user', 'avatar', 'bio']
+        fields = ['id', 'user', 'avatar', 'avatar_variants', 'bio']
+
+    def get_avatar_variants(self, obj):
+        return images.urls(obj.avatar_variants, obj.avatar.name or None)
 
-class LikeSerializer(serializers.ModelSerializer):
+class LikeSerializer(ModelSerializer):
     class Meta:
         model = Like
         fields = "__all__"
 
-class RatingSerializer(serializers.ModelSerializer):
+class RatingSerializer(ModelSerializer):
     class Meta:
         model = Rating
         fields = "__all__"
 
 
-class HistorySerializer(serializers.ModelSerializer):
+class HistorySerializer(ModelSerializer):
     class Meta:
         model = History
         fields = ['id', 'user', 'action', 'created_at']
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(ModelSerializer):
     class Meta:
         model = Follow
         fields = ['id', 'follower', 'following']
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'message', 'is_read', 'created_at']
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(ModelSerializer):
     class Meta:
         model = Favorite
         fields = ['id', 'item', 'is_public', 'created_at']
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(ModelSerializer):
     class Meta:
         model = TagSubscription
         fields = '__all__'
 
-class CommentLikeSerializer(serializers.ModelSerializer):
+class CommentLikeSerializer(ModelSerializer):
     class Meta:
         model = CommentLike
         fields = '__all__'
 
-class CommentRatingSerializer(serializers.ModelSerializer):
+class CommentRatingSerializer(ModelSerializer):
     class Meta:
         model = CommentRating
         fields = '__all__'
 
-class TagSubscriptionSerializer(serializers.ModelSerializer):
+class TagSubscriptionSerializer(ModelSerializer):
     class Meta:
         model = TagSubscription
         fields = '__all__'
         read_only_fields = ('user', 'created_at')
 
-class CategorySubscriptionSerializer(serializers.ModelSerializer):
+class CategorySubscriptionSerializer(ModelSerializer):
     class Meta:
         model = CategorySubscription
         fields = '__all__'
@@ -1,7 +1,12 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F, Subquery
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Follow, Notification, Profile, Equipment, History
+from . import authentication, cache, feed, history, images, metrics, recommender, search, stats, streams, tasks, uploads
+from .models import Profile, Equipment, Like, Rating, Tag, Category, Favorite, Comment, Follow, Stats, \
+    FileReference, Notification, CommentLike, CommentRating
 
 
 @receiver(post_save, sender=User)
@@ -11,17 +16,390 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=Equipment)
 def log_item(sender, instance, created, **kwargs):
-    if created:
-        History.objects.create(user=instance.author, action=f"Added item {instance.name}")
-    else:
-        History.objects.create(user=instance.author, action=f"Updated item {instance.name}")
+    verb = "Added" if created else "Updated"
+    history.record(instance.author_id, f"{verb} item {instance.name}")
 
 @receiver(post_save, sender=Equipment)
 def notify_followers(sender, instance, created, **kwargs):
     if created:
-        followers = Follow.objects.filter(following=instance.author)
-        for f in followers:
-            Notification.objects.create(
-                user=f.follower,
-                message=f"Пользователь {instance.author.username} добавил новый объект {instance.name}"
-            )
\ No newline at end of file
+        # Fanned out by the background worker (api/tasks.py), after the item is committed.
+        message = f"Пользователь {instance.author.username} добавил новый объект {instance.name}"
+        transaction.on_commit(lambda: tasks.enqueue(
+            'notify_followers', item_id=instance.pk, author_id=instance.author_id, message=message,
+        ))
+
+# -----------------------
+# Following feed timelines (api/feed.py)
+# -----------------------
+@receiver(post_save, sender=Equipment)
+def fan_out_item(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: tasks.enqueue(
+            'fan_out_item', item_id=instance.pk, author_id=instance.author_id,
+        ))
+
+@receiver(post_save, sender=Follow)
+def follow_timeline(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill(instance.follower_id, instance.following_id)
+
+@receiver(post_delete, sender=Follow)
+def unfollow_timeline(sender, instance, **kwargs):
+    feed.forget(instance.follower_id, instance.following_id)
+
+# -----------------------
+# Equipment counters: like_count, rating_count, rating_sum
+# -----------------------
+def bump_counters(item_id, **deltas):
+    Equipment.objects.filter(pk=item_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+@receiver(pre_save, sender=Like)
+@receiver(pre_save, sender=Rating)
+def remember_previous(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk:
+        fields = ('item_id', 'value') if sender is Rating else ('item_id',)
+        instance._previous = sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+@receiver(post_save, sender=Like)
+def like_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        bump_counters(instance.item_id, like_count=1)
+    elif previous['item_id'] != instance.item_id:
+        bump_counters(previous['item_id'], like_count=-1)
+        bump_counters(instance.item_id, like_count=1)
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, **kwargs):
+    bump_counters(instance.item_id, like_count=-1)
+
+@receiver(post_save, sender=Rating)
+def rating_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        bump_counters(instance.item_id, rating_count=1, rating_sum=instance.value)
+    elif previous['item_id'] != instance.item_id:
+        bump_counters(previous['item_id'], rating_count=-1, rating_sum=-previous['value'])
+        bump_counters(instance.item_id, rating_count=1, rating_sum=instance.value)
+    elif previous['value'] != instance.value:
+        bump_counters(instance.item_id, rating_sum=instance.value - previous['value'])
+
+@receiver(post_delete, sender=Rating)
+def rating_deleted(sender, instance, **kwargs):
+    bump_counters(instance.item_id, rating_count=-1, rating_sum=-instance.value)
+
+# -----------------------
+# Comment counters: like_count, rating_count, rating_sum
+# -----------------------
+def bump_comment_counters(comment_id, **deltas):
+    Comment.objects.filter(pk=comment_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+@receiver(pre_save, sender=CommentLike)
+@receiver(pre_save, sender=CommentRating)
+def remember_previous_comment_vote(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk:
+        fields = ('comment_id', 'value') if sender is CommentRating else ('comment_id',)
+        instance._previous = sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+@receiver(post_save, sender=CommentLike)
+def comment_like_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        bump_comment_counters(instance.comment_id, like_count=1)
+    elif previous['comment_id'] != instance.comment_id:
+        bump_comment_counters(previous['comment_id'], like_count=-1)
+        bump_comment_counters(instance.comment_id, like_count=1)
+
+@receiver(post_delete, sender=CommentLike)
+def comment_like_deleted(sender, instance, **kwargs):
+    bump_comment_counters(instance.comment_id, like_count=-1)
+
+@receiver(post_save, sender=CommentRating)
+def comment_rating_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    if previous is None:
+        bump_comment_counters(instance.comment_id, rating_count=1, rating_sum=instance.value)
+    elif previous['comment_id'] != instance.comment_id:
+        bump_comment_counters(previous['comment_id'], rating_count=-1, rating_sum=-previous['value'])
+        bump_comment_counters(instance.comment_id, rating_count=1, rating_sum=instance.value)
+    elif previous['value'] != instance.value:
+        bump_comment_counters(instance.comment_id, rating_sum=instance.value - previous['value'])
+
+@receiver(post_delete, sender=CommentRating)
+def comment_rating_deleted(sender, instance, **kwargs):
+    bump_comment_counters(instance.comment_id, rating_count=-1, rating_sum=-instance.value)
+
+# -----------------------
+# Full-text search index
+# -----------------------
+@receiver(post_save, sender=Equipment)
+def index_item(sender, instance, **kwargs):
+    search.index_items([instance.pk])
+
+@receiver(post_delete, sender=Equipment)
+def unindex_item(sender, instance, **kwargs):
+    search.remove_items([instance.pk])
+
+@receiver(m2m_changed, sender=Equipment.tags.through)
+@receiver(m2m_changed, sender=Equipment.categories.through)
+def index_item_relations(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            search.index_items([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_item_ids = list(instance.items.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        search.index_items(getattr(instance, '_cleared_item_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        search.index_items(pk_set)
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Category)
+def index_renamed_label(sender, instance, created, **kwargs):
+    if not created:
+        search.index_items(instance.items.values_list('pk', flat=True))
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Category)
+def remember_labelled_items(sender, instance, **kwargs):
+    instance._labelled_item_ids = list(instance.items.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Category)
+def index_deleted_label(sender, instance, **kwargs):
+    search.index_items(getattr(instance, '_labelled_item_ids', []))
+
+# -----------------------
+# Recommendations
+# -----------------------
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def refresh_recommendations(sender, instance, **kwargs):
+    transaction.on_commit(lambda: recommender.refresh_user(instance.user_id))
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def favorites_changed(sender, instance, **kwargs):
+    cache.invalidate_user_interests(instance.user_id)
+    transaction.on_commit(lambda: cache.invalidate_user_interests(instance.user_id))
+
+# -----------------------
+# Materialized statistics
+# -----------------------
+def like_owner(like):
+    return Subquery(Profile.objects.filter(pk=like.user_id).values('user_id'))
+
+@receiver(post_save, sender=User)
+def user_stats_created(sender, instance, created, **kwargs):
+    if created:
+        Stats.objects.create(user=instance)
+        stats.bump(fields=['users'])
+
+@receiver(post_delete, sender=User)
+def user_stats_deleted(sender, instance, **kwargs):
+    stats.bump(delta=-1, fields=['users'])
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Like)
+@receiver(post_save, sender=Rating)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Category)
+def stats_created(sender, instance, created, **kwargs):
+    if created:
+        bump_stats(sender, instance, 1)
+
+@receiver(post_delete, sender=Equipment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Like)
+@receiver(post_delete, sender=Rating)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Category)
+def stats_deleted(sender, instance, **kwargs):
+    bump_stats(sender, instance, -1)
+
+def bump_stats(sender, instance, delta):
+    if sender is Equipment:
+        stats.bump(instance.author_id, delta, fields=['items'])
+    elif sender is Comment:
+        stats.bump(instance.author_id, delta, fields=['comments'])
+    elif sender is Like:
+        stats.bump(like_owner(instance), delta, fields=['likes'])
+    elif sender is Rating:
+        stats.bump(instance.user_id, delta, fields=['ratings'])
+    elif sender is Follow:
+        stats.bump(instance.follower_id, delta, fields=['follows'])
+        stats.bump(instance.following_id, delta, fields=['followers'], include_global=False)
+        # Checked after the count changed, in the same transaction (api/feed.py).
+        if delta < 0 and feed.fell_to_limit(instance.following_id):
+            transaction.on_commit(lambda: tasks.enqueue('backfill_followers', author_id=instance.following_id))
+    elif sender is Category:
+        stats.bump(delta=delta, fields=['categories'])
+
+@receiver(pre_save, sender=Notification)
+def remember_read_state(sender, instance, **kwargs):
+    instance._was_read = None
+    if instance.pk:
+        instance._was_read = sender.objects.filter(pk=instance.pk).values_list('is_read', flat=True).first()
+
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, **kwargs):
+    # Notifications fanned out with bulk_create are counted in tasks.notify_followers.
+    was_read = True if created else getattr(instance, '_was_read', None)
+    if was_read is None or was_read == instance.is_read:
+        return
+    delta = -1 if instance.is_read else 1
+    stats.bump(instance.user_id, delta, fields=['unread_notifications'], include_global=False)
+
+@receiver(post_delete, sender=Notification)
+def notification_deleted(sender, instance, **kwargs):
+    if not instance.is_read:
+        stats.bump(instance.user_id, -1, fields=['unread_notifications'], include_global=False)
+
+# -----------------------
+# Notification stream (api/streams.py)
+# -----------------------
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: streams.publish([instance]))
+
+# -----------------------
+# Catalog response cache version (api/cache.py)
+# -----------------------
+@receiver(post_save, sender=Equipment)
+@receiver(post_delete, sender=Equipment)
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    cache.invalidate_catalog()
+
+# Items render their author through UserSerializer; no other User field is in the catalog.
+AUTHOR_FIELDS = ('username', 'email')
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(sender, instance, update_fields=None, **kwargs):
+    instance._previous_author = None
+    if instance.pk and (update_fields is None or set(update_fields) & set(AUTHOR_FIELDS)):
+        instance._previous_author = sender.objects.filter(pk=instance.pk).values_list(*AUTHOR_FIELDS).first()
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_author', None)
+    if previous is not None and previous != tuple(getattr(instance, field) for field in AUTHOR_FIELDS):
+        cache.invalidate_catalog()
+
+@receiver(m2m_changed, sender=Equipment.tags.through)
+@receiver(m2m_changed, sender=Equipment.categories.through)
+def catalog_relations_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        cache.invalidate_catalog()
+
+# -----------------------
+# Image variants
+# -----------------------
+@receiver(pre_save, sender=Equipment)
+@receiver(pre_save, sender=Profile)
+def remember_previous_variants(sender, instance, **kwargs):
+    _, variants_field, _ = images.spec_for(sender)
+    instance._previous_variants = None
+    if instance.pk:
+        instance._previous_variants = sender.objects.filter(pk=instance.pk).values_list(
+            variants_field, flat=True).first()
+
+@receiver(post_save, sender=Equipment)
+@receiver(post_save, sender=Profile)
+def queue_image_variants(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_variants', None)
+    image_field, _, _ = images.spec_for(sender)
+    if previous and previous.get('source') != (getattr(instance, image_field).name or None):
+        # The variants of the replaced image, once the new one is committed.
+        transaction.on_commit(lambda: images.delete_variants(previous))
+    if images.needs_variants(instance):
+        transaction.on_commit(lambda: tasks.enqueue(
+            'generate_image_variants', model=sender._meta.label_lower, pk=instance.pk,
+        ))
+
+# -----------------------
+# Content-addressed equipment files: reference counts
+# -----------------------
+def add_file_reference(name, content=None):
+    if not uploads.is_content_addressed(name):
+        return
+    reference, created = FileReference.objects.get_or_create(name=name, defaults={'ref_count': 1})
+    if not created:
+        FileReference.objects.filter(pk=reference.pk).update(ref_count=F('ref_count') + 1)
+    # Storage skips a name that exists, leaving the upload unread, and a pending
+    # delete_unreferenced_file() may have removed it since. With the reference
+    # held, put it back.
+    storage = uploads.equipment_file_storage()
+    if content is not None and not storage.exists(name):
+        content.seek(0)
+        storage.save(name, content)
+
+def drop_file_reference(name):
+    if not uploads.is_content_addressed(name):
+        return
+    FileReference.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    if FileReference.objects.filter(name=name, ref_count=0).delete()[0]:
+        # Deleted after commit, so a rolled back transaction never loses the file.
+        transaction.on_commit(lambda: delete_unreferenced_file(name))
+
+def delete_unreferenced_file(name):
+    # BEGIN IMMEDIATE holds the write lock, so no upload can take a reference
+    # between the check and the delete.
+    with transaction.atomic():
+        if not FileReference.objects.filter(name=name, ref_count__gt=0).exists():
+            uploads.equipment_file_storage().delete(name)
+
+@receiver(pre_save, sender=Equipment)
+def remember_previous_file(sender, instance, **kwargs):
+    instance._previous_file = None
+    # Kept for add_file_reference(): after save the field only holds the name.
+    instance._new_file = None if instance.file._committed else instance.file.file
+    if instance.pk:
+        instance._previous_file = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+
+@receiver(post_save, sender=Equipment)
+def count_file_references(sender, instance, **kwargs):
+    previous, current = getattr(instance, '_previous_file', None) or '', instance.file.name or ''
+    if previous != current:
+        add_file_reference(current, getattr(instance, '_new_file', None))
+        drop_file_reference(previous)
+
+@receiver(post_delete, sender=Equipment)
+def release_file_reference(sender, instance, **kwargs):
+    drop_file_reference(instance.file.name or '')
+
+# -----------------------
+# Cached JWT users (api/authentication.py)
+# -----------------------
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    authentication.forget_user(instance.pk)
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def forget_cached_profile(sender, instance, **kwargs):
+    authentication.forget_user(instance.user_id)
+
+# -----------------------
+# Request timing (api/metrics.py)
+# -----------------------
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    if metrics.execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, metrics.execute_wrapper)
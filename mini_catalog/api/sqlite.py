@@ -0,0 +1,37 @@
+"""
+SQLite tuning for concurrent use, applied to every new connection.
+
+With the default rollback journal a writer locks out all readers while it
+commits, and a transaction that reads before it writes (every signal that
+bumps a counter) fails at once with "database is locked" when another
+writer got there first: SQLite cannot wait on a lock upgrade. So, for each
+connection:
+
+* journal_mode=WAL: readers keep reading the last commit while one writer
+  appends to the log;
+* busy_timeout: a writer waits for the lock instead of failing;
+* synchronous=NORMAL: no fsync per commit in WAL mode (a power cut may lose
+  the last transactions, never corrupts the file);
+* mmap_size / cache_size: pages served from the OS page cache and a bigger
+  per-connection cache;
+* transactions start with BEGIN IMMEDIATE, taking the write lock up front
+  where busy_timeout applies, instead of upgrading it halfway through.
+
+All of it is set in DATABASES['default']['OPTIONS'] (catalog/settings.py):
+`transaction_mode` and an `init_command` that Django runs on every new
+connection. The read alias (api/routers.py) opens its connections with
+`PRAGMA query_only` and the same pragmas except journal_mode, which is a
+property of the file and set by the writers.
+"""
+PRAGMAS = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size')
+
+
+def pragmas(connection):
+    """Current values of the tuned pragmas on an open connection (for checks and the benchmark)."""
+    connection.ensure_connection()
+    values = {}
+    for name in PRAGMAS:
+        # In-memory databases have no mmap_size.
+        row = connection.connection.execute(f'PRAGMA {name}').fetchone()
+        values[name] = row[0] if row else None
+    return values
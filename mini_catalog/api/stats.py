@@ -0,0 +1,71 @@
+"""
+Materialized counters for UserStatsView and GlobalStatsView.
+
+Signals call `bump()` with the user a row belongs to; the user's Stats row and
+the global row (user=None) are adjusted in one UPDATE. `reconcile()` recounts
+everything from the source tables and is run periodically by
+`manage.py reconcile_stats`, which also repairs drift from bulk operations
+that bypass signals.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Stats, Equipment, Comment, Like, Rating, Follow, Category, Notification
+
+
+def bump(user_id=None, delta=1, *, fields, include_global=True):
+    scope = Q(user_id=user_id) if user_id is not None else Q(pk__in=[])
+    if include_global:
+        scope |= Q(user__isnull=True)
+    Stats.objects.filter(scope).update(**{field: F(field) + delta for field in fields})
+
+
+def bump_users(user_ids, delta=1, *, fields):
+    """Adjust many users' rows in one UPDATE (bulk inserts that bypass signals)."""
+    Stats.objects.filter(user_id__in=user_ids).update(**{field: F(field) + delta for field in fields})
+
+
+def _count(queryset, column):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{column: OuterRef('user_id')}).order_by().values(column)
+            .annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def reconcile(user_ids=None, include_global=True):
+    """Recount per-user rows (all, or only `user_ids`) and the global row."""
+    users = User.objects.all() if user_ids is None else User.objects.filter(pk__in=user_ids)
+    with transaction.atomic():
+        Stats.objects.get_or_create(user=None)
+        missing = users.filter(stats__isnull=True).values_list('pk', flat=True)
+        Stats.objects.bulk_create([Stats(user_id=pk) for pk in missing], ignore_conflicts=True)
+
+        rows = Stats.objects.filter(user__isnull=False)
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows.update(
+            items=_count(Equipment.objects.all(), 'author_id'),
+            comments=_count(Comment.objects.all(), 'author_id'),
+            likes=_count(Like.objects.all(), 'user__user_id'),
+            ratings=_count(Rating.objects.all(), 'user_id'),
+            follows=_count(Follow.objects.all(), 'follower_id'),
+            followers=_count(Follow.objects.all(), 'following_id'),
+            unread_notifications=_count(Notification.objects.filter(is_read=False), 'user_id'),
+        )
+        if not include_global:
+            return
+        Stats.objects.filter(user__isnull=True).update(
+            items=Equipment.objects.count(),
+            comments=Comment.objects.count(),
+            likes=Like.objects.count(),
+            ratings=Rating.objects.count(),
+            follows=Follow.objects.count(),
+            users=User.objects.count(),
+            categories=Category.objects.count(),
+        )
@@ -0,0 +1,290 @@
+"""
+Server-Sent Events stream of new notifications (GET /api/notifications/stream/).
+
+Runs under ASGI (`catalog/asgi.py`): each open stream is a coroutine waiting on
+its own queue, not a worker thread. Events reach the queues in two ways:
+
+* in-process pub/sub: a Notification committed in this process (signals,
+  tasks run in the web process) is published to its user's subscribers;
+* DB polling: notifications written by other processes (`run_worker`, other
+  web workers) are picked up by one poller per process, which reads
+  `id > last seen` for the connected users every
+  NOTIFICATION_STREAM_POLL_INTERVAL seconds - one query per interval,
+  however many clients are connected.
+
+EventSource cannot set headers, and a JWT in the query string would end up in
+access logs. A browser therefore first POSTs (with its JWT) to
+/api/notifications/stream/ticket/ and opens the stream with `?ticket=`. The
+ticket is random, lives NOTIFICATION_STREAM_TICKET_TTL seconds in the cache and
+is deleted by the first stream that presents it. Clients that can set headers
+send the JWT in Authorization, and a session cookie works as well.
+
+Event ids are notification ids, so a reconnecting EventSource sends
+`Last-Event-ID` and receives what it missed; duplicates from the two paths
+are dropped by id. A comment line is sent every
+NOTIFICATION_STREAM_HEARTBEAT seconds to keep proxies from closing the
+connection.
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .authentication import CachedJWTAuthentication
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+BACKLOG = 100
+QUEUE_SIZE = 100
+RETRY_MS = 3000
+TICKET_PREFIX = 'streams:ticket:'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def serialize(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: notification\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+# -----------------------
+# In-process pub/sub
+# -----------------------
+class Subscription:
+    def __init__(self, user_id, after_id, loop):
+        self.user_id = user_id
+        self.after_id = after_id
+        self.last_id = after_id
+        self.loop = loop
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        # Recently sent ids: both delivery paths may carry the same row, and
+        # rows committed by other processes can arrive slightly out of order.
+        self.sent = deque(maxlen=QUEUE_SIZE * 2)
+        # Set when the queue overflowed: the stream re-reads from the database.
+        self.lagging = False
+
+    def offer(self, event):
+        # Called from any thread; the queue belongs to the subscriber's loop.
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The loop is closed: the stream is gone without having cleaned up.
+            broker.unsubscribe(self)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagging = True
+
+    def accept(self, event):
+        if event['id'] <= self.after_id or event['id'] in self.sent:
+            return False
+        self.sent.append(event['id'])
+        self.last_id = max(self.last_id, event['id'])
+        return True
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.pollers = {}
+
+    def subscribe(self, user_id, after_id):
+        loop = asyncio.get_running_loop()
+        subscription = Subscription(user_id, after_id, loop)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscription)
+            start_poller = loop not in self.pollers and _setting('NOTIFICATION_STREAM_POLL_INTERVAL', 2.0)
+            if start_poller:
+                self.pollers[loop] = loop.create_task(self.poll(loop))
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscribers.pop(subscription.user_id, None)
+
+    def has_subscribers(self, user_id=None):
+        return bool(self.subscribers.get(user_id) if user_id is not None else self.subscribers)
+
+    def publish(self, user_id, event):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.offer(event)
+
+    async def poll(self, loop):
+        """Publish notifications inserted by other processes, while this loop has subscribers."""
+        interval = _setting('NOTIFICATION_STREAM_POLL_INTERVAL', 2.0)
+        cursor = None
+        try:
+            while True:
+                with self.lock:
+                    local = [s for subscriptions in self.subscribers.values() for s in subscriptions
+                             if s.loop is loop]
+                    if not local:
+                        # Removed under the lock, so a new subscriber starts a new poller.
+                        self.pollers.pop(loop, None)
+                        return
+                users = list({s.user_id for s in local})
+                if cursor is None:
+                    # Later subscribers read what precedes the cursor as their backlog.
+                    cursor = min(s.after_id for s in local)
+                try:
+                    await asyncio.sleep(interval)
+                    for notification in await sync_to_async(fetch_since)(users, cursor):
+                        cursor = max(cursor, notification.id)
+                        self.publish(notification.user_id, serialize(notification))
+                except DatabaseError:
+                    logger.exception("Notification stream poll failed")
+        finally:
+            with self.lock:
+                if self.pollers.get(loop) is asyncio.current_task():
+                    self.pollers.pop(loop)
+
+
+broker = Broker()
+
+
+def publish(notifications):
+    """Push committed notifications to subscribers in this process (no-op without any)."""
+    if not broker.has_subscribers():
+        return
+    for notification in notifications:
+        if broker.has_subscribers(notification.user_id):
+            broker.publish(notification.user_id, serialize(notification))
+
+
+def latest_id():
+    return Notification.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def fetch_since(users, after_id, limit=1000):
+    return list(Notification.objects.filter(user_id__in=users, id__gt=after_id).order_by('id')[:limit])
+
+
+def backlog(user_id, after_id):
+    return list(
+        Notification.objects.filter(user_id=user_id, id__gt=after_id).order_by('id')[:BACKLOG]
+    )
+
+
+# -----------------------
+# Stream tickets
+# -----------------------
+def ticket_ttl():
+    return _setting('NOTIFICATION_STREAM_TICKET_TTL', 30)
+
+
+def issue_ticket(user_id):
+    ticket = secrets.token_urlsafe(32)
+    cache.set(TICKET_PREFIX + ticket, user_id, ticket_ttl())
+    return ticket
+
+
+async def redeem_ticket(ticket):
+    """The user the ticket was issued to, or None; a ticket opens one stream only."""
+    key = TICKET_PREFIX + ticket
+    user_id = await cache.aget(key)
+    # Of two streams presenting the same ticket, only one deletes it.
+    if user_id is None or not await cache.adelete(key):
+        return None
+    return await User.objects.filter(pk=user_id, is_active=True).afirst()
+
+
+# -----------------------
+# SSE view
+# -----------------------
+def authenticate(request):
+    """JWT from the Authorization header; never from the query string."""
+    auth = CachedJWTAuthentication()
+    try:
+        header = auth.get_header(request)
+        raw = auth.get_raw_token(header) if header else None
+        if not raw:
+            return None
+        return auth.get_user(auth.get_validated_token(raw))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def last_event_id(request):
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def stream(user_id, after_id):
+    heartbeat = _setting('NOTIFICATION_STREAM_HEARTBEAT', 15)
+    subscription = broker.subscribe(user_id, after_id)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        missed = await sync_to_async(backlog)(user_id, after_id)
+        while True:
+            for notification in missed:
+                event = serialize(notification)
+                if subscription.accept(event):
+                    yield format_event(event)
+            if len(missed) == BACKLOG:
+                # More was missed than one page; keep replaying before going live.
+                missed = await sync_to_async(backlog)(user_id, missed[-1].id)
+                continue
+            missed = []
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if subscription.accept(event):
+                yield format_event(event)
+            if subscription.lagging:
+                subscription.lagging = False
+                missed = await sync_to_async(backlog)(user_id, subscription.last_id)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def notification_stream(request):
+    user = await sync_to_async(authenticate)(request)
+    if user is None and request.GET.get('ticket'):
+        user = await redeem_ticket(request.GET['ticket'])
+    if user is None:
+        user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    after_id = last_event_id(request)
+    if after_id is None:
+        # A new connection starts from now; only reconnects replay.
+        after_id = await sync_to_async(latest_id)()
+    response = StreamingHttpResponse(stream(user.id, after_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,272 @@
+"""
+A small DB-backed task queue, so slow work runs outside the request.
+
+`enqueue()` stores a Task row; `manage.py run_worker` claims pending rows,
+runs the registered function and retries failures with exponential backoff.
+Past TASKS_QUEUE_MAX pending rows enqueue() raises QueueFull, which API views
+answer with 503; a task queuing its next chunk fails and is retried later.
+The pending count is cached for TASKS_QUEUE_COUNT_TTL seconds and bumped on
+each enqueue, so the check costs no query in between.
+
+Tasks registered with `@task(atomic=True)` run in one transaction with the
+removal of their Task row, so a chunk that committed is never run again, even
+when the worker dies right after it or its lease ran out meanwhile.
+"""
+import logging
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache as backend
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+
+from . import cache, feed, images, stats, streams
+from .models import Task, Follow, Notification, Equipment, TimelineEntry
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+PENDING_KEY = 'tasks:pending'
+
+
+class QueueFull(APIException):
+    status_code = 503
+    default_detail = "Очередь задач переполнена, повторите запрос позже."
+    default_code = 'queue_full'
+
+
+class LeaseLost(Exception):
+    """Another worker claimed the task while it ran; its changes are rolled back."""
+
+
+def task(func=None, *, atomic=False):
+    def register(func):
+        func.atomic = atomic
+        registry[func.__name__] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(name, **payload):
+    if name not in registry:
+        raise KeyError(f"Unknown task {name!r}")
+    if _setting('TASKS_RUN_EAGERLY', False):
+        with transaction.atomic() if registry[name].atomic else nullcontext():
+            return registry[name](**payload)
+    pending = pending_count()
+    if pending >= _setting('TASKS_QUEUE_MAX', 10000):
+        logger.error("Task queue is full (%s pending), rejecting %s", pending, name)
+        raise QueueFull()
+    Task.objects.create(name=name, payload=payload)
+    try:
+        backend.incr(PENDING_KEY)
+    except ValueError:
+        pass  # expired; recounted on the next enqueue
+
+
+def pending_count():
+    pending = backend.get(PENDING_KEY)
+    if pending is None:
+        pending = Task.objects.filter(status=Task.PENDING).count()
+        backend.set(PENDING_KEY, pending, _setting('TASKS_QUEUE_COUNT_TTL', 5))
+    return pending
+
+
+def claim():
+    """
+    Atomically take the oldest due task and return it, or None.
+
+    A claimed task is leased for TASKS_LEASE_SECONDS; if its worker dies, the
+    task becomes due again once the lease runs out.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status__in=[Task.PENDING, Task.RUNNING], run_after__lte=now)
+    while True:
+        candidate = due.order_by('run_after', 'id').values_list('id', flat=True).first()
+        if candidate is None:
+            return None
+        claimed = due.filter(id=candidate).update(
+            status=Task.RUNNING,
+            attempts=F('attempts') + 1,
+            run_after=now + timedelta(seconds=_setting('TASKS_LEASE_SECONDS', 300)),
+        )
+        if claimed:
+            return Task.objects.get(id=candidate)
+
+
+def run(job):
+    func = registry[job.name]
+    try:
+        if func.atomic:
+            with transaction.atomic():
+                func(**job.payload)
+                complete(job)
+        else:
+            func(**job.payload)
+            complete(job)
+    except LeaseLost:
+        logger.warning("Task %s #%s was claimed again while it ran, dropping its result", job.name, job.id)
+        return False
+    except Exception as exc:
+        logger.exception("Task %s #%s failed (attempt %s)", job.name, job.id, job.attempts)
+        max_attempts = _setting('TASKS_MAX_ATTEMPTS', 5)
+        if job.attempts >= max_attempts:
+            job.status = Task.FAILED
+        else:
+            job.status = Task.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=2 ** job.attempts)
+        job.last_error = repr(exc)
+        job.save(update_fields=['status', 'run_after', 'last_error'])
+        return False
+    return True
+
+
+def complete(job):
+    # Only while the lease is ours: a re-claim bumped `attempts`.
+    if not Task.objects.filter(pk=job.pk, attempts=job.attempts).delete()[0]:
+        raise LeaseLost(job.pk)
+
+
+def run_pending(limit=None):
+    """Run due tasks until the queue is drained (or `limit` is reached)."""
+    done = 0
+    while limit is None or done < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
+
+
+def work(poll_interval=1.0, stop=lambda: False):
+    while not stop():
+        if not run_pending(limit=100):
+            time.sleep(poll_interval)
+
+
+# -----------------------
+# Tasks
+# -----------------------
+@task(atomic=True)
+def notify_followers(item_id, author_id, message, after=0):
+    """
+    Notify one chunk of followers, then queue the next chunk.
+
+    The chunk, its continuation and the removal of this task commit together,
+    so a retried chunk never duplicates notifications.
+    """
+    chunk_size = _setting('NOTIFY_CHUNK_SIZE', 1000)
+    follows = list(
+        Follow.objects.filter(following_id=author_id, id__gt=after)
+        .order_by('id').values_list('id', 'follower_id')[:chunk_size]
+    )
+    if not follows:
+        return
+    created = Notification.objects.bulk_create(
+        [Notification(user_id=follower_id, message=message) for _, follower_id in follows]
+    )
+    stats.bump_users([follower_id for _, follower_id in follows], fields=['unread_notifications'])
+    # Subscribers connected to this process get them at once; others through polling.
+    transaction.on_commit(lambda: streams.publish(created))
+    if len(follows) == chunk_size:
+        enqueue('notify_followers', item_id=item_id, author_id=author_id,
+                message=message, after=follows[-1][0])
+
+
+@task(atomic=True)
+def fan_out_item(item_id, author_id, after=0):
+    """
+    Copy a new item into one chunk of followers' timelines, then queue the next chunk.
+
+    Items of authors above FEED_FANOUT_MAX_FOLLOWERS are skipped: the feed
+    reads them at request time (api/feed.py).
+    """
+    if not after and not feed.fans_out(author_id):
+        return
+    created = list(Equipment.objects.filter(pk=item_id).values_list('id', 'created_at'))
+    if not created:
+        return
+    chunk_size = _setting('NOTIFY_CHUNK_SIZE', 1000)
+    follows = list(
+        Follow.objects.filter(following_id=author_id, id__gt=after)
+        .order_by('id').values_list('id', 'follower_id')[:chunk_size]
+    )
+    if not follows:
+        return
+    TimelineEntry.objects.bulk_create(
+        feed.entries([follower_id for _, follower_id in follows], author_id, created), ignore_conflicts=True,
+    )
+    if len(follows) == chunk_size:
+        enqueue('fan_out_item', item_id=item_id, author_id=author_id, after=follows[-1][0])
+
+
+@task(atomic=True)
+def fan_out_items(item_ids, author_id, after=0):
+    """
+    fan_out_item for a batch of items, queued by the importer (api/importer.py),
+    whose bulk_create sends no post_save. A chunk takes fewer followers the
+    more items there are, so it writes about NOTIFY_CHUNK_SIZE entries.
+    """
+    if not after and not feed.fans_out(author_id):
+        return
+    created = list(Equipment.objects.filter(pk__in=item_ids).values_list('id', 'created_at'))
+    if not created:
+        return
+    chunk_size = max(1, _setting('NOTIFY_CHUNK_SIZE', 1000) // len(created))
+    follows = list(
+        Follow.objects.filter(following_id=author_id, id__gt=after)
+        .order_by('id').values_list('id', 'follower_id')[:chunk_size]
+    )
+    if not follows:
+        return
+    TimelineEntry.objects.bulk_create(
+        feed.entries([follower_id for _, follower_id in follows], author_id, created), ignore_conflicts=True,
+    )
+    if len(follows) == chunk_size:
+        enqueue('fan_out_items', item_ids=item_ids, author_id=author_id, after=follows[-1][0])
+
+
+@task(atomic=True)
+def backfill_followers(author_id, after=0):
+    """
+    Copy an author's latest items into one chunk of followers' timelines, then queue the next chunk.
+
+    Queued when the author falls back to FEED_FANOUT_MAX_FOLLOWERS: their
+    items posted above it were never fanned out (api/feed.py).
+    """
+    if not after and not feed.fans_out(author_id):
+        return
+    created = feed.latest(author_id)
+    if not created:
+        return
+    chunk_size = _setting('NOTIFY_CHUNK_SIZE', 1000)
+    follows = list(
+        Follow.objects.filter(following_id=author_id, id__gt=after)
+        .order_by('id').values_list('id', 'follower_id')[:chunk_size]
+    )
+    if not follows:
+        return
+    TimelineEntry.objects.bulk_create(
+        feed.entries([follower_id for _, follower_id in follows], author_id, created), ignore_conflicts=True,
+    )
+    if len(follows) == chunk_size:
+        enqueue('backfill_followers', author_id=author_id, after=follows[-1][0])
+
+
+@task
+def generate_image_variants(model, pk):
+    model = apps.get_model(model)
+    if images.generate(model, pk) and model._meta.label_lower == 'api.equipment':
+        cache.invalidate_catalog()
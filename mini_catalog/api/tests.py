@@ -1,3 +1,1774 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import warnings
+from contextlib import asynccontextmanager, closing, contextmanager
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count, F
+from PIL import Image
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, authentication, exporter, feed, history, images, importer, metrics, recommender, search, seed, sqlite, \
+    stats, streams, tasks, uploads
+from .benchmarks import asgi as asgi_benchmark, common as benchmark_common, endpoints as endpoint_benchmark, \
+    feed as feed_benchmark, sqlite as sqlite_benchmark
+from .models import Equipment, Category, Tag, Favorite, Follow, Notification, Task, History, \
+    Comment, Like, Rating, Stats, Profile, FileReference, Recommendation, CommentLike, CommentRating, TimelineEntry
+from .cache import catalog_version
+from .routers import ReadWriteRouter
+from .serializers import ProfileSerializer
+from .views import UserHistoryView, NotificationListView, FollowersListView, EquipmentViewSet, CommentViewSet, \
+    UserStatsView
+
+
+class QueryPlanMixin:
+    """
+    Fail a test when SQLite plans a query as a full table scan or sorts it in
+    a temporary B-tree instead of reading an index in order.
+    """
+
+    def query_plan(self, sql, params=()):
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexedPlan(self, sql, params=(), allow_scan=()):
+        plan = self.query_plan(sql, params)
+        bad = [
+            step for step in plan
+            if 'TEMP B-TREE' in step
+            or (step.startswith('SCAN ') and ' USING ' not in step and 'VIRTUAL TABLE' not in step
+                and step.split()[1] not in allow_scan)
+        ]
+        if bad:
+            self.fail(f"Unindexed plan for:\n{sql}\n" + "\n".join(plan))
+
+    def assertIndexedQueryset(self, queryset, **kwargs):
+        self.assertIndexedPlan(*queryset.query.sql_with_params(), **kwargs)
+
+    @contextmanager
+    def assertIndexedQueries(self, table, allow_scan=()):
+        """Check the plan of every SELECT on `table` run inside the block."""
+        with CaptureQueriesContext(connections['default']) as ctx:
+            yield ctx
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')
+                   and f'FROM "{table}"' in q['sql']]
+        self.assertTrue(selects, f"No query on {table} was run")
+        for sql in selects:
+            self.assertIndexedPlan(sql, allow_scan=allow_scan)
+
+
+class QueryBudgetMixin:
+    """Fail a test when a block runs more SQL queries than it is allowed to."""
+
+    @contextmanager
+    def assertMaxQueries(self, limit, using='default'):
+        with CaptureQueriesContext(connections[using]) as ctx:
+            yield ctx
+        executed = len(ctx.captured_queries)
+        if executed > limit:
+            queries = "\n".join(
+                f"{i}. {q['sql']}" for i, q in enumerate(ctx.captured_queries, start=1)
+            )
+            self.fail(f"{executed} queries executed, budget is {limit}:\n{queries}")
+
+
+def make_items(author, count, category=None, tag=None):
+    items = []
+    for i in range(count):
+        item = Equipment.objects.create(name=f"item {i}", price_per_day=10, author=author)
+        if category:
+            item.categories.add(category)
+        if tag:
+            item.tags.add(tag)
+        items.append(item)
+    return items
+
+
+class EquipmentQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.category = Category.objects.create(name='tents')
+        self.tag = Tag.objects.create(name='winter')
+
+    def test_list_is_constant_in_number_of_items(self):
+        make_items(self.author, 1, self.category, self.tag)
+        with self.assertMaxQueries(3):
+            self.client.get('/api/items/')
+
+        make_items(self.author, 25, self.category, self.tag)
+        with self.assertMaxQueries(3):
+            response = self.client.get('/api/items/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve(self):
+        item = make_items(self.author, 1, self.category, self.tag)[0]
+        with self.assertMaxQueries(3):
+            response = self.client.get(f'/api/items/{item.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['author']['username'], 'author')
+        self.assertEqual([t['name'] for t in response.data['tags']], ['winter'])
+
+    def test_authenticated_list(self):
+        items = make_items(self.author, 10, self.category, self.tag)
+        Favorite.objects.create(user=self.author, item=items[0])
+        self.client.force_authenticate(self.author)
+        with self.assertMaxQueries(5):
+            response = self.client.get('/api/items/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+
+        # Favourite and tag ids now come from the per-user cache.
+        with self.assertMaxQueries(3):
+            self.client.get('/api/items/')
+        with self.assertMaxQueries(3):
+            self.client.get(f'/api/items/{items[3].id}/')
+
+    def test_interest_cache_follows_favourites(self):
+        lone, tagged = make_items(self.author, 1), make_items(self.author, 1, tag=self.tag)
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.get('/api/items/').data['results'], [])
+
+        Favorite.objects.create(user=self.author, item=tagged[0])
+        ids = [row['id'] for row in self.client.get('/api/items/').data['results']]
+        self.assertEqual(ids, [tagged[0].id])
+
+        Favorite.objects.create(user=self.author, item=lone[0])
+        ids = [row['id'] for row in self.client.get('/api/items/').data['results']]
+        self.assertEqual(ids, [tagged[0].id, lone[0].id])
+
+    def test_author_can_edit_items_outside_their_interests(self):
+        item = make_items(self.author, 1)[0]
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/items/{item.id}/', {'name': 'renamed'})
+        self.assertEqual(response.status_code, 200)
+
+
+class KeysetPaginationTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.items = make_items(self.author, 7)
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        return seen
+
+    def test_pages_cover_every_row_once_newest_first(self):
+        expected = [item.id for item in reversed(self.items)]
+        self.assertEqual(self.walk('/api/items/?page_size=3'), expected)
+
+    def test_client_ordering_is_used_as_the_keyset(self):
+        expected = [item.id for item in sorted(self.items, key=lambda i: (i.name, i.id))]
+        self.assertEqual(self.walk('/api/items/?page_size=2&ordering=name'), expected)
+
+    def test_previous_link_returns_the_earlier_page(self):
+        first = self.client.get('/api/items/?page_size=3')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_no_count_query(self):
+        with self.assertMaxQueries(3) as ctx:
+            self.client.get('/api/items/?page_size=3')
+        self.assertFalse(any('COUNT(' in q['sql'] for q in ctx.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/items/?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = User.objects.create_user('author', password='pass12345')
+        self.tent = Equipment.objects.create(name='Tent Alpine', description='two person', price_per_day=5, author=author)
+        self.stove = Equipment.objects.create(name='Gas stove', description='for a tent camp', price_per_day=3, author=author)
+        self.rope = Equipment.objects.create(name='Rope', price_per_day=2, author=author)
+        self.tag = Tag.objects.create(name='climbing')
+        self.rope.tags.add(self.tag)
+
+    def search(self, term):
+        response = self.client.get('/api/items/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(self.search('tent'), [self.tent.id, self.stove.id])
+
+    def test_prefix_and_tag_names(self):
+        self.assertEqual(self.search('climb'), [self.rope.id])
+
+    def test_index_follows_tag_and_category_changes(self):
+        self.tag.name = 'mountaineering'
+        self.tag.save()
+        self.assertEqual(self.search('climb'), [])
+        self.assertEqual(self.search('mountain'), [self.rope.id])
+
+        category = Category.objects.create(name='camping')
+        category.items.add(self.stove)
+        self.assertEqual(self.search('camping'), [self.stove.id])
+        category.items.clear()
+        self.assertEqual(self.search('camping'), [])
+
+        self.tag.delete()
+        self.assertEqual(self.search('mountain'), [])
+
+    def test_deleted_items_leave_the_index(self):
+        self.tent.delete()
+        self.assertEqual(self.search('tent'), [self.stove.id])
+
+    def test_rebuild(self):
+        Equipment.objects.filter(pk=self.rope.pk).update(name='Carabiner')
+        self.assertEqual(search.rebuild(), 3)
+        self.assertEqual(self.search('carabiner'), [self.rope.id])
+
+    def test_paging_by_rank(self):
+        first = self.client.get('/api/items/', {'search': 'tent', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual([r['id'] for r in first.data['results'] + second.data['results']],
+                         [self.tent.id, self.stove.id])
+
+    def test_index_is_matched_once(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.search('tent')
+        sql = next(q['sql'] for q in ctx.captured_queries if 'MATCH' in q['sql'])
+        self.assertEqual(sql.count('MATCH'), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertEqual(sum(search.FTS_TABLE in step for step in plan), 1, plan)
+        self.assertFalse([step for step in plan if 'CORRELATED' in step], plan)
+
+    def test_fts5_is_probed_once(self):
+        self.assertTrue(search.has_fts5())
+        with self.assertNumQueries(0):
+            self.assertTrue(search.is_available())
+
+    def test_without_fts5_search_falls_back_to_icontains(self):
+        with mock.patch.object(search, 'has_fts5', return_value=False), \
+                CaptureQueriesContext(connection) as ctx:
+            found = self.search('tent')
+        self.assertEqual(sorted(found), [self.tent.id, self.stove.id])
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if search.FTS_TABLE in q['sql']])
+
+
+class RecommendationTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('reader', password='pass12345')
+        author = User.objects.create_user('author', password='pass12345')
+        winter, rock, water = (Tag.objects.create(name=n) for n in ('winter', 'rock', 'water'))
+        self.boots, self.axe, self.rope, self.kayak = make_items(author, 4)
+        self.boots.tags.add(winter, rock)
+        self.axe.tags.add(winter)
+        self.rope.tags.add(rock)
+        self.kayak.tags.add(water)
+        self.client.force_authenticate(self.user)
+
+    def recommended(self):
+        response = self.client.get(f'/api/users/{self.user.id}/recommendations/')
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_favourites_refresh_the_users_recommendations(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, item=self.axe)
+        self.assertEqual(self.recommended(), [self.boots.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, item=self.rope)
+        self.assertEqual(self.recommended(), [self.boots.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(item=self.rope).delete()
+            Favorite.objects.filter(item=self.axe).delete()
+        self.assertEqual(self.recommended(), [])
+
+    def test_rebuild_matches_incremental_refresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, item=self.boots)
+        incremental = list(self.user.recommendations.order_by('-score', 'item').values_list('item', 'score'))
+        recommender.rebuild()
+        rebuilt = list(self.user.recommendations.order_by('-score', 'item').values_list('item', 'score'))
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual([item for item, _ in rebuilt], [self.axe.id, self.rope.id])
+
+    def test_single_lookup(self):
+        recommender.rebuild()
+        with self.assertMaxQueries(3):
+            self.recommended()
+
+
+@override_settings(NOTIFY_CHUNK_SIZE=3)
+class FollowerFanOutTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.client.force_authenticate(self.author)
+
+    def follow(self, count):
+        for i in range(count):
+            follower = User.objects.create_user(f'follower{Follow.objects.count()}')
+            Follow.objects.create(follower=follower, following=self.author)
+
+    def create_item(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/items/', {'name': 'Tent', 'price_per_day': '5.00'})
+        self.assertEqual(response.status_code, 201)
+
+    def test_request_cost_does_not_depend_on_follower_count(self):
+        self.follow(1)
+        with self.assertMaxQueries(100) as few:
+            self.create_item()
+        self.follow(20)
+        with self.assertMaxQueries(len(few)):
+            self.create_item()
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_worker_fans_out_in_chunks(self):
+        self.follow(7)
+        self.create_item()
+        # Notifications and timeline entries, three chunks each.
+        self.assertEqual(tasks.run_pending(), 6)
+        self.assertEqual(Notification.objects.count(), 7)
+        self.assertEqual(
+            set(Notification.objects.values_list('user_id', flat=True)),
+            set(Follow.objects.values_list('follower_id', flat=True)),
+        )
+        self.assertFalse(Task.objects.exists())
+
+    def test_failed_task_is_retried_with_backoff(self):
+        calls = []
+
+        @tasks.task
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+
+        self.addCleanup(tasks.registry.pop, 'flaky')
+        tasks.enqueue('flaky')
+        with self.assertLogs('api.tasks', 'ERROR'):
+            self.assertEqual(tasks.run_pending(), 1)
+        job = Task.objects.get()
+        self.assertEqual((job.status, job.attempts), (Task.PENDING, 1))
+        self.assertEqual(tasks.run_pending(), 0)  # not due yet
+
+        Task.objects.update(run_after=job.created_at)
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_QUEUE_MAX=2)
+    def test_full_queue_rejects_tasks(self):
+        cache.clear()
+        tasks.enqueue('fan_out_item', item_id=1, author_id=self.author.id)
+        # The pending count is cached and bumped, not counted again.
+        with self.assertNumQueries(1):
+            tasks.enqueue('fan_out_item', item_id=2, author_id=self.author.id)
+        with self.assertNumQueries(0), self.assertLogs('api.tasks', 'ERROR'), self.assertRaises(tasks.QueueFull):
+            tasks.enqueue('fan_out_item', item_id=3, author_id=self.author.id)
+        self.assertEqual(Task.objects.count(), 2)
+
+    @override_settings(TASKS_QUEUE_MAX=0)
+    def test_full_queue_answers_503(self):
+        self.follow(2)
+        # Outside a transaction, as in production, on_commit callbacks run at once.
+        with mock.patch('django.db.transaction.on_commit', side_effect=lambda callback, *args, **kwargs: callback()), \
+                self.assertLogs('api.tasks', 'ERROR'):
+            response = self.client.post('/api/items/', {'name': 'Tent', 'price_per_day': '5.00'})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Task.objects.exists())
+
+    def test_chunk_commits_with_the_removal_of_its_task(self):
+        self.follow(2)
+        self.create_item()
+        Task.objects.exclude(name='notify_followers').delete()
+        job = tasks.claim()
+        # The worker dies after the chunk, before anything commits.
+        with mock.patch.object(tasks, 'complete', side_effect=KeyboardInterrupt), \
+                self.assertRaises(KeyboardInterrupt):
+            tasks.run(job)
+        self.assertEqual(Notification.objects.count(), 0)
+
+        Task.objects.update(run_after=job.created_at)
+        self.assertEqual(tasks.run_pending(), 1)
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertFalse(Task.objects.exists())
+
+    def test_task_claimed_again_is_rolled_back(self):
+        self.follow(2)
+        self.create_item()
+        Task.objects.exclude(name='notify_followers').delete()
+        job = tasks.claim()
+        # Its lease ran out and another worker took it.
+        Task.objects.filter(pk=job.pk).update(attempts=F('attempts') + 1)
+        with self.assertLogs('api.tasks', 'WARNING'):
+            self.assertFalse(tasks.run(job))
+        self.assertEqual(Notification.objects.count(), 0)
+        self.assertTrue(Task.objects.filter(pk=job.pk).exists())
+
+
+class HistoryWriteModeTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user('author', password='pass12345')
+
+    def test_sync_mode_writes_in_the_request(self):
+        make_items(self.author, 1)
+        self.assertEqual(list(History.objects.values_list('action', flat=True)), ['Added item item 0'])
+
+    @override_settings(HISTORY_WRITE_MODE='buffered')
+    def test_buffered_mode_writes_after_commit_in_bulk(self):
+        self.addCleanup(history.buffer.flush)
+        with self.captureOnCommitCallbacks(execute=True):
+            item = make_items(self.author, 1)[0]
+            item.save()
+        self.assertFalse(History.objects.exists())
+        self.assertEqual(history.buffer.flush(), 2)
+        self.assertEqual(History.objects.count(), 2)
+
+    def test_buffer_flushes_at_size_threshold(self):
+        buffer = history.HistoryBuffer(max_size=2, interval=60)
+        self.addCleanup(buffer.flush)
+        buffer.add(History(user=self.author, action='one'))
+        self.assertFalse(History.objects.exists())
+        buffer.add(History(user=self.author, action='two'))
+        self.assertEqual(History.objects.count(), 2)
+        self.assertIsNone(buffer.timer)
+
+    def test_locked_database_keeps_the_batch(self):
+        buffer = history.HistoryBuffer(max_size=2, interval=60, max_pending=3)
+        self.addCleanup(buffer.flush)
+        locked = OperationalError('database is locked')
+        with mock.patch.object(History.objects, 'bulk_create', side_effect=locked), \
+                self.assertLogs('api.history', 'WARNING'):
+            buffer.add(History(user=self.author, action='one'))
+            buffer.add(History(user=self.author, action='two'))
+            # No write per add() while failing; the timer retries.
+            buffer.add(History(user=self.author, action='three'))
+            self.assertEqual(len(buffer.entries), 3)
+            with self.assertLogs('api.history', 'ERROR'):
+                buffer.add(History(user=self.author, action='four'))
+                self.assertEqual(buffer.flush(), 0)
+        self.assertIsNotNone(buffer.timer)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(list(History.objects.order_by('id').values_list('action', flat=True)),
+                         ['two', 'three', 'four'])
+        self.assertFalse(buffer.failing)
+
+
+class StatsTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('author', password='pass12345')
+        other = User.objects.create_user('other', password='pass12345')
+        item, spare = make_items(self.user, 2)
+        Comment.objects.create(item=item, author=self.user, text='nice')
+        Like.objects.create(user=self.user.profile, item=item)
+        Rating.objects.create(user=self.user, item=item, value=5)
+        Follow.objects.create(follower=self.user, following=other)
+        Category.objects.create(name='tents')
+        spare.delete()
+        self.client.force_authenticate(self.user)
+
+    def fetch(self):
+        with self.assertMaxQueries(1):
+            user = self.client.get(f'/api/users/{self.user.id}/stats/').data
+        with self.assertMaxQueries(1):
+            total = self.client.get('/api/stats/').data
+        return user, total
+
+    def test_signals_keep_counters_in_sync(self):
+        user, total = self.fetch()
+        self.assertEqual(user, {
+            'objects_count': 1, 'comments_count': 1, 'likes_count': 1,
+            'ratings_count': 1, 'follows_count': 1,
+        })
+        self.assertEqual(total, {
+            'total_objects': 1, 'total_comments': 1, 'total_likes': 1,
+            'total_ratings': 1, 'total_users': 2, 'categories_count': 1,
+        })
+
+    def test_reconcile_repairs_drift(self):
+        expected = self.fetch()
+        Stats.objects.update(items=99, likes=-3, users=0)
+        stats.reconcile()
+        self.assertEqual(self.fetch(), expected)
+
+    def test_missing_user_row_is_rebuilt(self):
+        Stats.objects.filter(user=self.user).delete()
+        response = self.client.get(f'/api/users/{self.user.id}/stats/')
+        self.assertEqual(response.data['objects_count'], 1)
+        self.assertEqual(self.client.get('/api/users/999/stats/').status_code, 404)
+
+
+class CatalogCacheTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.item = make_items(self.author, 1)[0]
+
+    def test_anonymous_reads_are_served_from_cache(self):
+        for url in ('/api/items/', f'/api/items/{self.item.id}/'):
+            first = self.client.get(url)
+            with self.assertMaxQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+            self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_conditional_get(self):
+        etag = self.client.get('/api/items/')['ETag']
+        with self.assertMaxQueries(0):
+            response = self.client.get('/api/items/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_changes_bump_the_version(self):
+        etag = self.client.get(f'/api/items/{self.item.id}/')['ETag']
+        Like.objects.create(user=self.author.profile, item=self.item)
+        response = self.client.get(f'/api/items/{self.item.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like_count'], 1)
+
+        etag = response['ETag']
+        self.item.tags.add(Tag.objects.create(name='winter'))
+        response = self.client.get(f'/api/items/{self.item.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([t['name'] for t in response.data['tags']], ['winter'])
+
+    def test_only_rendered_author_fields_bump_the_version(self):
+        version = catalog_version()
+        self.author.last_login = timezone.now()
+        self.author.save(update_fields=['last_login'])
+        self.author.set_password('other12345')
+        self.author.is_active = False
+        self.author.save()
+        self.assertEqual(catalog_version(), version)
+
+        self.author.username = 'renamed'
+        self.author.save()
+        self.assertNotEqual(catalog_version(), version)
+        self.assertEqual(self.client.get(f'/api/items/{self.item.id}/').data['author']['username'], 'renamed')
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.client.get('/api/items/')
+        self.client.force_authenticate(self.author)
+        response = self.client.get('/api/items/')
+        self.assertNotIn('ETag', response)
+
+
+class EquipmentImportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create_user('supplier', password='pass12345')
+        self.client.force_authenticate(self.author)
+        Tag.objects.create(name='winter')
+
+    def upload(self, name, content):
+        return self.client.post('/api/items/import/', {'file': SimpleUploadedFile(name, content.encode())})
+
+    def test_csv_import_reports_bad_rows_and_keeps_going(self):
+        response = self.upload('catalog.csv', (
+            "name,price_per_day,categories,tags\n"
+            "Tent,12.50,camping,winter|alpine\n"
+            "Broken,not-a-price,,\n"
+            "Stove,3,camping,\n"
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 1))
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        self.assertIn('price_per_day', response.data['errors'][0]['errors'])
+
+        tent = Equipment.objects.get(name='Tent')
+        self.assertEqual(tent.author, self.author)
+        self.assertEqual(sorted(tent.tags.values_list('name', flat=True)), ['alpine', 'winter'])
+        self.assertEqual(Tag.objects.filter(name='winter').count(), 1)
+        self.assertEqual(Category.objects.get().items.count(), 2)
+
+        self.assertEqual(Stats.objects.get(user=self.author).items, 2)
+        self.client.force_authenticate(None)
+        found = self.client.get('/api/items/', {'search': 'alpine'}).data['results']
+        self.assertEqual([row['id'] for row in found], [tent.id])
+
+    def test_undecodable_and_malformed_lines_are_reported(self):
+        content = (
+            "name,price_per_day\n"
+            "Tent,12\n"
+        ).encode() + "Piolet Chamonix été,8\n".encode('latin-1') + b"Ro\x00pe,2\nStove,3\n"
+        # Past csv.field_size_limit(): a csv.Error for that line only.
+        content += b'"' + b'x' * (csv.field_size_limit() + 1) + b'",1\nAxe,4\n'
+        response = self.client.post('/api/items/import/', {'file': SimpleUploadedFile('catalog.csv', content)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['failed']), (3, 3))
+        self.assertEqual([error['line'] for error in response.data['errors']], [3, 4, 6])
+        self.assertIn('UTF-8', response.data['errors'][0]['errors']['non_field_errors'][0])
+        self.assertEqual(sorted(Equipment.objects.values_list('name', flat=True)), ['Axe', 'Stove', 'Tent'])
+
+        lines = b'{"name": "Rope", "price_per_day": 2}\n{"name": "\xe9", "price_per_day": 2}\n'
+        response = self.client.post('/api/items/import/', {'file': SimpleUploadedFile('more.ndjson', lines)})
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+
+    def test_ndjson_command_in_batches(self):
+        lines = [f'{{"name": "Rope {i}", "price_per_day": 2, "tags": ["rock"]}}' for i in range(5)]
+        lines.insert(2, '{not json')
+        path = self.tmp_file("\n".join(lines))
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_equipment', path, author='supplier', batch_size=2, stdout=out, stderr=err)
+        self.assertIn('Created 5 items, 1 rows failed', out.getvalue())
+        self.assertIn('line 3', err.getvalue())
+        self.assertEqual(Tag.objects.get(name='rock').items.count(), 5)
+
+    @override_settings(NOTIFY_CHUNK_SIZE=4)
+    def test_imported_items_reach_the_followers_timelines(self):
+        followers = [User.objects.create_user(f'follower{i}') for i in range(3)]
+        for follower in followers:
+            Follow.objects.create(follower=follower, following=self.author)
+        lines = "\n".join(f'{{"name": "Rope {i}", "price_per_day": 2}}' for i in range(3))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_equipment', self.tmp_file(lines), author='supplier', batch_size=2,
+                         stdout=io.StringIO())
+        # One task per batch; the batch of two items takes two followers per chunk.
+        self.assertEqual(Task.objects.filter(name='fan_out_items').count(), 2)
+        self.assertEqual(tasks.run_pending(), 3)
+        for follower in followers:
+            self.assertEqual(TimelineEntry.objects.filter(user=follower).count(), 3)
+
+    def test_full_queue_does_not_fail_the_import(self):
+        with override_settings(TASKS_QUEUE_MAX=0), self.assertLogs('api.importer', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.upload('catalog.csv', "name,price_per_day\nTent,12\n")
+        self.assertEqual(response.data['created'], 1)
+        self.assertFalse(Task.objects.exists())
+
+    def tmp_file(self, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False)
+        self.addCleanup(os.unlink, handle.name)
+        with handle:
+            handle.write(content)
+        return handle.name
+
+
+class EquipmentExportTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.client.force_authenticate(self.author)
+        make_items(self.author, 5, Category.objects.create(name='tents'), Tag.objects.create(name='winter'))
+
+    def test_ndjson_stream_reads_in_chunks(self):
+        response = self.client.get('/api/items/export/')
+        self.assertTrue(response.streaming)
+        with self.assertMaxQueries(3 * 3):  # items, categories, tags per chunk of 2
+            lines = list(exporter.ndjson_lines(exporter.export_rows(chunk_size=2)))
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[0]['author'], rows[0]['categories'], rows[0]['tags']), ('author', ['tents'], ['winter']))
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], [r['id'] for r in rows])
+
+    def test_csv_round_trips_through_the_importer(self):
+        response = self.client.get('/api/items/export/', {'type': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        body = b"".join(response.streaming_content)
+        report = importer.Importer(self.author).run(io.BytesIO(body), 'csv')
+        self.assertEqual((report['created'], report['failed']), (5, 0))
+        self.assertEqual(Tag.objects.get().items.count(), 10)
+
+    async def test_asgi_stream_is_read_in_batches(self):
+        with mock.patch.object(exporter, 'ASYNC_BATCH', 2), warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            response = await self.async_client.get('/api/items/export/', headers={
+                'Authorization': f'Bearer {AccessToken.for_user(self.author)}',
+            })
+            self.assertTrue(response.is_async)
+            batches = [batch async for batch in response.streaming_content]
+        self.assertEqual([len(batch.splitlines()) for batch in batches], [2, 2, 1])
+        self.assertEqual(len(b"".join(batches).splitlines()), 5)
+        self.assertFalse([w for w in caught if 'synchronous iterators' in str(w.message)])
+
+
+def png_bytes(size=(640, 480), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(self.settings(MEDIA_ROOT=media))
+        # Pool children keep the MEDIA_ROOT they were forked with.
+        images.shutdown()
+        self.addCleanup(images.shutdown)
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.client.force_authenticate(self.author)
+
+    def test_upload_is_resized_by_the_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/items/', {
+                'name': 'Tent', 'price_per_day': '5.00',
+                'image': SimpleUploadedFile('tent.png', png_bytes(), content_type='image/png'),
+            })
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.data['image_variants'])
+
+        tasks.run_pending()
+        item = Equipment.objects.get()
+        self.client.force_authenticate(None)
+        variants = self.client.get(f'/api/items/{item.id}/').data['image_variants']
+        self.assertEqual(set(variants), {'thumb', 'medium'})
+        self.assertTrue(variants['thumb']['webp'].endswith('/thumb.webp'))
+        with Image.open(os.path.join(settings.MEDIA_ROOT, item.image_variants['thumb']['jpeg'])) as thumb:
+            self.assertEqual(thumb.size, images.SPECS['api.equipment'][2]['thumb'])
+
+    def test_upload_is_rendered_in_the_process_pool(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Equipment(name='Tent', price_per_day=1, author=self.author)
+            item.image.save('tent.png', ContentFile(png_bytes()))
+        # Forked (on the first submit) before the patch: the children decode for real.
+        images.pool().submit(abs, 0).result()
+        with mock.patch('PIL.Image.open', side_effect=AssertionError("decoded in the worker process")):
+            tasks.run_pending()
+        self.assertFalse(Task.objects.exists())
+        item.refresh_from_db()
+        self.assertEqual(item.image_variants['source'], item.image.name)
+
+    def test_replaced_image_leaves_no_variant_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Equipment(name='Tent', price_per_day=1, author=self.author)
+            item.image.save('tent.png', ContentFile(png_bytes()))
+        tasks.run_pending()
+        item.refresh_from_db()
+        old = [os.path.join(settings.MEDIA_ROOT, path) for path in images.variant_files(item.image_variants)]
+        self.assertEqual(len(old), 4)
+        self.assertTrue(all(os.path.exists(path) for path in old))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/items/{item.id}/', {
+                'image': SimpleUploadedFile('blue.png', png_bytes(color='blue'), content_type='image/png'),
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([path for path in old if os.path.exists(path)])
+        # Until the new image is rendered, the old variants are not linked.
+        self.assertIsNone(response.data['image_variants'])
+        tasks.run_pending()
+        item.refresh_from_db()
+        self.assertTrue(all(os.path.exists(os.path.join(settings.MEDIA_ROOT, path))
+                            for path in images.variant_files(item.image_variants)))
+
+    def test_backfill_in_a_process_pool(self):
+        for i in range(3):
+            item = Equipment(name=f'item {i}', price_per_day=1, author=self.author)
+            item.image.save(f'{i}.png', ContentFile(png_bytes()), save=False)
+            Equipment.objects.bulk_create([item])
+        Profile.objects.filter(user=self.author).update(avatar=Equipment.objects.first().image.name)
+
+        call_command('build_image_variants', workers=2, stdout=io.StringIO())
+        for item in Equipment.objects.all():
+            self.assertEqual(item.image_variants['source'], item.image.name)
+        profile = Profile.objects.get(user=self.author)
+        self.assertEqual(set(ProfileSerializer(profile).data['avatar_variants']), {'thumb', 'medium'})
+
+
+class ContentAddressedFileTests(TestCase):
+    pdf = b'%PDF-1.4\n' + b'x' * 1000
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(self.settings(MEDIA_ROOT=media))
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.client.force_authenticate(self.author)
+
+    def upload(self, content, name='manual.pdf'):
+        return self.client.post('/api/items/', {
+            'name': 'Tent', 'price_per_day': '5.00',
+            'file': SimpleUploadedFile(name, content, content_type='application/pdf'),
+        })
+
+    def stored_files(self):
+        root = os.path.join(settings.MEDIA_ROOT, 'equipment_files')
+        return [name for _, _, names in os.walk(root) for name in names]
+
+    def test_identical_uploads_share_one_file(self):
+        first, second = self.upload(self.pdf), self.upload(self.pdf, name='copy.PDF')
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        names = set(Equipment.objects.values_list('file', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertIn(hashlib.sha256(self.pdf).hexdigest(), names.pop())
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(FileReference.objects.get().ref_count, 2)
+
+    def test_same_type_shares_one_name_whatever_the_extension(self):
+        jpeg = b'\xff\xd8\xff\xe0' + b'x' * 1000
+        for name in ('photo.jpeg', 'photo.JPG', 'photo.jpg'):
+            self.assertEqual(self.upload(jpeg, name=name).status_code, 201)
+        self.assertEqual(self.stored_files(), [hashlib.sha256(jpeg).hexdigest() + '.jpg'])
+        self.assertEqual(FileReference.objects.get().ref_count, 3)
+
+    def test_small_uploads_stay_in_memory(self):
+        with mock.patch.object(uploads.TemporaryContentHashUploadHandler, 'new_file', side_effect=AssertionError):
+            self.assertEqual(self.upload(self.pdf).status_code, 201)
+        self.assertEqual(len(self.stored_files()), 1)
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_large_uploads_spill_to_disk_and_are_still_checked(self):
+        self.assertEqual(self.upload(self.pdf).status_code, 201)
+        self.assertEqual(self.upload(b'MZ' + b'x' * 1000).status_code, 400)
+        self.assertEqual(self.stored_files(), [hashlib.sha256(self.pdf).hexdigest() + '.pdf'])
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        self.upload(self.pdf)
+        self.upload(self.pdf)
+        first, second = Equipment.objects.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(len(self.stored_files()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(FileReference.objects.exists())
+
+    def test_reupload_keeps_a_file_whose_delete_is_pending(self):
+        self.upload(self.pdf)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Equipment.objects.get().delete()
+        # The same bytes come in before the delete runs: storage keeps the file as is.
+        self.upload(self.pdf)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(FileReference.objects.get().ref_count, 1)
+
+    def test_file_deleted_before_the_reference_is_written_back(self):
+        self.upload(self.pdf)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Equipment.objects.get().delete()
+        exists = uploads.ContentAddressedStorage.exists
+
+        def exists_then_delete(storage, name):
+            found = exists(storage, name)
+            # The pending delete lands after storage skipped the write, before the new reference.
+            while callbacks:
+                callbacks.pop()()
+            return found
+
+        with mock.patch.object(uploads.ContentAddressedStorage, 'exists', exists_then_delete):
+            self.assertEqual(self.upload(self.pdf).status_code, 201)
+        self.assertEqual(self.stored_files(), [os.path.basename(Equipment.objects.get().file.name)])
+
+    def test_wrong_magic_bytes_are_rejected_while_streaming(self):
+        response = self.upload(b'MZ\x90\x00 definitely not a pdf')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.data)
+        self.assertFalse(Equipment.objects.exists())
+
+    def test_oversized_upload_is_rejected(self):
+        response = self.upload(b'%PDF-' + b'0' * uploads.MAX_FILE_SIZE)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('5MB', str(response.data['file']))
+        self.assertEqual(self.stored_files(), [])
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    """The main queryset of each hot view is served by an index, in index order."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.other = User.objects.create_user('other', password='pass12345')
+        self.items = make_items(self.other, 3, Category.objects.create(name='tents'), Tag.objects.create(name='winter'))
+        Comment.objects.create(item=self.items[0], author=self.user, text='nice')
+        Follow.objects.create(follower=self.user, following=self.other)
+        Notification.objects.create(user=self.user, message='hello')
+        History.objects.create(user=self.user, action='login')
+        Recommendation.objects.create(user=self.user, item=self.items[1], score=1.5)
+
+    def call(self, view, **kwargs):
+        request = self.factory.get('/')
+        force_authenticate(request, self.user)
+        response = view.as_view()(request, **kwargs)
+        self.assertEqual(response.status_code, 200)
+
+    def test_item_list(self):
+        with self.assertIndexedQueries('api_equipment'):
+            self.client.get('/api/items/')
+        with self.assertIndexedQueries('api_equipment'):
+            self.client.get('/api/items/?ordering=-created_at&page_size=2')
+
+    def test_item_comments(self):
+        with self.assertIndexedQueries('api_comment'):
+            response = self.client.get(f'/api/items/{self.items[0].id}/comments/')
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_user_lists(self):
+        self.client.force_authenticate(self.user)
+        with self.assertIndexedQueries('api_equipmentlist'):
+            self.client.get('/api/lists/')
+
+    def test_recommendations(self):
+        self.client.force_authenticate(self.user)
+        with self.assertIndexedQueries('api_equipment'):
+            response = self.client.get(f'/api/users/{self.user.id}/recommendations/')
+        self.assertEqual([r['id'] for r in response.data['results']], [self.items[1].id])
+
+    def test_profiles(self):
+        # Newest first is a walk of the rowid B-tree from its end.
+        with self.assertIndexedQueries('api_profile', allow_scan=('api_profile',)):
+            self.client.get('/api/profile/')
+
+    def test_history(self):
+        with self.assertIndexedQueries('api_history'):
+            self.call(UserHistoryView, user_id=self.user.id)
+
+    def test_notifications(self):
+        with self.assertIndexedQueries('api_notification'):
+            self.call(NotificationListView)
+        self.client.force_authenticate(self.user)
+        with self.assertIndexedQueries('api_notification'):
+            self.client.get('/api/notifications/?unread=true')
+        self.assertIndexedQueryset(
+            self.user.notifications.filter(is_read=False).order_by('-created_at', '-id')[:20]
+        )
+
+    def test_followers(self):
+        with self.assertIndexedQueries('api_follow'):
+            self.call(FollowersListView, id=self.other.id)
+
+    def test_public_and_author_items(self):
+        self.assertIndexedQueryset(Equipment.objects.filter(public=True).order_by('-created_at', '-id')[:20])
+        self.assertIndexedQueryset(Equipment.objects.filter(author=self.other).order_by('-created_at', '-id')[:20])
+
+    def test_detects_unindexed_sort(self):
+        with self.assertRaises(AssertionError):
+            self.assertIndexedQueryset(Comment.objects.order_by('text'))
+
+
+class SeedDataTests(TestCase):
+    def test_generates_consistent_data(self):
+        call_command('seed_data', users=20, items=200, tags=10, categories=4, follows=60, favorites=60,
+                     comments=100, likes=150, ratings=80, seed=7, stdout=io.StringIO())
+
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Profile.objects.count(), 20)
+        self.assertEqual(Equipment.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertFalse(Follow.objects.filter(follower=F('following')).exists())
+        # Counters, stats and the search index are rebuilt after the bulk inserts.
+        self.assertEqual(sum(Equipment.objects.values_list('like_count', flat=True)), Like.objects.count())
+        totals = Stats.objects.get(user__isnull=True)
+        self.assertEqual((totals.users, totals.items), (20, 200))
+        if search.is_available():
+            with connections['default'].cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {search.FTS_TABLE}")
+                self.assertEqual(cursor.fetchone()[0], 200)
+
+    def test_popularity_is_skewed(self):
+        seed.Seeder(seed=3, skew=1.5).run(users=50, items=500, tags=5, categories=2,
+                                          follows=0, favorites=0, comments=500, likes=0, ratings=0)
+        per_author = sorted(Equipment.objects.values('author').annotate(n=Count('pk'))
+                            .values_list('n', flat=True), reverse=True)
+        self.assertGreater(per_author[0], 10 * per_author[len(per_author) // 2])
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('user', password='pass12345')
+        # Authenticated item reads are limited to the user's interests.
+        for item in make_items(self.user, 3):
+            Favorite.objects.create(user=self.user, item=item)
+
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(
+            [benchmark_common.percentile(samples, p) for p in (50, 95, 99, 100)], [50, 95, 99, 100]
+        )
+
+    def test_discovers_get_endpoints(self):
+        routes = {route for route, _ in endpoint_benchmark.discover()}
+        self.assertIn('api/items/', routes)
+        self.assertIn('api/items/<pk>/', routes)
+        self.assertIn('api/users/<id>/stats/', routes)
+        self.assertNotIn('api/register/', routes)
+        self.assertFalse([route for route in routes if 'format' in route])
+
+    def test_report(self):
+        report = endpoint_benchmark.run(iterations=3, warmup=1, only=r'items/(<pk>/)?$|stats')
+        self.assertEqual(report['authenticated_as'], 'user')
+        self.assertEqual(report['rows']['items'], 3)
+        by_route = {result['route']: result for result in report['endpoints']}
+        self.assertEqual(set(by_route), {'api/items/', 'api/items/<pk>/', 'api/users/<id>/stats/', 'api/stats/'})
+        for result in by_route.values():
+            self.assertEqual(result['status'], 200, result['path'])
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['peak_memory_kb'], 0)
+        self.assertEqual(by_route['api/stats/']['queries'], 1)
+        json.dumps(report)
+
+
+class PerformanceMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client = APIClient()
+        self.author = User.objects.create_user('author', password='pass12345')
+        make_items(self.author, 3, Category.objects.create(name='tents'))
+
+    def server_timing(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/items/')
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'db', 'serialize', 'total'})
+        self.assertEqual(timing['db']['desc'], '"3 queries"')
+        self.assertGreater(float(timing['serialize']['dur']), 0)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/items/')
+        self.client.get('/api/items/')
+        self.client.get('/api/nothing-here/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE catalog_http_request_duration_seconds histogram', body)
+        self.assertIn('catalog_http_requests_total{view="equipment-list",method="GET",status="200"} 2', body)
+        self.assertIn('catalog_http_requests_total{view="<unresolved>",method="GET",status="404"} 1', body)
+        self.assertIn('catalog_http_request_duration_seconds_count{view="equipment-list",method="GET"} 2', body)
+        # The second list came from the catalog cache without queries.
+        self.assertIn('catalog_http_db_queries_sum{view="equipment-list"} 3.0', body)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('h', 'help', ('view',), buckets=(1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(('a',), value)
+        self.assertEqual(list(histogram.samples()), [
+            'h_bucket{view="a",le="1.0"} 2',
+            'h_bucket{view="a",le="5.0"} 3',
+            'h_bucket{view="a",le="+Inf"} 4',
+            'h_sum{view="a"} 11.5',
+            'h_count{view="a"} 4',
+        ])
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_can_be_restricted(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_metrics_are_local_only_by_default(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='::1').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 404)
+
+    @override_settings(METRICS_ALLOWED_IPS=None)
+    def test_metrics_can_be_opened(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 200)
+
+
+class NotificationInboxTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.client.force_authenticate(self.user)
+
+    def unread(self):
+        return self.client.get('/api/notifications/unread-count/').data['unread']
+
+    def test_counter_follows_inserts_reads_and_deletes(self):
+        notes = [Notification.objects.create(user=self.user, message=f'n{i}') for i in range(3)]
+        Notification.objects.create(user=self.user, message='old', is_read=True)
+        self.assertEqual(self.unread(), 3)
+
+        notes[0].is_read = True
+        notes[0].save()
+        notes[1].delete()
+        self.assertEqual(self.unread(), 1)
+
+        with self.assertMaxQueries(1):
+            self.client.get('/api/notifications/unread-count/')
+
+    def test_fan_out_counts_bulk_inserts(self):
+        author = User.objects.create_user('author', password='pass12345')
+        Follow.objects.create(follower=self.user, following=author)
+        tasks.notify_followers(item_id=1, author_id=author.id, message='new item')
+        self.assertEqual(self.unread(), 1)
+
+    def test_mark_read_up_to_id(self):
+        notes = [Notification.objects.create(user=self.user, message=f'n{i}') for i in range(5)]
+        other = User.objects.create_user('other', password='pass12345')
+        Notification.objects.create(user=other, message='not mine')
+
+        response = self.client.post('/api/notifications/mark-read/', {'up_to': notes[2].id})
+        self.assertEqual(response.data, {'marked': 3, 'unread': 2})
+        # Already read rows are not matched again.
+        response = self.client.post('/api/notifications/mark-read/', {'up_to': notes[2].id})
+        self.assertEqual(response.data, {'marked': 0, 'unread': 2})
+
+        response = self.client.post('/api/notifications/mark-read/')
+        self.assertEqual(response.data, {'marked': 2, 'unread': 0})
+        self.assertTrue(Notification.objects.filter(user=other, is_read=False).exists())
+
+        response = self.client.post('/api/notifications/mark-read/', {'up_to': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_inbox_is_paginated_newest_first(self):
+        notes = [Notification.objects.create(user=self.user, message=f'n{i}') for i in range(5)]
+        notes[4].is_read = True
+        notes[4].save()
+
+        response = self.client.get('/api/notifications/?page_size=2')
+        self.assertEqual([n['id'] for n in response.data['results']], [notes[4].id, notes[3].id])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([n['id'] for n in response.data['results']], [notes[2].id, notes[1].id])
+
+        response = self.client.get('/api/notifications/?unread=true&page_size=2')
+        self.assertEqual([n['id'] for n in response.data['results']], [notes[3].id, notes[2].id])
+
+    def test_reconcile_recounts(self):
+        Notification.objects.bulk_create([Notification(user=self.user, message='bulk')] * 2)
+        stats.reconcile(user_ids=[self.user.id])
+        self.assertEqual(self.unread(), 2)
+
+
+@override_settings(NOTIFICATION_STREAM_POLL_INTERVAL=None, NOTIFICATION_STREAM_HEARTBEAT=5)
+class NotificationStreamTests(TestCase):
+    def setUp(self):
+        # Streams of earlier tests were closed when their event loop shut down.
+        self.assertFalse(streams.broker.has_subscribers())
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.token = str(AccessToken.for_user(self.user))
+
+    async def ticket(self):
+        response = await self.async_client.post(
+            '/api/notifications/stream/ticket/', headers={'Authorization': f'Bearer {self.token}'},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['ticket']
+
+    @asynccontextmanager
+    async def connect(self, **headers):
+        response = await self.async_client.get(
+            '/api/notifications/stream/', {'ticket': await self.ticket()}, headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await self.next_chunk(content), 'retry: 3000\n\n')
+            yield content
+        finally:
+            await content.aclose()
+
+    async def next_chunk(self, content):
+        chunk = await asyncio.wait_for(anext(content), timeout=5)
+        return chunk.decode() if isinstance(chunk, bytes) else chunk
+
+    def event_id(self, chunk):
+        self.assertIn('event: notification', chunk)
+        return int(chunk.split('\n', 1)[0].removeprefix('id: '))
+
+    def create_committed(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=self.user, **kwargs)
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get('/api/notifications/stream/', {'ticket': 'nope'})
+        self.assertEqual(response.status_code, 401)
+        # A JWT in the query string would be written to access logs.
+        response = await self.async_client.get('/api/notifications/stream/', {'token': self.token})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post('/api/notifications/stream/ticket/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_ticket_opens_one_stream(self):
+        ticket = await self.ticket()
+        response = await self.async_client.get('/api/notifications/stream/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        await response.streaming_content.aclose()
+        response = await self.async_client.get('/api/notifications/stream/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(NOTIFICATION_STREAM_TICKET_TTL=0)
+    async def test_expired_ticket_is_refused(self):
+        response = await self.async_client.get('/api/notifications/stream/', {'ticket': await self.ticket()})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_authorization_header(self):
+        response = await self.async_client.get(
+            '/api/notifications/stream/', headers={'Authorization': f'Bearer {self.token}'},
+        )
+        self.assertEqual(response.status_code, 200)
+        await response.streaming_content.aclose()
+
+    async def test_replays_from_last_event_id_then_streams_new_rows(self):
+        first = await Notification.objects.acreate(user=self.user, message='first')
+        second = await Notification.objects.acreate(user=self.user, message='second')
+        async with self.connect(**{'Last-Event-ID': str(first.id)}) as content:
+            self.assertEqual(self.event_id(await self.next_chunk(content)), second.id)
+
+            third = await sync_to_async(self.create_committed)(message='third')
+            chunk = await self.next_chunk(content)
+            self.assertEqual(self.event_id(chunk), third.id)
+            self.assertIn('"message": "third"', chunk)
+
+    async def test_fan_out_is_pushed_once(self):
+        author = await User.objects.acreate(username='author')
+        await Follow.objects.acreate(follower=self.user, following=author)
+
+        def fan_out():
+            with self.captureOnCommitCallbacks(execute=True):
+                tasks.notify_followers(item_id=1, author_id=author.id, message='new item')
+            # The same row offered again (e.g. by the poller) is not sent twice.
+            notification = Notification.objects.get(user=self.user)
+            streams.publish([notification])
+            return notification
+        async with self.connect() as content:
+            notification = await sync_to_async(fan_out)()
+            self.assertEqual(self.event_id(await self.next_chunk(content)), notification.id)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(anext(content), timeout=0.2)
+
+    @override_settings(NOTIFICATION_STREAM_POLL_INTERVAL=0.05)
+    async def test_poller_picks_up_rows_from_other_processes(self):
+        async with self.connect() as content:
+            # Inserted without an on_commit publish, as another process would.
+            notification = await Notification.objects.acreate(user=self.user, message='elsewhere')
+            self.assertEqual(self.event_id(await self.next_chunk(content)), notification.id)
+
+    async def test_closing_the_stream_unsubscribes(self):
+        events = streams.stream(self.user.id, after_id=0)
+        self.assertEqual(await anext(events), 'retry: 3000\n\n')
+        self.assertTrue(streams.broker.has_subscribers(self.user.id))
+        await events.aclose()
+        self.assertFalse(streams.broker.has_subscribers())
+
+    @override_settings(NOTIFICATION_STREAM_HEARTBEAT=0.05)
+    async def test_heartbeat(self):
+        async with self.connect() as content:
+            self.assertEqual(await self.next_chunk(content), ': ping\n\n')
+
+
+class AsyncReadViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        self.items = make_items(self.user, 3, tag=Tag.objects.create(name='camera'))
+        Favorite.objects.create(user=self.user, item=self.items[0])
+        Comment.objects.create(item=self.items[0], author=self.user, text='first')
+        Comment.objects.create(item=self.items[0], author=self.user, text='second')
+        Notification.objects.create(user=self.user, message='hello')
+        stats.reconcile()
+        self.paths = [
+            '/api/items/', f'/api/items/{self.items[0].id}/', f'/api/items/{self.items[0].id}/comments/',
+            f'/api/users/{self.user.id}/stats/', '/api/stats/', '/api/notifications/?unread=true',
+            '/api/notifications/unread-count/', '/api/items/?page_size=2',
+        ]
+
+    async def get(self, path, **headers):
+        return await self.async_client.get(path, headers={**self.auth, **headers})
+
+    async def test_responses_match_the_sync_views(self):
+        for path in self.paths:
+            response = await self.get(path)
+            with override_settings(ASYNC_READ_VIEWS=False):
+                expected = await self.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual(response.json(), expected.json(), path)
+
+    async def test_plain_reads_do_not_reach_the_drf_views(self):
+        refuse = AssertionError("served by the sync view")
+        with mock.patch.object(EquipmentViewSet, 'list', side_effect=refuse), \
+                mock.patch.object(EquipmentViewSet, 'retrieve', side_effect=refuse), \
+                mock.patch.object(CommentViewSet, 'list', side_effect=refuse), \
+                mock.patch.object(UserStatsView, 'get', side_effect=refuse):
+            for path in self.paths[:4]:
+                self.assertEqual((await self.get(path)).status_code, 200, path)
+
+            page = (await self.get('/api/items/?page_size=2')).json()
+            self.assertEqual(len(page['results']), 2)
+            rest = (await self.get(page['next'])).json()
+            self.assertEqual([item['id'] for item in page['results'] + rest['results']],
+                             [item.id for item in reversed(self.items)])
+
+    async def test_everything_else_falls_back_to_drf(self):
+        self.assertEqual((await self.get('/api/items/?search=item')).status_code, 200)
+        self.assertEqual((await self.get('/api/items/?cursor=broken')).status_code, 404)
+        self.assertEqual((await self.get('/api/items/999999/')).status_code, 404)
+        self.assertEqual((await self.get('/api/stats/', Authorization='Bearer nope')).status_code, 401)
+        self.assertEqual((await self.async_client.get('/api/notifications/')).status_code, 401)
+        response = await self.get('/api/items/', Accept='text/html')
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    async def test_anonymous_catalog_cache_is_shared_with_the_sync_views(self):
+        with override_settings(ASYNC_READ_VIEWS=False):
+            cold = await self.async_client.get('/api/items/')
+        warm = await self.async_client.get('/api/items/')
+        self.assertEqual(warm['ETag'], cold['ETag'])
+        self.assertEqual(warm.json(), cold.json())
+        response = await self.async_client.get('/api/items/', headers={'If-None-Match': cold['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_queries_are_timed(self):
+        metrics.reset()
+        response = await self.get(f'/api/items/{self.items[0].id}/comments/')
+        # The token's user and profile (cached from then on), then the comments with their authors.
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="3 queries"')
+        response = await self.get(f'/api/items/{self.items[0].id}/comments/')
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="1 queries"')
+
+    def test_only_the_asgi_application_installs_the_async_views(self):
+        async def handler(request):
+            return None
+
+        # The test suite loads catalog.asgi (through the ASGI benchmark) before the URLconf.
+        self.assertTrue(async_views.asgi)
+        sync_view = UserStatsView.as_view()
+        self.assertIsNot(async_views.hybrid(sync_view, handler), sync_view)
+        with mock.patch.object(async_views, 'asgi', False):
+            self.assertIs(async_views.hybrid(sync_view, handler), sync_view)
+            with override_settings(ASYNC_READ_VIEWS=True):
+                self.assertIsNot(async_views.hybrid(sync_view, handler), sync_view)
+        with override_settings(ASYNC_READ_VIEWS=False):
+            self.assertIs(async_views.hybrid(sync_view, handler), sync_view)
+
+
+class AsyncBenchmarkTests(TransactionTestCase):
+    def test_compare_sync_and_async(self):
+        user = User.objects.create_user('user', password='pass12345')
+        stats.reconcile()
+        report = asgi_benchmark.compare(requests=6, concurrency=3, warmup=0, only='stats')
+        self.assertEqual(report['authenticated_as'], user.username)
+        self.assertEqual([row['route'] for row in report['endpoints']], ['api/users/<id>/stats/', 'api/stats/'])
+        for row in report['endpoints']:
+            for mode in ('sync', 'async'):
+                self.assertEqual(row[mode]['statuses'], {'200': 6}, (row['route'], mode))
+                self.assertGreater(row[mode]['requests_per_second'], 0)
+        json.dumps(report)
+
+
+class SqliteTuningTests(TestCase):
+    def open(self, name, **options):
+        default = connections['default']
+        options = options or settings.DATABASES['default']['OPTIONS']
+        wrapper = type(default)({**default.settings_dict, 'NAME': name, 'OPTIONS': options}, 'tuning')
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_connections_are_tuned(self):
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+        pragmas = sqlite.pragmas(connection)
+        self.assertEqual(pragmas['busy_timeout'], 5000)
+        self.assertEqual(pragmas['synchronous'], 1)
+        self.assertEqual(pragmas['cache_size'], -32000)
+
+    def test_file_database_switches_to_wal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = self.open(os.path.join(directory, 'db.sqlite3'))
+        self.assertEqual(sqlite.pragmas(wrapper)['journal_mode'], 'wal')
+
+    def test_query_only_connection_is_left_to_read(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        name = os.path.join(directory, 'db.sqlite3')
+        self.open(name).connection.execute('CREATE TABLE t (x)')
+        reader = self.open(name, init_command=f'PRAGMA query_only = ON; {settings.SQLITE_PRAGMAS}')
+        self.assertIsNone(reader.transaction_mode)
+        pragmas = sqlite.pragmas(reader)
+        self.assertEqual((pragmas['journal_mode'], pragmas['busy_timeout']), ('wal', 5000))
+        with self.assertRaisesMessage(Exception, 'readonly'):
+            reader.connection.execute('INSERT INTO t VALUES (1)')
+
+
+class ReadWriteRouterTests(TransactionTestCase):
+    def test_routes_reads_outside_transactions_only(self):
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_read(Equipment), 'read')
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Equipment), 'default')
+        self.assertEqual(router.db_for_write(Equipment), 'default')
+        self.assertTrue(router.allow_migrate('default', 'api'))
+        self.assertFalse(router.allow_migrate('read', 'api'))
+
+    def test_contention_benchmark(self):
+        user = User.objects.create_user('user', password='pass12345')
+        make_items(user, 2)
+        stats.reconcile()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        scratch = os.path.join(directory, 'db.sqlite3')
+        connection.ensure_connection()
+        with closing(sqlite3.connect(scratch)) as copy:
+            connection.connection.backup(copy)
+        with self.assertRaisesMessage(ValueError, 'pass a copy'):
+            sqlite_benchmark.contention(settings.DATABASES['default']['NAME'])
+        with self.assertRaisesMessage(ValueError, 'does not exist'):
+            sqlite_benchmark.contention(os.path.join(directory, 'missing.sqlite3'))
+
+        report = sqlite_benchmark.contention(scratch, duration=0.2, readers=1, writers=1)
+        self.assertEqual([row['profile'] for row in report['profiles']], ['default', 'tuned'])
+        for row in report['profiles']:
+            self.assertGreater(row['writes_per_second'], 0)
+            self.assertIn('reads_per_second', row)
+        with closing(sqlite3.connect(scratch)) as copy:
+            self.assertEqual(copy.execute('SELECT COUNT(*) FROM api_comment').fetchone(), (0,))
+            self.assertEqual(copy.execute('SELECT comments FROM api_stats WHERE user_id IS NULL').fetchone(), (0,))
+        # Nothing ran on the test database.
+        self.assertNotEqual(connection.settings_dict['NAME'], scratch)
+        self.assertFalse(Comment.objects.exists())
+        json.dumps(report)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.users.clear()
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.token = AccessToken.for_user(self.user)
+        self.auth = authentication.CachedJWTAuthentication()
+
+    def authenticate(self, token=None):
+        return self.auth.get_user(self.auth.get_validated_token(str(token or self.token)))
+
+    def test_repeat_requests_need_no_query(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.profile.user_id, self.user.id)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/api/me/').data['username'], 'user')
+
+    def test_each_request_gets_its_own_instances(self):
+        first = self.authenticate()
+        first.username = 'changed'
+        first.profile.bio = 'changed'
+        second = self.authenticate()
+        self.assertEqual(second.username, 'user')
+        self.assertEqual(second.profile.bio, '')
+
+    def test_user_and_profile_changes_are_picked_up(self):
+        self.authenticate()
+        self.user.profile.bio = 'climber'
+        self.user.profile.save()
+        self.assertEqual(self.authenticate().profile.bio, 'climber')
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User is inactive'):
+            self.authenticate()
+
+        self.user.delete()
+        with self.assertRaisesMessage(AuthenticationFailed, 'User not found'):
+            self.authenticate()
+
+    def test_entries_expire_and_are_bounded(self):
+        other = User.objects.create_user('other', password='pass12345')
+        with override_settings(JWT_USER_CACHE_TTL=0):
+            self.authenticate()
+            with self.assertNumQueries(2):
+                self.authenticate()
+        with override_settings(JWT_USER_CACHE_SIZE=1):
+            self.authenticate()
+            self.authenticate(AccessToken.for_user(other))
+            self.assertEqual(list(authentication.users.entries), [str(other.id)])
+
+    def test_a_user_loaded_before_a_change_is_not_stored(self):
+        generation = authentication.users.generation
+        authentication.forget_user(self.user.id)
+        authentication.users.set(str(self.user.id), self.user, generation)
+        self.assertIsNone(authentication.users.get(str(self.user.id)))
+
+
+class EquipmentCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.item, self.other = make_items(self.user, 2)
+        self.voters = [User.objects.create_user(f'voter{i}', password='pass12345') for i in range(3)]
+
+    def counters(self, item=None):
+        item = Equipment.objects.get(pk=(item or self.item).pk)
+        return item.like_count, item.rating_count, item.rating_sum
+
+    def test_likes_and_ratings_keep_the_counters(self):
+        likes = [Like.objects.create(user=voter.profile, item=self.item) for voter in self.voters]
+        ratings = [Rating.objects.create(user=voter, item=self.item, value=value)
+                   for voter, value in zip(self.voters, (5, 4, 3))]
+        self.assertEqual(self.counters(), (3, 3, 12))
+
+        ratings[0].value = 1
+        ratings[0].save()
+        likes[0].delete()
+        ratings[1].delete()
+        self.assertEqual(self.counters(), (2, 2, 4))
+
+        likes[1].item = self.other
+        likes[1].save()
+        ratings[2].item = self.other
+        ratings[2].save()
+        self.assertEqual(self.counters(), (1, 1, 1))
+        self.assertEqual(self.counters(self.other), (1, 1, 3))
+
+    def test_rebuild_counters(self):
+        Like.objects.create(user=self.voters[0].profile, item=self.item)
+        Rating.objects.create(user=self.voters[0], item=self.item, value=4)
+        Equipment.objects.update(like_count=7, rating_count=0, rating_sum=9)
+        call_command('rebuild_counters', stdout=io.StringIO())
+        self.assertEqual(self.counters(), (1, 1, 4))
+        self.assertEqual(self.counters(self.other), (0, 0, 0))
+
+
+class CommentCounterTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('user', password='pass12345')
+        self.item = make_items(self.user, 1)[0]
+        self.comment = Comment.objects.create(item=self.item, author=self.user, text='first')
+        self.voters = [User.objects.create_user(f'voter{i}', password='pass12345') for i in range(3)]
+
+    def counters(self, comment=None):
+        comment = Comment.objects.get(pk=(comment or self.comment).pk)
+        return comment.like_count, comment.rating_count, comment.rating_sum
+
+    def test_likes_and_ratings_keep_the_counters(self):
+        likes = [CommentLike.objects.create(user=voter, comment=self.comment) for voter in self.voters]
+        ratings = [CommentRating.objects.create(user=voter, comment=self.comment, value=value)
+                   for voter, value in zip(self.voters, (5, 4, 3))]
+        self.assertEqual(self.counters(), (3, 3, 12))
+
+        ratings[0].value = 1
+        ratings[0].save()
+        likes[0].delete()
+        ratings[1].delete()
+        self.assertEqual(self.counters(), (2, 2, 4))
+
+        other = Comment.objects.create(item=self.item, author=self.user, text='second')
+        ratings[2].comment = other
+        ratings[2].save()
+        self.assertEqual(self.counters(), (2, 1, 1))
+        self.assertEqual(self.counters(other), (0, 1, 3))
+
+    def test_rebuild_counters(self):
+        CommentLike.objects.create(user=self.voters[0], comment=self.comment)
+        CommentRating.objects.create(user=self.voters[0], comment=self.comment, value=4)
+        Comment.objects.update(like_count=7, rating_count=0, rating_sum=0)
+        call_command('rebuild_counters', stdout=io.StringIO())
+        self.assertEqual(self.counters(), (1, 1, 4))
+
+    def test_list_is_one_query_however_many_comments(self):
+        for voter in self.voters:
+            comment = Comment.objects.create(item=self.item, author=voter, text='hi')
+            CommentLike.objects.create(user=self.user, comment=comment)
+            CommentRating.objects.create(user=self.user, comment=comment, value=4)
+        client = APIClient()
+        for async_reads in (True, False):
+            with override_settings(ASYNC_READ_VIEWS=async_reads), self.assertMaxQueries(1):
+                response = client.get(f'/api/items/{self.item.id}/comments/')
+            self.assertEqual(response.status_code, 200)
+            newest = response.json()['results'][0]
+            self.assertEqual(newest['author'], 'voter2')
+            self.assertEqual((newest['like_count'], newest['rating_count'], newest['avg_rating']), (1, 1, 4.0))
+
+
+
+class FacetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user('user', password='pass12345')
+        tents, stoves = Category.objects.create(name='tents'), Category.objects.create(name='stoves')
+        winter, summer = Tag.objects.create(name='winter'), Tag.objects.create(name='summer')
+        make_items(self.user, 3, tents, winter)
+        make_items(self.user, 2, stoves, winter)
+        self.summer = make_items(self.user, 1, tents, summer)[0]
+
+    def facets(self, query=''):
+        response = self.client.get(f'/api/items/?facets=categories,tags{query}')
+        self.assertEqual(response.status_code, 200)
+        return {name: [(row['name'], row['count']) for row in rows] for name, rows in response.data['facets'].items()}
+
+    def test_counts_follow_the_filtered_result_set(self):
+        self.assertEqual(self.facets(), {
+            'categories': [('tents', 4), ('stoves', 2)],
+            'tags': [('winter', 5), ('summer', 1)],
+        })
+        self.assertEqual(self.facets('&tags__name=winter&page_size=1'), {
+            'categories': [('tents', 3), ('stoves', 2)],
+            'tags': [('winter', 5)],
+        })
+        self.assertEqual(self.client.get('/api/items/?facets=tags').data['facets'].keys(), {'tags'})
+
+    def test_one_query_per_facet_then_none(self):
+        # Signed-in users see their favourites and items sharing a tag with them.
+        Favorite.objects.create(user=self.user, item=self.summer)
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/items/')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/items/?facets=categories,tags')
+        self.assertEqual(sum('COUNT(DISTINCT' in q['sql'] for q in ctx.captured_queries), 2)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/items/?facets=tags,categories&page_size=2')
+        self.assertFalse(any('COUNT(DISTINCT' in q['sql'] for q in ctx.captured_queries))
+
+    def test_catalog_changes_invalidate_the_counts(self):
+        self.facets()
+        self.summer.categories.clear()
+        self.assertEqual(self.facets()['categories'], [('tents', 3), ('stoves', 2)])
+
+    def test_unknown_facet(self):
+        response = self.client.get('/api/items/?facets=authors')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('facets', response.data)
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=2, TASKS_RUN_EAGERLY=True)
+class FeedTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader', password='pass12345')
+        self.author = User.objects.create_user('author', password='pass12345')
+        self.popular = User.objects.create_user('popular', password='pass12345')
+        for i in range(3):
+            Follow.objects.create(follower=User.objects.create_user(f'fan{i}'), following=self.popular)
+        Follow.objects.create(follower=self.reader, following=self.author)
+        Follow.objects.create(follower=self.reader, following=self.popular)
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def post(self, author, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_items(author, count)
+
+    def feed(self, url='/api/feed/?page_size=3'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_timeline_merged_with_popular_authors(self):
+        items = []
+        for _ in range(3):
+            items += self.post(self.author, 1) + self.post(self.popular, 1)
+        make_items(User.objects.create_user('stranger'), 2)
+        # Only the author below the limit is fanned out.
+        self.assertEqual(set(TimelineEntry.objects.values_list('author_id', flat=True)), {self.author.id})
+
+        ids, url = [], '/api/feed/?page_size=4'
+        while url:
+            page = self.feed(url)
+            ids += [item['id'] for item in page['results']]
+            url = page['next']
+        self.assertEqual(ids, [item.id for item in reversed(items)])
+        previous = self.feed(self.feed(self.feed()['next'])['previous'])
+        self.assertEqual([item['id'] for item in previous['results']], ids[:3])
+
+    def test_page_cost_does_not_depend_on_followees(self):
+        self.post(self.author, 3)
+        self.post(self.popular, 3)
+        with self.assertMaxQueries(100) as few:
+            self.feed()
+        for i in range(20):
+            followee = User.objects.create_user(f'followee{i}')
+            Follow.objects.create(follower=self.reader, following=followee)
+            self.post(followee, 2)
+        with self.assertMaxQueries(len(few)):
+            self.assertEqual(len(self.feed()['results']), 3)
+
+    def test_follow_and_unfollow(self):
+        other = User.objects.create_user('other')
+        items = self.post(other, 2)
+        follow = Follow.objects.create(follower=self.reader, following=other)
+        self.assertEqual([item['id'] for item in self.feed()['results']], [item.id for item in reversed(items)])
+        follow.delete()
+        self.assertEqual(self.feed()['results'], [])
+
+    def test_author_crossing_the_limit_is_not_listed_twice(self):
+        items = self.post(self.author, 2)
+        for i in range(2):
+            Follow.objects.create(follower=User.objects.create_user(f'new{i}'), following=self.author)
+        self.assertEqual(feed.popular_followees(self.reader.id).count(), 2)
+        self.assertEqual([item['id'] for item in self.feed()['results']], [item.id for item in reversed(items)])
+
+    def test_author_without_stats_row_is_counted(self):
+        Stats.objects.filter(user__in=[self.author, self.popular]).delete()
+        self.assertEqual(list(feed.popular_followees(self.reader.id).values_list('following_id', flat=True)),
+                         [self.popular.id])
+        items = self.post(self.popular, 1) + self.post(self.author, 1)
+        self.assertEqual(list(TimelineEntry.objects.values_list('author_id', flat=True)), [self.author.id])
+        self.assertEqual([item['id'] for item in self.feed()['results']], [item.id for item in reversed(items)])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_author_falling_back_to_the_limit_is_backfilled(self):
+        other = User.objects.create_user('other')
+        Follow.objects.create(follower=self.reader, following=other)
+        follow = Follow.objects.create(follower=User.objects.create_user('fan'), following=other)
+        items = self.post(other, 2)
+        self.assertFalse(TimelineEntry.objects.filter(author=other).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        self.assertEqual([item['id'] for item in self.feed()['results']], [item.id for item in reversed(items)])
+        # Unfollows further below the limit queue nothing.
+        with self.captureOnCommitCallbacks() as callbacks:
+            Follow.objects.filter(following=other).delete()
+        self.assertEqual(callbacks, [])
+
+    def test_rebuild_timelines(self):
+        self.post(self.author, 2)
+        self.post(self.popular, 2)
+        expected = self.feed()
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timelines', stdout=io.StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+        self.assertEqual(self.feed(), expected)
+
+    def test_requires_authentication(self):
+        self.assertEqual(APIClient().get('/api/feed/').status_code, 401)
+
+    def test_benchmark(self):
+        report = feed_benchmark.feed_comparison(followees=30, items_per_author=2, popular=3, depth=3,
+                                                iterations=1, warmup=0)
+        self.assertTrue(report['same_results'])
+        self.assertEqual([(row['strategy'], row['page']) for row in report['reads']],
+                         [('timeline', 1), ('timeline', 3), ('join', 1), ('join', 3)])
+        self.assertFalse(User.objects.filter(username__startswith=feed_benchmark.FEED_MARKER).exists())
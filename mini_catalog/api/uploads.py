@@ -0,0 +1,166 @@
+"""
+Streaming validation and content-addressed storage for Equipment.file.
+
+The content-hash upload handlers see each chunk as it arrives: they reject a
+file as soon as it passes the size limit or its first bytes don't match an
+allowed type, and hash the content on its way into memory (or, above
+FILE_UPLOAD_MAX_MEMORY_SIZE, a temporary file). Files are then stored under
+their SHA-256 digest and the extension of their sniffed type, so identical
+uploads share one file on disk; FileReference counts the items pointing at each file and
+the file is deleted when the last one goes away.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, SkipFile, TemporaryFileUploadHandler
+
+MAX_FILE_SIZE = 5 * 1024 * 1024
+ALLOWED_FILE_TYPES = {'jpeg', 'png', 'pdf'}
+
+# Leading bytes of each accepted file type
+SIGNATURES = {
+    'jpeg': b'\xff\xd8\xff',
+    'png': b'\x89PNG\r\n\x1a\n',
+    'pdf': b'%PDF-',
+}
+# Stored extension of each type, whatever the uploaded name says
+EXTENSIONS = {'jpeg': '.jpg', 'png': '.png', 'pdf': '.pdf'}
+
+
+def sniff(head):
+    for kind, signature in SIGNATURES.items():
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+class ContentHashMixin:
+    """
+    Hash uploads as they stream in and enforce `rules` per form field.
+
+    `rules` maps a field name to (max size in bytes, allowed sniffed types).
+    A rejected file is skipped and its error stored in
+    `request.upload_errors[field_name]` for the serializer to report.
+    """
+
+    def __init__(self, request=None, rules=None):
+        super().__init__(request)
+        self.rules = rules or {}
+        if request is not None and not hasattr(request, 'upload_errors'):
+            request.upload_errors = {}
+
+    def new_file(self, field_name, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        self.received = 0
+        self.kind = None
+        self.rule = self.rules.get(field_name)
+        super().new_file(field_name, *args, **kwargs)
+
+    def reject(self, message):
+        self.request.upload_errors[self.field_name] = message
+        self.upload_interrupted()
+        raise SkipFile()
+
+    def receive_data_chunk(self, raw_data, start):
+        # The in-memory handler passes requests above FILE_UPLOAD_MAX_MEMORY_SIZE on untouched.
+        if not getattr(self, 'activated', True):
+            return raw_data
+        self.received += len(raw_data)
+        if self.rule:
+            max_size, kinds = self.rule
+            if self.received > max_size:
+                self.reject(f"Файл көлемі {max_size // (1024 * 1024)}MB-тан аспауы керек.")
+            if start == 0:
+                self.kind = sniff(raw_data)
+                if self.kind not in kinds:
+                    self.reject("Рұқсат етілген форматтар: JPG, PNG, PDF.")
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+            file.sniffed_type = self.kind
+        return file
+
+
+class MemoryContentHashUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    pass
+
+
+class TemporaryContentHashUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class StreamingUploadMixin:
+    """
+    Install the content-hash handlers with the view's `upload_rules` before parsing.
+
+    Uploads stay in memory up to FILE_UPLOAD_MAX_MEMORY_SIZE (MAX_FILE_SIZE
+    bounds them anyway) and only larger requests are spooled to a temporary file.
+    """
+    upload_rules = {}
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [
+            MemoryContentHashUploadHandler(request, self.upload_rules),
+            TemporaryContentHashUploadHandler(request, self.upload_rules),
+        ]
+        return super().initialize_request(request, *args, **kwargs)
+
+
+# -----------------------
+# Content-addressed storage
+# -----------------------
+def content_digest(file):
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def content_extension(file, filename):
+    """The extension of the sniffed type, so .JPG, .jpeg and .jpg of the same bytes share one name."""
+    kind = getattr(file, 'sniffed_type', None)
+    if kind is None:
+        file.seek(0)
+        kind = sniff(file.read(16))
+        file.seek(0)
+    return EXTENSIONS.get(kind) or os.path.splitext(filename)[1].lower()
+
+
+def equipment_file_path(instance, filename):
+    digest = content_digest(instance.file.file)
+    ext = content_extension(instance.file.file, filename)
+    return f"equipment_files/sha256/{digest[:2]}/{digest}{ext}"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Names are digests: an existing name already holds the same bytes, so it is never rewritten."""
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        # Write under a unique name and rename into place, so two concurrent
+        # uploads of the same content never see a half-written file.
+        partial = super()._save(f"{name}.{uuid.uuid4().hex}.part", content)
+        os.replace(self.path(partial), self.path(name))
+        return name
+
+
+def equipment_file_storage():
+    return ContentAddressedStorage()
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith('equipment_files/sha256/')
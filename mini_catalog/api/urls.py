@@ -2,21 +2,37 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import EquipmentViewSet, RegisterView, MeView, CommentViewSet, EquipmentListViewSet, ProfileListView, \
     CommentListCreateView, CommentDeleteView, LikeCreateView, RatingCreateView, AddItemToListView, ProfileUpdateView, \
-    SubscribeTagView, SubscribeCategoryView, RecommendationsView
+    SubscribeTagView, SubscribeCategoryView, RecommendationsView, UserStatsView, GlobalStatsView, \
+    EquipmentImportView, EquipmentExportView, NotificationListView, UnreadNotificationCountView, \
+    MarkNotificationsReadView, NotificationStreamTicketView, FeedView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from .streams import notification_stream
+from .async_views import hybrid, item_list, item_detail, comment_list, user_stats_view, global_stats_view, \
+    notification_list, unread_count
 
 router = DefaultRouter()
 router.register('items', EquipmentViewSet)
 router.register('lists', EquipmentListViewSet, basename='list')
 
+# GET served natively async under ASGI (api/async_views.py); listed before the router so they win.
+items = EquipmentViewSet.as_view({'get': 'list', 'post': 'create'}, basename='equipment', detail=False)
+item = EquipmentViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    basename='equipment', detail=True,
+)
+
 urlpatterns = [
     path("register/", RegisterView.as_view(), name="register"),
     path("login/", TokenObtainPairView.as_view(), name="login"),
     path("token/refresh", TokenRefreshView.as_view(), name="token_refresh"),
     path("me/", MeView.as_view(), name="me"),
+    path("items/import/", EquipmentImportView.as_view(), name="items-import"),
+    path("items/export/", EquipmentExportView.as_view(), name="items-export"),
+    path("items/", hybrid(items, item_list), name="equipment-list"),
+    path("items/<int:pk>/", hybrid(item, item_detail), name="equipment-detail"),
     path('', include(router.urls)),
     path('profile/', ProfileListView.as_view()),
-    path('items/<int:equipment_id>/comments/', CommentViewSet.as_view({'get': 'list', 'post': 'create'}), name='comment-list'),
+    path('items/<int:equipment_id>/comments/', hybrid(CommentViewSet.as_view({'get': 'list', 'post': 'create'}), comment_list), name='comment-list'),
     path("items/<int:item_id>/comments/", CommentListCreateView.as_view()),
     path("comments/<int:pk>/", CommentDeleteView.as_view()),
     path("items/<int:item_id>/like/", LikeCreateView.as_view()),
@@ -26,4 +42,13 @@ urlpatterns = [
     path("subscribe/tag/<int:id>/", SubscribeTagView.as_view(), name="subscribe-tag"),
     path("subscribe/category/<int:id>/", SubscribeCategoryView.as_view(), name="subscribe-category"),
     path("users/<int:user_id>/recommendations/", RecommendationsView.as_view(), name="recommendations"),
+    path("users/<int:id>/stats/", hybrid(UserStatsView.as_view(), user_stats_view), name="user-stats"),
+    path("stats/", hybrid(GlobalStatsView.as_view(), global_stats_view), name="global-stats"),
+    path("notifications/", hybrid(NotificationListView.as_view(), notification_list), name="notifications"),
+    path("notifications/unread-count/", hybrid(UnreadNotificationCountView.as_view(), unread_count),
+         name="notifications-unread-count"),
+    path("notifications/mark-read/", MarkNotificationsReadView.as_view(), name="notifications-mark-read"),
+    path("notifications/stream/", notification_stream, name="notifications-stream"),
+    path("notifications/stream/ticket/", NotificationStreamTicketView.as_view(), name="notifications-stream-ticket"),
+    path("feed/", FeedView.as_view(), name="feed"),
 ]
\ No newline at end of file
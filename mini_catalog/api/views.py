@@ -1,15 +1,26 @@
-from django.db.models import Avg, Count
-from django.shortcuts import render
+from django.db.models import F
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.shortcuts import render, get_object_or_404
 from rest_framework import permissions, generics, viewsets, filters
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from django.contrib.auth.models import User
 from rest_framework.views import APIView
+from django.db import transaction
 from django.db.models import Q
 
-from .models import Equipment, Comment, EquipmentList, Profile, History, Follow, Tag, Like, Rating, Category
+from . import exporter, facets, feed, stats, streams
+from .cache import CatalogCacheMixin, user_interests
+from .importer import Importer, format_for
+from .pagination import MergedKeysetPagination
+from .uploads import StreamingUploadMixin, MAX_FILE_SIZE, ALLOWED_FILE_TYPES
+from .search import FullTextSearchFilter
+from .models import Equipment, Comment, EquipmentList, Profile, History, Follow, Tag, Like, Rating, Category, Stats, \
+    Notification
 from .serializers import EquipmentSerializer, RegisterSerializer, UserSerializer, CommentSerializer, \
     EquipmentListSerializer, ProfileSerializer, LikeSerializer, RatingSerializer, HistorySerializer, FollowSerializer, \
     NotificationSerializer, FavoriteSerializer, CommentLikeSerializer, CommentRatingSerializer, \
@@ -28,18 +39,27 @@ class MeView(generics.RetrieveAPIView):
     def get_object(self):
         return self.request.user
 
-class EquipmentViewSet(viewsets.ModelViewSet):
-    queryset = Equipment.objects.all()
+def personalise(queryset, favorite_ids, tag_ids):
+    # Favourited items and items sharing a tag with them.
+    tagged = Equipment.tags.through.objects.filter(tag_id__in=tag_ids).values('equipment_id')
+    return queryset.filter(
+        Q(id__in=tagged) | Q(id__in=favorite_ids)
+    )
+
+class EquipmentViewSet(CatalogCacheMixin, StreamingUploadMixin, viewsets.ModelViewSet):
+    queryset = Equipment.objects.with_related()
     serializer_class = EquipmentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    upload_rules = {'file': (MAX_FILE_SIZE, ALLOWED_FILE_TYPES)}
 
     filter_backends = [
-        filters.SearchFilter,
+        FullTextSearchFilter,
         DjangoFilterBackend,
         filters.OrderingFilter
     ]
 
-    search_fields = ['name', 'description', 'tags']
+    # Used by FullTextSearchFilter only when FTS5 is unavailable
+    search_fields = ['name', 'description', 'tags__name', 'categories__name']
     filterset_fields = ['available_from', 'categories__name', 'tags__name']
     ordering_fields = ['created_at', 'name']
 
@@ -52,16 +72,20 @@ class EquipmentViewSet(viewsets.ModelViewSet):
 
         user = self.request.user
 
-        if user.is_authenticated:
-            user_tags = Tag.objects.filter(items__in=[f.item for f in user.favorites.all()])
-            favorite_ids = [f.item.id for f in user.favorites.all()]
-
-            queryset = queryset.filter(
-                Q(tags__in=user_tags) | Q(id__in=favorite_ids)
-            )
+        # Writes are checked against the author in perform_update/perform_destroy.
+        if user.is_authenticated and self.action in ('list', 'retrieve'):
+            queryset = personalise(queryset, *user_interests(user.id))
 
         return queryset.distinct()
 
+    def list(self, request, *args, **kwargs):
+        names = facets.requested(request)
+        response = super().list(request, *args, **kwargs)
+        if names and isinstance(response.data, dict):
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data['facets'] = facets.facet_counts(request, queryset, names)
+        return response
+
     def perform_update(self, serializer):
         if serializer.instance.author != self.request.user:
             raise PermissionDenied("Вы не можете редактировать чужую запись")
@@ -72,16 +96,48 @@ class EquipmentViewSet(viewsets.ModelViewSet):
             raise PermissionDenied("Вы не можете удалить чужую запись")
         instance.delete()
 
+class EquipmentImportView(APIView):
+    """Bulk-create items from an uploaded CSV or NDJSON `file`."""
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({"file": "Загрузите CSV или NDJSON файл."})
+        fmt = request.data.get('type') or format_for(upload.name)
+        if fmt not in ('csv', 'ndjson'):
+            raise ValidationError({"type": "Поддерживаются форматы csv и ndjson."})
+        report = Importer(request.user).run(upload, fmt)
+        return Response(report)
+
+class EquipmentExportView(APIView):
+    """Stream the whole catalog as `?type=ndjson` (default) or `?type=csv`."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        fmt = request.query_params.get('type', 'ndjson')
+        if fmt not in exporter.FORMATS:
+            raise ValidationError({"type": "Поддерживаются форматы csv и ndjson."})
+        encode, content_type = exporter.FORMATS[fmt]
+        lines = encode(exporter.export_rows())
+        if isinstance(request._request, ASGIRequest):
+            lines = exporter.async_lines(lines)
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="catalog.{fmt}"'
+        return response
+
 class CommentViewSet(viewsets.ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
-        item_id = self.kwargs.get('item_id')
-        return Comment.objects.filter(item_id=item_id).order_by('-created_at')
+        # Keyset-paginated newest first on the (item, created_at, id) index.
+        item_id = self.kwargs.get('equipment_id')
+        return Comment.objects.with_related().filter(item_id=item_id)
 
     def perform_create(self, serializer):
-        item_id = self.kwargs.get('item_id')
+        item_id = self.kwargs.get('equipment_id')
         serializer.save(author=self.request.user, item_id=item_id)
 
 class CommentListCreateView(generics.ListCreateAPIView):
@@ -90,7 +146,7 @@ class CommentListCreateView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         item_id = self.kwargs['item_id']
-        return Comment.objects.filter(item_id=item_id)
+        return Comment.objects.with_related().filter(item_id=item_id)
 
     def perform_create(self, serializer):
         item_id = self.kwargs['item_id']
@@ -107,6 +163,7 @@ class CommentDeleteView(generics.DestroyAPIView):
 class EquipmentListViewSet(viewsets.ModelViewSet):
     serializer_class = EquipmentListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('-added_at', '-id')
 
     def get_queryset(self):
         return EquipmentList.objects.filter(user=self.request.user)
@@ -117,6 +174,7 @@ class EquipmentListViewSet(viewsets.ModelViewSet):
 class ProfileListView(generics.ListCreateAPIView):
     queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
+    keyset_ordering = ('-id',)
 
 class ProfileUpdateView(generics.UpdateAPIView):
     serializer_class = ProfileSerializer
@@ -174,13 +232,75 @@ class FollowersListView(generics.ListAPIView):
         user = User.objects.get(id=self.kwargs['id'])
         return Follow.objects.filter(following=user)
 
+# Лента: новые записи тех, на кого подписан пользователь
+class FeedView(generics.ListAPIView):
+    """Timeline rows merged with the items of popular followees (api/feed.py)."""
+    serializer_class = EquipmentSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = MergedKeysetPagination
+    filter_backends = []
+    keyset_ordering = feed.ORDERING
+
+    def get_queryset(self):
+        return feed.sources(self.request.user.id)
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(feed.items(page), many=True)
+        return self.get_paginated_response(serializer.data)
+
 # Список уведомлений
 class NotificationListView(generics.ListAPIView):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return self.request.user.notifications.all()
+        return inbox(self.request.user.id, self.request.query_params)
+
+def inbox(user_id, params):
+    # Keyset-paginated newest first on (user, [is_read,] created_at, id).
+    queryset = Notification.objects.filter(user_id=user_id)
+    if params.get('unread') in ('1', 'true'):
+        queryset = queryset.filter(is_read=False)
+    return queryset
+
+def unread_notifications(user_id):
+    row = Stats.objects.filter(user_id=user_id).values_list('unread_notifications', flat=True).first()
+    if row is None:
+        stats.reconcile(user_ids=[user_id], include_global=False)
+        row = Stats.objects.get(user_id=user_id).unread_notifications
+    return row
+
+class UnreadNotificationCountView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({"unread": unread_notifications(request.user.id)})
+
+class MarkNotificationsReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        up_to = request.data.get('up_to')
+        queryset = Notification.objects.filter(user=request.user, is_read=False)
+        if up_to not in (None, ''):
+            try:
+                queryset = queryset.filter(id__lte=int(up_to))
+            except (TypeError, ValueError):
+                raise ValidationError({"up_to": "Должно быть целым числом"})
+        with transaction.atomic():
+            # One UPDATE; rows already read are not matched, so concurrent calls never double-count.
+            marked = queryset.update(is_read=True)
+            stats.bump(request.user.id, -marked, fields=['unread_notifications'], include_global=False)
+        return Response({"marked": marked, "unread": unread_notifications(request.user.id)})
+
+class NotificationStreamTicketView(APIView):
+    """A single-use ticket for opening the notification stream from EventSource (api/streams.py)."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ticket = streams.issue_ticket(request.user.id)
+        return Response({"ticket": ticket, "expires_in": streams.ticket_ttl()}, status=201)
 
 class AddFavoriteView(generics.CreateAPIView):
     serializer_class = FavoriteSerializer
@@ -193,20 +313,18 @@ class AddFavoriteView(generics.CreateAPIView):
 class RecommendationsView(generics.ListAPIView):
     serializer_class = EquipmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Ordered on Recommendation columns so the (user, score, item) index serves the sort.
+    keyset_ordering = ('-recommendation_score', '-recommended_item')
 
     def get_queryset(self):
-        user = self.request.user
-        user_tags = Tag.objects.filter(items__in=[f.item for f in user.favorites.all()])
-        favorite_ids = [f.item.id for f in user.favorites.all()]
-
-        recommended = Equipment.objects.filter(
-            Q(tags__in=user_tags) | Q(id__in=favorite_ids)
+        # Precomputed by `manage.py build_recommendations`, refreshed when favourites change.
+        return Equipment.objects.with_related().filter(
+            recommendations__user=self.request.user
         ).annotate(
-            like_count=Count('likes'),
-            avg_rating=Avg('ratings__value')
-        ).order_by('-avg_rating')
+            recommendation_score=F('recommendations__score'),
+            recommended_item=F('recommendations__item'),
+        )
 
-        return recommended.distinct()
 class CommentLikeView(generics.CreateAPIView):
     serializer_class = CommentLikeSerializer
     permission_classes = [IsAuthenticated]
@@ -227,39 +345,49 @@ class CommentListView(generics.ListAPIView):
     serializer_class = CommentSerializer
 
     def get_queryset(self):
+        # Likes and ratings come from the counters kept on Comment (api/signals.py).
         item_id = self.kwargs['item_id']
-        return Comment.objects.filter(item_id=item_id).annotate(
-            like_count=Count('likes'),
-            avg_rating=Avg('ratings__value')
-        )
+        return Comment.objects.with_related().filter(item_id=item_id)
 
 class UserStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, id):
-        user = User.objects.get(id=id)
-        data = {
-            "objects_count": Equipment.objects.filter(author=user).count(),
-            "comments_count": Comment.objects.filter(author=user).count(),
-            "likes_count": Like.objects.filter(user=user).count(),
-            "ratings_count": Rating.objects.filter(user=user).count(),
-            "follows_count": Follow.objects.filter(follower=user).count(),
-        }
-        return Response(data)
+        row = Stats.objects.filter(user_id=id).first()
+        if row is None:
+            get_object_or_404(User, id=id)
+            stats.reconcile(user_ids=[id], include_global=False)
+            row = Stats.objects.get(user_id=id)
+        return Response(user_stats(row))
+
+def user_stats(row):
+    return {
+        "objects_count": row.items,
+        "comments_count": row.comments,
+        "likes_count": row.likes,
+        "ratings_count": row.ratings,
+        "follows_count": row.follows,
+    }
 
 class GlobalStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        data = {
-            "total_objects": Equipment.objects.count(),
-            "total_comments": Comment.objects.count(),
-            "total_likes": Like.objects.count(),
-            "total_ratings": Rating.objects.count(),
-            "total_users": User.objects.count(),
-            "categories_count": Category.objects.count()
-        }
-        return Response(data)
+        row = Stats.objects.filter(user__isnull=True).first()
+        if row is None:
+            stats.reconcile(user_ids=[])
+            row = Stats.objects.get(user__isnull=True)
+        return Response(global_stats(row))
+
+def global_stats(row):
+    return {
+        "total_objects": row.items,
+        "total_comments": row.comments,
+        "total_likes": row.likes,
+        "total_ratings": row.ratings,
+        "total_users": row.users,
+        "categories_count": row.categories
+    }
 
 class SubscribeTagView(generics.CreateAPIView):
     serializer_class = TagSubscriptionSerializer
@@ -5,3 +5,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'catalog.settings')
 
 application = get_asgi_application()
+
+# The hot reads run on the event loop (api/async_views.py, ASYNC_READ_VIEWS = None).
+from api import async_views  # noqa: E402
+
+async_views.serve_asgi()
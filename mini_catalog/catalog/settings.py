@@ -36,7 +36,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticatedOrReadOnly",
@@ -45,10 +45,17 @@ REST_FRAMEWORK = {
         "django_filters.rest_framework.DjangoFilterBackend",
         "rest_framework.filters.SearchFilter",
         "rest_framework.filters.OrderingFilter",
-    )
+    ),
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.KeysetPagination",
+    "PAGE_SIZE": 20,
 }
 
+# Users resolved from JWTs, cached per process (api/authentication.py)
+JWT_USER_CACHE_SIZE = 10000
+JWT_USER_CACHE_TTL = 60
+
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +68,49 @@ MIDDLEWARE = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Request timing (api/middleware.py): Server-Timing header and Prometheus
+# histograms at /metrics. Only METRICS_ALLOWED_IPS (REMOTE_ADDR) may read
+# /metrics; add the Prometheus host's address, or set None to open it to all.
+PERFORMANCE_METRICS = True
+SERVER_TIMING_HEADER = True
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Background tasks (api/tasks.py), processed by `python manage.py run_worker`
+TASKS_RUN_EAGERLY = False
+# Past this many pending tasks enqueue() rejects new ones (503 in the API).
+TASKS_QUEUE_MAX = 10000
+TASKS_QUEUE_COUNT_TTL = 5
+TASKS_MAX_ATTEMPTS = 5
+TASKS_LEASE_SECONDS = 300
+NOTIFY_CHUNK_SIZE = 1000
+# Processes rendering image variants (api/images.py), per worker; None: CPU count.
+IMAGE_RENDER_WORKERS = None
+
+# Following feed (api/feed.py): items of authors with more followers than this
+# are merged in when the feed is read instead of being copied to every follower.
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+# Latest items copied into a timeline when following someone.
+FEED_BACKFILL = 50
+
+# Notification SSE stream (api/streams.py); needs an ASGI server.
+# POLL_INTERVAL picks up rows written by other processes (None: in-process only).
+NOTIFICATION_STREAM_HEARTBEAT = 15
+NOTIFICATION_STREAM_POLL_INTERVAL = 2.0
+# Lifetime of the single-use tickets EventSource opens the stream with; kept in
+# CACHES, which has to be shared when the API runs in several processes.
+NOTIFICATION_STREAM_TICKET_TTL = 30
+
+# Async GET handlers for the hot read paths (api/async_views.py). None: on when
+# served through catalog/asgi.py, off under WSGI, where every async view would
+# need an event loop of its own. True or False forces either path.
+ASYNC_READ_VIEWS = None
+
+# Audit log (api/history.py): 'sync' writes each History row in the request,
+# 'buffered' batches them in memory and may lose the last batch on a crash.
+HISTORY_WRITE_MODE = 'sync'
+HISTORY_BUFFER_SIZE = 500
+HISTORY_FLUSH_INTERVAL = 2.0
+
 ROOT_URLCONF = 'catalog.urls'
 
 TEMPLATES = [
@@ -84,13 +134,51 @@ WSGI_APPLICATION = 'catalog.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning for concurrent use (api/sqlite.py), run on every new connection.
+SQLITE_PRAGMAS = (
+    'PRAGMA busy_timeout = 5000; PRAGMA synchronous = normal; '
+    'PRAGMA mmap_size = 268435456; PRAGMA cache_size = -32000'
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock up front, where busy_timeout applies.
+            'transaction_mode': 'IMMEDIATE',
+            # After busy_timeout, so that switching the journal mode waits for other connections too.
+            'init_command': f'{SQLITE_PRAGMAS}; PRAGMA journal_mode = wal',
+        },
     }
 }
 
+# Optional read/write split (api/routers.py): reads through a second,
+# query-only connection to the same file. Compare with `manage.py benchmark_sqlite`.
+SQLITE_READ_CONNECTION = False
+READ_DATABASE = 'read'
+if SQLITE_READ_CONNECTION:
+    DATABASES[READ_DATABASE] = {
+        **DATABASES['default'],
+        # journal_mode is a property of the file, set by the writers.
+        'OPTIONS': {'init_command': f'PRAGMA query_only = ON; {SQLITE_PRAGMAS}'},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['api.routers.ReadWriteRouter']
+
+# Local memory is per process; with several workers use a shared backend
+# such as django.core.cache.backends.filebased.FileBasedCache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Anonymous /api/items/ responses (api/cache.py)
+CATALOG_CACHE_TIMEOUT = 300
+# Favourite ids / tag ids personalising /api/items/ for signed-in users
+INTERESTS_CACHE_TIMEOUT = 600
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 